@@ -11,11 +11,17 @@ from PyQt6.QtWidgets import (
     QStyledItemDelegate, QFormLayout, QStyleOptionButton
 )
 from PyQt6.QtGui import QIcon, QFont, QTextCursor, QPixmap
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QSettings
 from widgets import *
-from dialogs import PreseedDialog, KernelSelectionDialog, AdvancedCompressionDialog
-from threads import CommandRunnerThread
-from package_models import PackageListModel, PackageSortFilterProxyModel
+from dialogs import PreseedDialog, KernelSelectionDialog, AdvancedCompressionDialog, IsoBrowserDialog
+from threads import SessionCommandThread, BackgroundExecutor, format_exit_status
+from chroot_env import mounts_under
+from package_models import PackageListModel, PackageSortFilterProxyModel, SEARCH_SYNTAX_HELP
+from dpkg_status import read_installed_kernels, read_installed_packages
+from iso9660 import read_iso_info
+from iso_selection import Selection
+from build_journal import JOURNAL_FILE, RECOVERY_COMMAND, BuildJournal, tree_signature
+from iso_pipeline import IsoPipelineMixin
 
 # ... (ElidedLabel, CommandRunnerThread, PackageListModel, PackageSortFilterProxyModel, PreseedDialog, KernelSelectionDialog, AdvancedCompressionDialog classes - no changes needed)
 
@@ -47,7 +53,7 @@ class CenteredIconDelegate(QStyledItemDelegate):
             super().paint(painter, option, index)
 
 
-class ISOMasterBuilderApp(QWidget):
+class ISOMasterBuilderApp(IsoPipelineMixin, QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("ISO Master Builder")
@@ -55,9 +61,49 @@ class ISOMasterBuilderApp(QWidget):
         self.setGeometry(100, 100, 850, 700)
         self.setMinimumSize(850, 700) # Make sure the UI doesn't become too small
 
+        # Blocking work (xorriso queries, dpkg database reads) runs here.
+        self.executor = BackgroundExecutor(parent=self)
+        self.busy_indicator = BusyIndicator(self.executor)
+        self.iso_info_task = None
+        self.verification_tasks = []
+        self.verification_status = {}
+        # Extraction is done once the root filesystem and both trees' snapshots are.
+        self.extraction_steps_pending = 0
+        self.extraction_thread = None
+        self.package_removal_thread = None
+        self.iso_recreation_thread = None
+        # What this build has done so far, on disk in the working folder so
+        # it can be resumed after a crash or restart.
+        self.journal = None
+        # (packages, first index, recover) of a removal to pick up at step 6.
+        self.resumed_removal = None
+        # Reuse the root filesystem image an interrupted rebuild finished.
+        self.resume_recreation = False
+
         self.working_folder_path = QLineEdit()
         self.iso_file_path = QLineEdit()
+        # Optional SHA256SUMS the ISO is checked against while it is extracted.
+        self.checksums_file_path = QLineEdit()
+        self.checksums_file_path.setPlaceholderText("SHA256SUMS (optional)")
+        # Glob patterns limiting what is extracted; the rest stays in the ISO
+        # and is carried over from it when the ISO is rebuilt.
+        self.extract_include_edit = QLineEdit()
+        self.extract_include_edit.setPlaceholderText("Everything (e.g. casper/ boot/ isolinux/ .disk/)")
+        self.extract_exclude_edit = QLineEdit()
+        self.extract_exclude_edit.setPlaceholderText("Nothing (e.g. pool/ dists/ *.deb)")
+        self.extraction_selection = None
         self.extracted_iso_path = ""
+        # Where chroot commands run: the unpacked live filesystem, or the ISO
+        # tree itself when the ISO has no squashfs root.
+        self.root_fs_path = ""
+        self.unsquash_progress = None
+        self.mksquash_progress = None
+        self.mksquash_image = None
+        # Path of the squashfs inside the ISO, and its byte offset in the ISO
+        # file when it is unpacked without being extracted first.
+        self.live_root_image = None
+        self.live_root_offset = None
+        self.live_root_size = None
         self.output_iso_path = ElidedLabel()  # Use ElidedLabel
         self.output_iso_path.setToolTip("Full path will be shown here") #tooltip
 
@@ -74,6 +120,7 @@ class ISOMasterBuilderApp(QWidget):
         self.step3_progress_bar = QProgressBar()
         self.step3_progress_bar.setRange(0, 100)
         self.step3_progress_bar.setValue(0)
+        self.step3_verification_label = QLabel("")
 
         self.step4_terminal_label = QLabel("Customize ISO (Chroot Terminal)")
         self.step4_terminal = QPlainTextEdit()
@@ -84,10 +131,13 @@ class ISOMasterBuilderApp(QWidget):
         self.step4_terminal_command_history = []
         self.step4_terminal_history_index = -1
         self.command_runner_thread = None
+        # One shell in the chroot serves every terminal command.
+        self.chroot_session = None
 
         self.step5_group = QGroupBox("Step 5: Package Removal")
         self.step5_search_line_edit = QLineEdit()
-        self.step5_search_line_edit.setPlaceholderText("Search packages...")
+        self.step5_search_line_edit.setPlaceholderText("Search packages... (e.g. section:doc size>10M !priority:required)")
+        self.step5_search_line_edit.setToolTip(SEARCH_SYNTAX_HELP)
         self.step5_search_line_edit.textChanged.connect(self._filter_package_list)
         self.step5_package_table_view = QTableView()
         self.step5_package_model = PackageListModel()
@@ -95,13 +145,15 @@ class ISOMasterBuilderApp(QWidget):
         self.step5_proxy_model.setSourceModel(self.step5_package_model)
         self.step5_package_table_view.setModel(self.step5_proxy_model)
         self.step5_package_table_view.setItemDelegate(CenteredIconDelegate())  # Center checkboxes
-        self.step5_package_table_view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        # Column widths come from a sample of rows; see _populate_package_list.
+        self.step5_package_table_view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Interactive)
+        self.step5_package_table_view.horizontalHeader().setResizeContentsPrecision(200)
+        self.step5_package_table_view.horizontalHeader().setStretchLastSection(True)
         self.step5_package_table_view.setSortingEnabled(True)
 
         self.step6_group = QGroupBox("Step 6: Confirm Package Removal")
         self.step6_progress_label = QLabel("Package Removal Progress:")
-        self.step6_package_list_display = QPlainTextEdit()
-        self.step6_package_list_display.setReadOnly(True)
+        self.step6_package_list_display = LogView()
         self.step6_package_list_display.setFont(QFont("Courier New", 10)) #monospaced
         self.step6_progress_bar = QProgressBar()  # Progress bar for removal
         self.step6_progress_bar.setRange(0, 100)
@@ -112,8 +164,7 @@ class ISOMasterBuilderApp(QWidget):
         self.step7_progress_bar = QProgressBar()
         self.step7_progress_bar.setRange(0, 100)
         self.step7_progress_bar.setValue(0)
-        self.step7_log_display = QPlainTextEdit()
-        self.step7_log_display.setReadOnly(True)
+        self.step7_log_display = LogView()
         self.step7_log_display.setFont(QFont("Courier New", 10))
 
         self.step8_group = QGroupBox("Step 8: Finished")
@@ -144,6 +195,8 @@ class ISOMasterBuilderApp(QWidget):
         self.kernel_button.clicked.connect(self.show_kernel_selection)
 
         self.advanced_compression_button = QPushButton("Advanced Compression...")
+        self.modify_iso_checkbox = QCheckBox("Only write changed files (copy the rest from the original ISO)")
+        self.modify_iso_checkbox.setChecked(True)
         self.advanced_compression_button.clicked.connect(self.show_advanced_compression_dialog)
         self.compression_options = {}  # Store compression options
 
@@ -171,12 +224,20 @@ class ISOMasterBuilderApp(QWidget):
         iso_file_layout.addWidget(QLabel("ISO File:"))
         iso_file_layout.addWidget(self.iso_file_path)
         iso_file_layout.addWidget(QPushButton("Browse", clicked=self.browse_iso_file))
+        iso_file_layout.addWidget(QPushButton("Contents...", clicked=self.show_iso_browser))
         iso_info_layout.addLayout(iso_file_layout)
+        checksums_layout = QHBoxLayout()
+        checksums_layout.addWidget(QLabel("Checksums:"))
+        checksums_layout.addWidget(self.checksums_file_path)
+        checksums_layout.addWidget(QPushButton("Browse", clicked=self.browse_checksums_file))
+        iso_info_layout.addLayout(checksums_layout)
 
         iso_info_grid = QFormLayout()  # Use QFormLayout for labels and fields
         iso_info_grid.addRow("ISO Name:", self.iso_name_edit)
         iso_info_grid.addRow("Version:", self.iso_version_edit)
         iso_info_grid.addRow("Architecture:", self.iso_architecture_edit)
+        iso_info_grid.addRow("Extract only:", self.extract_include_edit)
+        iso_info_grid.addRow("Leave in ISO:", self.extract_exclude_edit)
 
         boot_logo_layout = QHBoxLayout()
         self.boot_logo_label = QLabel("Boot Logo:")
@@ -197,6 +258,7 @@ class ISOMasterBuilderApp(QWidget):
         step3_layout = QVBoxLayout()
         step3_layout.addWidget(self.step3_progress_label)
         step3_layout.addWidget(self.step3_progress_bar)
+        step3_layout.addWidget(self.step3_verification_label)
         self.step3_group.setLayout(step3_layout)
 
 
@@ -245,6 +307,7 @@ class ISOMasterBuilderApp(QWidget):
         step7_layout.addWidget(self.preseed_button) #advanced options
         step7_layout.addWidget(self.kernel_button) #kernel
         step7_layout.addWidget(self.advanced_compression_button)  # Advanced compression
+        step7_layout.addWidget(self.modify_iso_checkbox)
         step7_layout.addWidget(self.step7_progress_bar)
         step7_layout.addWidget(self.step7_log_display)
 
@@ -274,6 +337,7 @@ class ISOMasterBuilderApp(QWidget):
         button_layout = QHBoxLayout()
         button_layout.addWidget(self.back_button)
         button_layout.addStretch(1)  # Center the buttons
+        button_layout.addWidget(self.busy_indicator)
         button_layout.addWidget(self.next_button)
         main_layout.addLayout(button_layout)  # Add button layout to main layout
 
@@ -307,43 +371,36 @@ class ISOMasterBuilderApp(QWidget):
                 print(f"Preseed file selected: {self.preseed_file}")
 
     def show_kernel_selection(self):
-        if not self.extracted_iso_path or not os.path.exists(self.extracted_iso_path):
+        # The packages live in the unpacked root filesystem, not in the ISO tree around it.
+        if not self.root_fs_path or not os.path.exists(self.root_fs_path):
             QMessageBox.warning(self, "Warning", "ISO must be extracted before selecting a kernel.")
             return
-        # Find available kernels in the chroot environment
-        command = ["chroot", self.extracted_iso_path, "apt", "list", "--installed", "linux-image-*"]
-        try:
-
-            result = subprocess.run(command, capture_output=True, text=True, check=True)
-            output_lines = result.stdout.strip().split('\n')
-            available_kernels = []
-            current_kernel = ""
-            for line in output_lines:
-                if "linux-image-" in line and "installed" in line:
-                    parts = line.split()
-                    kernel_name_parts = parts[0].split("/")
-                    kernel_name = kernel_name_parts[0] if kernel_name_parts else "Unknown"
-                    version_part = parts[1].split(",")
-                    version = version_part[0] if version_part else "Unknown"
-                    available_kernels.append({'name': kernel_name, 'version': version, 'remove': False})  # Add 'remove' key
-
-            if not available_kernels:
-                QMessageBox.information(self, "Kernel Selection", "No alternative kernels found.")
-                return
-
-            dialog = KernelSelectionDialog(available_kernels, current_kernel, self)
-            if dialog.exec():
-                selected_kernel = dialog.get_selected_kernel()
-                if selected_kernel:
-                     print(f"Selected Kernel: {selected_kernel}")
-                     #implement kernel install.
+        # Read the kernels straight from the tree's dpkg database, off the GUI thread
+        self.kernel_button.setEnabled(False)
+        task = self.executor.submit(read_installed_kernels, self.root_fs_path, description="Looking for kernels")
+        task.finished.connect(self._show_kernel_dialog)
+        task.failed.connect(self._kernel_lookup_failed)
+        task.done.connect(lambda: self.kernel_button.setEnabled(True))
+
+    def _show_kernel_dialog(self, available_kernels):
+        current_kernel = ""
+
+        if not available_kernels:
+            QMessageBox.information(self, "Kernel Selection", "No alternative kernels found.")
+            return
 
-        except FileNotFoundError:
-            QMessageBox.critical(self, "Error", "'chroot' or 'apt' command not found.")
-        except subprocess.CalledProcessError as e:
-            QMessageBox.critical(self, "Error", f"Error listing kernels: {e.stderr}")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"An unexpected error occurred: {e}")
+        dialog = KernelSelectionDialog(available_kernels, current_kernel, self)
+        if dialog.exec():
+            selected_kernel = dialog.get_selected_kernel()
+            if selected_kernel:
+                 print(f"Selected Kernel: {selected_kernel}")
+                 #implement kernel install.
+
+    def _kernel_lookup_failed(self, error):
+        if isinstance(error, OSError):
+            QMessageBox.critical(self, "Error", f"Error reading dpkg status database: {error}")
+        else:
+            QMessageBox.critical(self, "Error", f"An unexpected error occurred: {error}")
 
 
     def show_advanced_compression_dialog(self):
@@ -358,6 +415,99 @@ class ISOMasterBuilderApp(QWidget):
         if folder_path:
             self.working_folder_path.setText(folder_path)
             print(f"Working folder selected: {folder_path}")
+            self.offer_resume(folder_path)
+
+    def offer_resume(self, working_folder=None):
+        """Offer to resume the unfinished build in `working_folder`, by default the last one used."""
+        if working_folder is None:
+            working_folder = QSettings("MasterLinux", "MasterLinux").value("last_working_folder", "")
+        if not working_folder:
+            return False
+        journal_path = os.path.join(working_folder, ".masterlinux", JOURNAL_FILE)
+        if not os.path.exists(journal_path):
+            return False
+        try:
+            journal = BuildJournal(journal_path)
+            if not journal.resumable():
+                return False
+            warnings = journal.check()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Cannot resume the build in {working_folder}: {e}")
+            return False
+        message = f"An unfinished build was found in {working_folder}:\n\n{journal.summary()}"
+        if warnings:
+            message += "\n\n" + "\n".join(warnings)
+        reply = QMessageBox.question(self, "Resume Build", message + "\n\nResume it where it stopped?",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                     QMessageBox.StandardButton.Yes)
+        if reply != QMessageBox.StandardButton.Yes:
+            return False
+        self._resume_build(working_folder, journal)
+        return True
+
+    def _resume_build(self, working_folder, journal):
+        # Everything extraction set up comes back from the journal, so the
+        # build carries on without extracting again.
+        settings, layout = journal.data['settings'], journal.data['layout']
+        self.journal = journal
+        self.working_folder_path.setText(working_folder)
+        self.iso_file_path.setText(settings['iso_file'])
+        self.checksums_file_path.setText(settings['checksums_file'])
+        self.extract_include_edit.setText(settings['include'])
+        self.extract_exclude_edit.setText(settings['exclude'])
+        self._populate_iso_info()
+        self.extracted_iso_path = layout['extracted_iso_path']
+        self.root_fs_path = layout['root_fs_path']
+        self.live_root_image = layout['live_root_image']
+        self.live_root_offset = layout['live_root_offset']
+        self.live_root_size = layout['live_root_size']
+        self.extraction_selection = Selection(*layout['selection']) if layout['selection'] else None
+        print(f"Resuming the build in {working_folder}")
+
+        start = journal.first_incomplete_stage()
+        recreation = journal.recreation_settings()
+        if start is not None:
+            packages = [command[-1] for _name, command in journal.stages()]
+            self.resumed_removal = (packages, start, journal.interrupted_stage() is not None)
+            self.go_to_step(6)
+        elif recreation is not None:
+            self.output_iso_path.setText(recreation['output'])
+            self.output_iso_path.setToolTip(recreation['output'])
+            self.compression_options = recreation['compression']
+            self.modify_iso_checkbox.setChecked(recreation['modify_iso'])
+            self.boot_logo_path = recreation['boot_logo']
+            self.preseed_file = recreation['preseed']
+            self.resume_recreation = True
+            self.go_to_step(7)
+            self._start_iso_recreation()
+        else:
+            self.go_to_step(4)
+
+    def _start_journal(self):
+        # A new extraction starts a new build and supersedes the old journal.
+        settings = {"iso_file": self.iso_file_path.text(), "checksums_file": self.checksums_file_path.text(),
+                    "include": self.extract_include_edit.text(), "exclude": self.extract_exclude_edit.text()}
+        self.journal = None
+        try:
+            journal_path = self._cache_path(JOURNAL_FILE)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            journal = BuildJournal(journal_path)
+            journal.start(settings)
+        except (OSError, ValueError) as e:
+            print(f"Could not start the build journal, this build cannot be resumed: {e}")
+            return
+        self.journal = journal
+        QSettings("MasterLinux", "MasterLinux").setValue("last_working_folder", self.working_folder_path.text())
+
+    def _journal_record(self, event, *args, **kwargs):
+        # Without the journal the build only loses the ability to resume.
+        if self.journal is None:
+            return
+        try:
+            getattr(self.journal, event)(*args, **kwargs)
+        except OSError as e:
+            print(f"Could not update the build journal: {e}")
 
     def browse_iso_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select Base ISO File", "", "ISO Files (*.iso)")
@@ -369,6 +519,19 @@ class ISOMasterBuilderApp(QWidget):
             print(f"ISO file selected: {file_path}")
             self._populate_iso_info()
 
+    def show_iso_browser(self):
+        dialog = IsoBrowserDialog(self.iso_file_path.text(), self.executor, self)
+        if dialog.exec() and dialog.selected_iso() and dialog.selected_iso() != self.iso_file_path.text():
+            self.iso_file_path.setText(dialog.selected_iso())
+            print(f"ISO file selected: {dialog.selected_iso()}")
+            self._populate_iso_info()
+
+    def browse_checksums_file(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Select SHA256SUMS File", "",
+                                                   "Checksum Files (SHA256SUMS *.sha256 *.txt);;All Files (*)")
+        if file_path:
+            self.checksums_file_path.setText(file_path)
+
     def browse_output_iso_location(self):
         default_filename = f"custom-{os.path.basename(self.iso_file_path.text())}"  # Suggest a filename
         default_path = os.path.join(os.path.dirname(self.iso_file_path.text()), default_filename) #Join dirname and filename
@@ -386,46 +549,35 @@ class ISOMasterBuilderApp(QWidget):
         if not self.iso_file_path.text():
             return
 
-        try:
-            iso_path =  self.iso_file_path.text()
-            # Corrected xorriso command for older versions
-            cmd = ["xorriso", "-indev", iso_path, "-report_system_area", "as_mkisofs"] 
-            process = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            output_lines = process.stdout.strip().split('\n')
-            iso_name = "Unknown"
-            iso_version = "Unknown"
-            iso_architecture = "Unknown"
-
-            for line in output_lines:
-                if line.startswith("System_ID="):
-                    iso_name = line.split("=")[1].strip("'")
-                elif line.startswith("Application_ID="):
-                    iso_version = line.split("=")[1].strip("'")
-
-            # Try to get architecture from the filename (fallback)
-            filename = os.path.basename(iso_path).lower()
-            if "amd64" in filename:
-                iso_architecture = "amd64"
-            elif "i386" in filename:
-                iso_architecture = "i386"
-            elif "arm64" in filename:
-                iso_architecture = "arm64"
-            # Add more architecture checks as needed
-
-            self.iso_name_edit.setText(iso_name)
-            self.iso_version_edit.setText(iso_version)
-            self.iso_architecture_edit.setText(iso_architecture)
-            print("ISO information extracted.")
-
-        except FileNotFoundError:
-            QMessageBox.critical(self, "Error", "xorriso command not found. Is it installed?")
-            print("Error: xorriso not found.")
-        except subprocess.CalledProcessError as e:
-            QMessageBox.critical(self, "Error", f"Error extracting ISO info with xorriso: {e.stderr}")
-            print(f"Error running xorriso: {e.stderr}")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"An unexpected error occurred during ISO info extraction: {e}")
-            print(f"Unexpected error during ISO info extraction: {e}")
+        # A newer ISO selection supersedes a query still in flight.
+        if self.iso_info_task is not None:
+            self.iso_info_task.cancel()
+        self.iso_info_task = self.executor.submit(read_iso_info, self.iso_file_path.text(),
+                                                  description="Reading ISO information")
+        self.iso_info_task.finished.connect(self._iso_info_ready)
+        self.iso_info_task.failed.connect(self._iso_info_failed)
+
+    def _iso_info_ready(self, iso_info):
+        self.iso_name_edit.setText(iso_info['label'] or "Unknown")
+        self.iso_version_edit.setText(iso_info['version'] or "Unknown")
+        self.iso_architecture_edit.setText(iso_info['architecture'] or "Unknown")
+        details = [iso_info['description'] or iso_info['label'] or ""]
+        if iso_info['publisher']:
+            details.append(f"Publisher: {iso_info['publisher']}")
+        if iso_info['created']:
+            details.append(f"Created: {iso_info['created']:%Y-%m-%d %H:%M}")
+        boot = ", ".join(dict.fromkeys(record['platform'] for record in iso_info['boot_records']))
+        details.append(f"Boot: {boot or 'not bootable'}")
+        self.iso_name_edit.setToolTip("\n".join(detail for detail in details if detail))
+        print("ISO information extracted.")
+
+    def _iso_info_failed(self, error):
+        if isinstance(error, ValueError):
+            QMessageBox.critical(self, "Error", f"Not a usable ISO image: {error}")
+            print(f"Error reading ISO info: {error}")
+        else:
+            QMessageBox.critical(self, "Error", f"An unexpected error occurred during ISO info extraction: {error}")
+            print(f"Unexpected error during ISO info extraction: {error}")
 
     def go_to_next_step(self):
         if self.current_step == 1:
@@ -514,7 +666,7 @@ class ISOMasterBuilderApp(QWidget):
             self.step5_refresh_button.show()
             self.next_button.show()
             self.back_button.show()
-            if not self.step5_package_model._package_data: #don't repopulate on back
+            if not self.step5_package_model.rowCount(): #don't repopulate on back
                self.refresh_package_list()
 
 
@@ -528,13 +680,16 @@ class ISOMasterBuilderApp(QWidget):
             self.next_button.setEnabled(False) #disable until removal is done.
             self.back_button.setEnabled(False) #disable until removal is done.
 
-            packages_to_remove = self.step5_package_model.get_checked_packages()
+            # A resumed build picks up the removal it was interrupted in.
+            resumed, self.resumed_removal = self.resumed_removal, None
+            packages_to_remove, resume_at, recover = resumed or (self.step5_package_model.get_checked_packages(),
+                                                                 None, False)
             self.step6_package_list_display.clear()
             if packages_to_remove:
-                self.step6_package_list_display.setPlainText("Packages to be removed:\n" + "\n".join(packages_to_remove))
-                self._execute_package_removal(packages_to_remove)  # Start removal in the background
+                self.step6_package_list_display.set_text("Packages to be removed:\n" + "\n".join(packages_to_remove))
+                self._execute_package_removal(packages_to_remove, resume_at, recover)  # Start removal in the background
             else: #should not happen, but handle for robustness.
-                self.step6_package_list_display.setPlainText("No packages selected for removal.")
+                self.step6_package_list_display.set_text("No packages selected for removal.")
                 self.step6_progress_label.hide()  # Hide if no removal
                 self.step6_progress_bar.hide()
                 self.next_button.setEnabled(True) #reenable next.
@@ -560,66 +715,6 @@ class ISOMasterBuilderApp(QWidget):
         self.current_step = step_number
 
 
-    def _extract_iso(self):
-
-        working_folder = self.working_folder_path.text()
-        iso_file = self.iso_file_path.text()
-        self.extracted_iso_path = os.path.join(working_folder, "extracted_iso")
-        os.makedirs(self.extracted_iso_path, exist_ok=True)
-
-        self.step3_progress_bar.setValue(0)
-        self.step3_progress_bar.setFormat("%p% - Extracting...")
-
-        try:
-            iso_file = self.iso_file_path.text()
-             # Use xorriso for extraction
-            cmd = ["xorriso", "-osirrox", "on", "-indev", iso_file, "-extract", "/", self.extracted_iso_path]
-
-            self.extraction_thread = CommandRunnerThread(cmd)
-            self.extraction_thread.command_output_signal.connect(self._process_extraction_output)
-            self.extraction_thread.command_finished_signal.connect(self._extraction_finished)
-            self.extraction_thread.start()
-
-
-        except FileNotFoundError:
-            self.step3_progress_bar.setFormat("Error")
-            QMessageBox.critical(self, "Error", "xorriso command not found. Is it installed?")
-            print("Error: xorriso not found.")
-        except Exception as e:
-            self.step3_progress_bar.setFormat("Error")
-            QMessageBox.critical(self, "Error", f"Unexpected error during ISO extraction: {e}")
-            print(f"Unexpected error during ISO extraction: {e}")
-
-
-    def _process_extraction_output(self, output_text):
-        # Parse xorriso output to estimate progress (very basic)
-        if "filesினாலும்" in output_text: #basic percentage
-            try:
-                parts = output_text.split("filesினாலும்")
-                numbers = parts[0].split()
-                current = int(numbers[-2].strip())
-                total = int(numbers[-1].strip())
-                percent = int((current / total) * 100)
-                self.step3_progress_bar.setValue(percent)
-
-            except (ValueError, IndexError):
-                pass  # Ignore parsing errors, just update the text
-
-
-    def _extraction_finished(self, return_code):
-        if return_code == 0:
-            self.step3_progress_bar.setValue(100)
-            self.step3_progress_bar.setFormat("%p% - Extraction Complete")
-            print("ISO extraction completed.")
-            self.back_button.setEnabled(True) #reenable now
-            self.next_button.setEnabled(True)
-
-        else:
-            self.step3_progress_bar.setFormat("Extraction Failed")
-            QMessageBox.critical(self, "Error", "ISO extraction failed.")
-            print("Error during ISO extraction.")
-            self.back_button.setEnabled(True) #extraction failed, still allow going back.
-
     def browse_boot_logo(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select Boot Logo Image", "", "Images (*.png *.jpg *.bmp *.svg *.xpm)")
         if file_path:
@@ -672,6 +767,7 @@ class ISOMasterBuilderApp(QWidget):
                 "  help - Show this help message\n"
                 "  ls   - List files in current directory (in chroot)\n"
                 "  pwd  - Print working directory (in chroot)\n"
+                "  cd <dir> - Change directory (kept for later commands, like variables)\n"
                 "  echo <text> - Print text (in chroot)\n"
                 "  exit - Exit chroot environment\n"
                 "  apt update - Update package lists (requires sudo)\n"
@@ -691,23 +787,29 @@ class ISOMasterBuilderApp(QWidget):
         self._append_to_terminal("\n")  # Newline before output
         self.terminal_stop_button.show()
 
-        # Run commands with chroot
-        self.command_runner_thread = CommandRunnerThread([command], chroot_path=self.extracted_iso_path)
+        # Run commands in the persistent chroot shell
+        self.command_runner_thread = SessionCommandThread(self._get_chroot_session(), command)
         self.command_runner_thread.command_output_signal.connect(self._append_to_terminal)
+        self.command_runner_thread.command_completed_signal.connect(self._command_execution_completed)
         self.command_runner_thread.command_finished_signal.connect(self._command_execution_finished)
         self.command_runner_thread.start()
 
+    def _command_execution_completed(self, return_code, wall_time):
+        # Like a shell, only failures are worth a line.
+        if return_code != 0:
+            self._append_to_terminal(f"[{format_exit_status(return_code, wall_time)}]\n")
+
     def _command_execution_finished(self, return_code):
         self.terminal_stop_button.hide()
         self._append_to_terminal("$ ")  # Ready for next command
         self.command_runner_thread = None
-        # You might want to handle non-zero return codes here (errors)
 
     def stop_terminal_command(self):
         if self.command_runner_thread and self.command_runner_thread.isRunning():
+            # The whole process group gets SIGTERM, then SIGKILL; the prompt
+            # comes back once it has actually exited.
             self.command_runner_thread.stop_thread()
-            self._append_to_terminal("\n[Command stopped by user]\n$ ")
-            self.command_runner_thread = None #cleanup
+            self._append_to_terminal("\n[Stopping command...]\n")
 
     def _append_to_terminal(self, text):
         self.step4_terminal.moveCursor(QTextCursor.MoveOperation.End)
@@ -739,46 +841,25 @@ class ISOMasterBuilderApp(QWidget):
         self._populate_package_list() #call the actual population.
 
     def _populate_package_list(self):
-
         self.step5_package_model.clear_package_statuses()
-        self.step5_package_model._package_data = []  # Clear existing data
-        self.step5_package_model.layoutAboutToBeChanged.emit()
-
-
-        command = ["apt", "list", "--installed"]
         self._append_to_terminal(f"\nFetching installed package list...\n")
 
-
-        self.package_list_thread = CommandRunnerThread(command, chroot_path = self.extracted_iso_path)
-        self.package_list_thread.command_output_signal.connect(self._process_package_list_output)
-        self.package_list_thread.command_finished_signal.connect(self._package_list_fetch_finished)
-        self.package_list_thread.start()
-
-
-    def _process_package_list_output(self, output_text):
-        lines = output_text.strip().split('\n')
-        package_data = []
-        for line in lines:
-            if "/" in line and ",now" in line:  # Check for valid package lines
-                parts = line.split()
-                package_name_parts = parts[0].split("/")
-                package_name = package_name_parts[0]
-                version_part = parts[1].split(",")
-                version = version_part[0]
-                # Add to data with 'remove' flag initially set to False
-                package_data.append({'name': package_name, 'version': version, 'remove': False})
-        if package_data:
-            # Append to existing data
-            current_data = self.step5_package_model._package_data
-            updated_data = current_data + package_data
-            self.step5_package_model._package_data = updated_data
-            self.step5_package_model.layoutChanged.emit() #refresh UI
-            self.step5_proxy_model.invalidateFilter()  # Apply filter
-
-    def _package_list_fetch_finished(self, return_code):
+        # Parse var/lib/dpkg/status in a worker instead of running apt in the chroot
+        task = self.executor.submit(read_installed_packages, self.root_fs_path,
+                                    description="Reading installed packages")
+        task.finished.connect(self._package_list_ready)
+        task.failed.connect(self._package_list_failed)
+        task.done.connect(lambda: self.step5_refresh_button.setEnabled(True))
+
+    def _package_list_ready(self, package_data):
+        # Rows stream into the view in chunks; size the columns from the first one.
+        self.step5_package_model.set_row_source(package_data)
+        self.step5_package_table_view.resizeColumnsToContents()
         self._append_to_terminal(f"\nPackage list fetched.\n")
-        self.step5_refresh_button.setEnabled(True)
-        self.package_list_thread = None #cleanup.
+
+    def _package_list_failed(self, error):
+        QMessageBox.critical(self, "Error", f"Error reading dpkg status database: {error}")
+        self.step5_package_model.set_packages([])
 
     def _filter_package_list(self, filter_text):
         self.step5_proxy_model.setFilterText(filter_text)
@@ -787,7 +868,9 @@ class ISOMasterBuilderApp(QWidget):
           # Confirmation is now handled in go_to_step(6)
           self.go_to_step(6)
 
-    def _execute_package_removal(self, packages_to_remove):
+    def _execute_package_removal(self, packages_to_remove, resume_at=None, recover=False):
+        # `resume_at` continues a journalled removal from that package;
+        # `recover` first repairs what an interrupted one left behind.
         if not packages_to_remove:
             self._package_removal_finished(0)  # Treat empty list as success
             return
@@ -798,10 +881,27 @@ class ISOMasterBuilderApp(QWidget):
 
         # Remove packages one by one to handle dependencies gracefully
         self.packages_to_remove_queue = packages_to_remove.copy()  # Create a copy
-        self.current_package_index = 0
+        self.current_package_index = resume_at or 0
         self.total_packages_to_remove = len(self.packages_to_remove_queue)
-        self.step6_progress_bar.setValue(0) #reset
-        self._remove_next_package()
+        self.step6_progress_bar.setValue(int((self.current_package_index / self.total_packages_to_remove) * 100))
+        if resume_at is None:
+            self._journal_record("start_stages", [(f"Remove {package}", self._removal_command(package))
+                                                  for package in packages_to_remove])
+        if recover:
+            self._recover_interrupted_stage()
+        else:
+            self._remove_next_package()
+
+    def _removal_command(self, package):
+        return ["apt-get", "purge", "-y", package] #single package at a time.
+
+    def _recover_interrupted_stage(self):
+        self.step6_package_list_display.append_text("\n$ " + " ".join(RECOVERY_COMMAND) + "\n")
+        self.package_removal_thread = SessionCommandThread(self._get_chroot_session(), RECOVERY_COMMAND)
+        self.package_removal_thread.command_output_signal.connect(self._process_package_removal_output)
+        self.package_removal_thread.command_completed_signal.connect(self._report_package_removal_status)
+        self.package_removal_thread.command_finished_signal.connect(lambda _return_code: self._remove_next_package())
+        self.package_removal_thread.start()
 
 
     def _remove_next_package(self):
@@ -811,15 +911,19 @@ class ISOMasterBuilderApp(QWidget):
             return
 
         package = self.packages_to_remove_queue[self.current_package_index]
-        remove_command = ["apt-get", "purge", "-y", package] #single package at a time.
+        remove_command = self._removal_command(package)
 
-        self.package_removal_thread = CommandRunnerThread(remove_command, chroot_path = self.extracted_iso_path)
+        self._journal_record("stage_started", self.current_package_index)
+        self.package_removal_thread = SessionCommandThread(self._get_chroot_session(), remove_command)
         self.package_removal_thread.command_output_signal.connect(self._process_package_removal_output)
+        self.package_removal_thread.command_completed_signal.connect(self._report_package_removal_status)
         self.package_removal_thread.command_finished_signal.connect(self._handle_single_package_removal)
         self.package_removal_thread.start()
 
     def _handle_single_package_removal(self, return_code):
           package_removed = self.packages_to_remove_queue[self.current_package_index]
+          self._journal_record("stage_finished", self.current_package_index, return_code,
+                               self.package_removal_thread.wall_time, tree_signature(self.root_fs_path))
 
           if return_code == 0:
             self.step5_package_model.set_package_status(package_removed, 'removed') #success
@@ -836,10 +940,11 @@ class ISOMasterBuilderApp(QWidget):
           self._remove_next_package()
 
 
+    def _report_package_removal_status(self, return_code, wall_time):
+        self.step6_package_list_display.append_text(f"[{format_exit_status(return_code, wall_time)}]\n")
+
     def _process_package_removal_output(self, output_text):
-        self.step6_package_list_display.moveCursor(QTextCursor.MoveOperation.End)
-        self.step6_package_list_display.insertPlainText(output_text)
-        self.step6_package_list_display.moveCursor(QTextCursor.MoveOperation.End)
+        self.step6_package_list_display.append_text(output_text)
 
 
     def _package_removal_finished(self, return_code):
@@ -847,108 +952,11 @@ class ISOMasterBuilderApp(QWidget):
         self.step6_confirm_button.hide() #Hide confirm button.
         self.step6_progress_label.hide() #Hide progress label
         self._append_to_terminal("\nPackage removal process finished.\n")
-        self.step6_package_list_display.insertPlainText("\nPackage removal process finished.\n")
+        self.step6_package_list_display.append_text("\nPackage removal process finished.\n")
         self.next_button.setEnabled(True) #reenable next
         self.back_button.setEnabled(True) #reenable back
 
 
-    def _start_iso_recreation(self):
-        output_iso_file = self.output_iso_path.text()
-
-        if not output_iso_file:
-            QMessageBox.warning(self, "Warning", "Please specify output ISO path.")
-            return
-        if not self.compression_options: #default
-             self.compression_options = {"method": "gzip", "level": 6, "threads": 0, "custom_command":""}
-
-        self.step7_log_display.clear()
-        self.step7_progress_bar.setValue(0)
-        self.step7_progress_bar.show()
-        self.step7_log_display.show()
-        self.next_button.setEnabled(False)
-        self.back_button.setEnabled(False)
-        # Prepare xorriso command
-        cmd = [
-            "xorriso",
-            "-as", "mkisofs",
-            "-r",  # Rational Rock (Rock Ridge)
-            "-J",  # Joliet
-            "-joliet-long", #long filenames
-            "-l", #allow full 31 character filenames for Rock Ridge.
-            "-cache-inodes",
-            "-follow-links",
-            "-o", output_iso_file,
-            "-b", "isolinux/isolinux.bin",  # Boot image (adjust path if needed)
-            "-c", "isolinux/boot.cat",      # Boot catalog (adjust path)
-            "-no-emul-boot",
-            "-boot-load-size", "4",
-            "-boot-info-table",
-            "-isohybrid-mbr", "isolinux/isohdpfx.bin", #isohybrid for BIOS.
-            "-eltorito-alt-boot", #for EFI booting
-            "-e", "boot/grub/efi.img", #use efi image.
-            "-no-emul-boot", #required after -e
-            "-isohybrid-gpt-basdat", #mark data partition as bootable in GPT
-        ]
-
-        # Add preseed file if specified
-        if self.preseed_file and os.path.exists(self.preseed_file):
-             cmd.extend(["-preseed", self.preseed_file])
-
-        # Add boot logo if specified
-        if self.boot_logo_path and os.path.exists(self.boot_logo_path):
-            # Copy the boot logo into the extracted ISO
-            isolinux_dir = os.path.join(self.extracted_iso_path, "isolinux")
-            if not os.path.exists(isolinux_dir):
-                os.makedirs(isolinux_dir)
-
-            logo_dest_path = os.path.join(isolinux_dir, "logo.png")  # Use a consistent name
-            try:
-                shutil.copy(self.boot_logo_path, logo_dest_path)
-
-                # Modify isolinux.cfg (or syslinux.cfg) to use the logo
-                cfg_path = os.path.join(isolinux_dir, "isolinux.cfg")
-                if os.path.exists(cfg_path):
-                    with open(cfg_path, "a") as cfg_file:
-                         cfg_file.write(f"\nUI vesamenu.c32\nMENU BACKGROUND logo.png\n") #modify config
-            except (shutil.Error, IOError) as e:
-                 QMessageBox.warning(self, "Warning", f"Failed to copy boot logo: {e}")
-
-        # Add the source directory (extracted ISO content)
-        cmd.append(self.extracted_iso_path)
-
-        self.iso_recreation_thread = CommandRunnerThread(cmd, working_dir = self.working_folder_path.text()) #command, and the working directory
-        self.iso_recreation_thread.command_output_signal.connect(self._process_iso_recreation_output)
-        self.iso_recreation_thread.command_finished_signal.connect(self._iso_recreation_finished)
-        self.iso_recreation_thread.start()
-
-    def _process_iso_recreation_output(self, output_text):
-        self.step7_log_display.moveCursor(QTextCursor.MoveOperation.End)
-        self.step7_log_display.insertPlainText(output_text)
-        self.step7_log_display.moveCursor(QTextCursor.MoveOperation.End)
-
-        # Attempt to extract progress percentage from xorriso output
-        if "xorriso : UPDATE : " in output_text:
-            try:
-                parts = output_text.split(":")
-                progress_part = parts[-1].strip() #get last element
-                if progress_part.endswith("%"):
-                   progress_percent = int(progress_part[:-1]) #remove %
-                   self.step7_progress_bar.setValue(progress_percent)
-            except (ValueError, IndexError):
-                pass
-
-    def _iso_recreation_finished(self, return_code):
-        self.next_button.setEnabled(True)
-        self.back_button.setEnabled(True)
-        if return_code == 0:
-             self.step7_progress_bar.setValue(100)
-        else:
-           self.step7_progress_bar.setFormat("ISO Creation Failed") #indicate error.
-           QMessageBox.critical(self, "Error", f"ISO re-creation failed with return code {return_code}.") #show return code
-
-        self.iso_recreation_thread = None
-        self.go_to_step(8) #go to the final step regardless.
-
     def _open_output_folder(self):
         output_dir = os.path.dirname(self.output_iso_path.text())
         if os.path.exists(output_dir):
@@ -964,16 +972,38 @@ class ISOMasterBuilderApp(QWidget):
             QMessageBox.warning(self, "Warning", "Output folder does not exist.")
 
     def delete_temp_files(self):
-        if self.extracted_iso_path and os.path.exists(self.extracted_iso_path):
+        self._close_chroot_session()
+        # The unpacked root filesystem lives next to the ISO tree, or is it.
+        temp_dirs = [path for path in dict.fromkeys((self.root_fs_path, self.extracted_iso_path))
+                     if path and os.path.exists(path)]
+        # Never recurse into a bind mount of the host's /dev or similar.
+        leftover_mounts = [mount for path in temp_dirs for mount in mounts_under(path)]
+        if leftover_mounts:
+            QMessageBox.warning(self, "Warning", "Not deleting temporary files, these are still mounted:\n" + "\n".join(leftover_mounts))
+            return
+        for path in temp_dirs:
             try:
-                shutil.rmtree(self.extracted_iso_path)
-                print(f"Deleted temporary directory: {self.extracted_iso_path}")
+                shutil.rmtree(path)
+                print(f"Deleted temporary directory: {path}")
             except Exception as e:
                 QMessageBox.warning(self, "Warning", f"Failed to delete temporary files: {e}")
+        self._journal_record("remove")
+
+    def closeEvent(self, event):
+        # Kill running queries and commands instead of waiting for them on exit.
+        self.executor.shutdown()
+        for thread in (self.extraction_thread, self.command_runner_thread,
+                       self.package_removal_thread, self.iso_recreation_thread):
+            if thread is not None and thread.isRunning():
+                thread.stop_thread()
+                thread.wait()
+        self._close_chroot_session()
+        super().closeEvent(event)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     app.setStyle("Fusion")  # A more modern style
     iso_builder_app = ISOMasterBuilderApp()
     iso_builder_app.show()
+    iso_builder_app.offer_resume()
     sys.exit(app.exec())
\ No newline at end of file
@@ -1,174 +1,14 @@
 # threads.py
-# threads.py
-from PyQt6.QtCore import QThread, pyqtSignal
-import subprocess
-
-class CommandRunnerThread(QThread):
-    command_output_signal = pyqtSignal(str)
-    command_finished_signal = pyqtSignal(int)
-
-    def __init__(self, command, working_dir=None, chroot_path=None, is_dpkg_command=False):
-        super().__init__()
-        self.command = command
-        self.working_dir = working_dir
-        self.chroot_path = chroot_path
-        self.is_running = True
-        self.is_dpkg_command = is_dpkg_command
-
-    def run(self):
-        process = None
-        try:
-            if self.chroot_path:
-                if isinstance(self.command, str):
-                    command_list = self.command.split()
-                else:
-                    command_list = self.command
-
-                if self.is_dpkg_command:
-                    final_command = ["chroot", self.chroot_path] + command_list
-                else:
-                    final_command = ["chroot", self.chroot_path] + ["/bin/bash", "-c"] + [' '.join(command_list)]
-            else:
-                final_command = self.command
-
-            if isinstance(final_command, str):
-                final_command = final_command.split()
-
-            process = subprocess.Popen(final_command,
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE,
-                                       text=True,
-                                       cwd=self.working_dir,
-                                       bufsize=1,
-                                       universal_newlines=True)
-
-            while self.is_running:
-                output_line = process.stdout.readline()
-                if output_line == '' and process.poll() is not None:
-                    break
-                if output_line:
-                    self.command_output_signal.emit(output_line)
-
-            stdout, stderr = process.communicate()
-            if stdout:
-                self.command_output_signal.emit(stdout)
-            if stderr:
-                self.command_output_signal.emit(stderr)
-
-            self.command_finished_signal.emit(process.returncode)
-
-        except FileNotFoundError as e:
-            self.command_output_signal.emit(f"Error: Command not found: {e}\n")
-            self.command_finished_signal.emit(-1)
-
-        except Exception as e:
-            self.command_output_signal.emit(f"Error executing command: {e}\n")
-            self.command_finished_signal.emit(-1)
-
-    def stop_thread(self):
-        self.is_running = False
+from threads import CommandRunnerThread, SessionCommandThread
 
 # package_models.py
-from PyQt6.QtCore import QModelIndex, QAbstractTableModel, Qt, QSortFilterProxyModel
-from PyQt6.QtWidgets import QApplication
-
-class PackageListModel(QAbstractTableModel):
-    def __init__(self, package_data=None):
-        super().__init__()
-        self._package_data = package_data if package_data else []
-        self._headers = ["Remove", "Package Name", "Version"]
-
-    def rowCount(self, parent=QModelIndex()):
-        return len(self._package_data)
-
-    def columnCount(self, parent=QModelIndex()):
-        return len(self._headers)
-
-    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
-        if not index.isValid():
-            return None
-
-        row = index.row()
-        col = index.column()
-
-        if role == Qt.ItemDataRole.DisplayRole:
-            if col == 1:
-                return self._package_data[row].get('name', '')
-            elif col == 2:
-                return self._package_data[row].get('version', '')
-        elif role == Qt.ItemDataRole.CheckStateRole:
-            if col == 0:
-                return Qt.CheckState.Checked if self._package_data[row].get('remove') else Qt.CheckState.Unchecked
-        elif role == Qt.ItemDataRole.BackgroundRole:
-            status = self._package_data[row].get('status')
-            if status == 'removing':
-                return QApplication.palette().color(QApplication.palette().ColorRole.Mid)
-            elif status == 'removed':
-                return QApplication.palette().color(QApplication.palette().ColorRole.Highlight)
-            elif status == 'error':
-                return QApplication.palette().color(QApplication.palette().ColorRole.Window)
-
-        return None
-
-    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
-        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
-            return self._headers[section]
-        return super().headerData(section, orientation, role)
-
-    def flags(self, index):
-        if not index.isValid():
-            return Qt.ItemFlag.NoItemFlags
-
-        if index.column() == 0:
-            return Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemIsEnabled
-        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
-
-    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
-        if not index.isValid():
-            return False
-
-        if role == Qt.ItemDataRole.CheckStateRole and index.column() == 0:
-            self._package_data[index.row()]['remove'] = (value == Qt.CheckState.Checked)
-            self.dataChanged.emit(index, index, [Qt.ItemDataRole.CheckStateRole])
-            return True
-        return False
-
-    def get_checked_packages(self):
-        return [pkg['name'] for pkg in self._package_data if pkg.get('remove')]
-
-    def set_package_status(self, package_name, status):
-        for row in range(len(self._package_data)):
-            if self._package_data[row]['name'] == package_name:
-                self._package_data[row]['status'] = status
-
-    def clear_package_statuses(self):
-        for pkg in self._package_data:
-            if 'status' in pkg:
-                pkg.pop('status')
-
-class PackageSortFilterProxyModel(QSortFilterProxyModel):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.filter_text = ""
-
-    def setFilterText(self, text):
-        self.filter_text = text.lower()
-        self.invalidateFilter()
-
-    def filterAcceptsRow(self, source_row, source_parent):
-        if not self.filter_text:
-            return True
-
-        model = self.sourceModel()
-        package_name = model._package_data[source_row]['name']
-        package_version = model._package_data[source_row]['version']
-        return (self.filter_text in package_name.lower() or
-                self.filter_text in package_version.lower())
+from package_models import PackageListModel, PackageSortFilterProxyModel, SEARCH_SYNTAX_HELP
 
 # dialogs.py
 import os
-from PyQt6.QtWidgets import QDialog, QVBoxLayout, QLabel, QLineEdit, QPushButton, QHBoxLayout, QFormLayout, QComboBox, QSpinBox, QGroupBox, QListView
+from PyQt6.QtWidgets import QDialog, QVBoxLayout, QLabel, QLineEdit, QPushButton, QHBoxLayout, QFormLayout, QListView
 from PyQt6.QtWidgets import QFileDialog
+from dialogs import AdvancedCompressionDialog, IsoBrowserDialog
 
 class PreseedDialog(QDialog):
     def __init__(self, parent=None):
@@ -233,71 +73,9 @@ class KernelSelectionDialog(QDialog):
     def get_selected_kernel(self):
         selected_indexes = self.kernel_list.selectedIndexes()
         if selected_indexes:
-            return self.kernel_model._package_data[selected_indexes[0].row()]['name']
+            return self.kernel_model.package_name(selected_indexes[0].row())
         return None
 
-class AdvancedCompressionDialog(QDialog):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Advanced Compression Options")
-
-        self.compression_method_combo = QComboBox()
-        self.compression_method_combo.addItems(["gzip", "xz", "bzip2", "lzma", "Custom"])
-        self.compression_method_combo.currentIndexChanged.connect(self.toggle_custom_options)
-
-        self.custom_options_group = QGroupBox("Custom Options")
-        self.custom_command = QLineEdit()
-        self.custom_command.setPlaceholderText("e.g., xz -9 --threads=0")
-        custom_layout = QVBoxLayout()
-        custom_layout.addWidget(QLabel("Custom Command:"))
-        custom_layout.addWidget(self.custom_command)
-        self.custom_options_group.setLayout(custom_layout)
-        self.custom_options_group.hide()
-
-        self.level_spinbox = QSpinBox()
-        self.level_spinbox.setRange(0, 9)
-        self.level_spinbox.setValue(6)
-
-        self.threads_spinbox = QSpinBox()
-        self.threads_spinbox.setRange(0, os.cpu_count())
-        self.threads_spinbox.setValue(0)
-        self.threads_spinbox.setToolTip("0 = All available cores")
-
-        layout = QFormLayout()
-        layout.addRow("Compression Method:", self.compression_method_combo)
-        layout.addRow("Compression Level:", self.level_spinbox)
-        layout.addRow("Threads", self.threads_spinbox)
-        layout.addRow(self.custom_options_group)
-
-        button_box = QHBoxLayout()
-        ok_button = QPushButton("OK")
-        ok_button.clicked.connect(self.accept)
-        cancel_button = QPushButton("Cancel")
-        cancel_button.clicked.connect(self.reject)
-        button_box.addWidget(ok_button)
-        button_box.addWidget(cancel_button)
-        layout.addRow(button_box)
-        self.setLayout(layout)
-
-    def toggle_custom_options(self):
-        if self.compression_method_combo.currentText() == "Custom":
-            self.custom_options_group.show()
-        else:
-            self.custom_options_group.hide()
-
-    def get_compression_options(self):
-        method = self.compression_method_combo.currentText()
-        level = self.level_spinbox.value()
-        threads = self.threads_spinbox.value()
-        custom_command = self.custom_command.text() if method == "Custom" else ""
-
-        return {
-            "method": method,
-            "level": level,
-            "threads": threads,
-            "custom_command": custom_command,
-        }
-
 # widgets.py
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import QLabel, QStyledItemDelegate, QStyleOptionButton
@@ -350,14 +128,28 @@ import shutil
 import platform
 from PyQt6.QtWidgets import (QApplication, QWidget, QPushButton, QLabel, QLineEdit,
                              QFileDialog, QGroupBox, QVBoxLayout, QHBoxLayout,
-                             QFormLayout, QProgressBar, QPlainTextEdit, QCheckBox,
+                             QFormLayout, QProgressBar, QCheckBox,
                              QMessageBox, QTableView, QTabWidget,
-                             QHeaderView, QStackedWidget, QComboBox)
-from PyQt6.QtGui import QIcon, QFont, QPixmap, QTextCursor
-from PyQt6.QtCore import Qt
+                             QHeaderView, QStackedWidget, QComboBox, QSpinBox)
+from PyQt6.QtGui import QIcon, QFont, QPixmap
+from PyQt6.QtCore import Qt, QSettings
+from dpkg_status import read_installed_kernels, read_installed_packages
+from apt_index import load_index, release_date
+from threads import BackgroundExecutor, format_exit_status
+from chroot_env import mounts_under
+from widgets import BusyIndicator, LogView
+from iso9660 import read_iso_info
+from stage_cache import DEFAULT_BUDGET, StageCache, stage_keys
+from iso_selection import Selection
+from build_journal import JOURNAL_FILE, RECOVERY_COMMAND, BuildJournal, tree_signature
+from iso_pipeline import IsoPipelineMixin
+from package_models import format_size
+
+
+class ISOMasterBuilderApp(IsoPipelineMixin, QWidget):
+    # Rows measured when sizing the package table columns.
+    PACKAGE_COLUMN_SAMPLE_ROWS = 200
 
-
-class ISOMasterBuilderApp(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("ISO Master Builder")
@@ -365,9 +157,54 @@ class ISOMasterBuilderApp(QWidget):
         self.setGeometry(100, 100, 850, 700)
         self.setMinimumSize(850, 700)
 
+        # Blocking work (xorriso queries, package database reads) runs here.
+        self.executor = BackgroundExecutor(parent=self)
+        self.busy_indicator = BusyIndicator(self.executor)
+        self.iso_info_task = None
+        self.verification_tasks = []
+        self.verification_status = {}
+        # Extraction is done once the root filesystem and both trees' snapshots are.
+        self.extraction_steps_pending = 0
+        self.package_fetch_tasks = []
+        self.extraction_thread = None
+        self.modification_thread = None
+        self.iso_recreation_thread = None
+        # What this build has done so far, on disk in the working folder so
+        # it can be resumed after a crash or restart.
+        self.journal = None
+        # Reuse the root filesystem image an interrupted rebuild finished.
+        self.resume_recreation = False
+        # One shell in the chroot serves every modification command.
+        self.chroot_session = None
+        # Trees left by earlier step-4 stages; the keys of this run's stages,
+        # empty when its results cannot be cached.
+        self.stage_cache = None
+        self.stage_keys = []
+
         self.working_folder_path = QLineEdit()
         self.iso_file_path = QLineEdit()
+        # Optional SHA256SUMS the ISO is checked against while it is extracted.
+        self.checksums_file_path = QLineEdit()
+        self.checksums_file_path.setPlaceholderText("SHA256SUMS (optional)")
+        # Glob patterns limiting what is extracted; the rest stays in the ISO
+        # and is carried over from it when the ISO is rebuilt.
+        self.extract_include_edit = QLineEdit()
+        self.extract_include_edit.setPlaceholderText("Everything (e.g. casper/ boot/ isolinux/ .disk/)")
+        self.extract_exclude_edit = QLineEdit()
+        self.extract_exclude_edit.setPlaceholderText("Nothing (e.g. pool/ dists/ *.deb)")
+        self.extraction_selection = None
         self.extracted_iso_path = ""
+        # Where chroot commands run: the unpacked live filesystem, or the ISO
+        # tree itself when the ISO has no squashfs root.
+        self.root_fs_path = ""
+        self.unsquash_progress = None
+        self.mksquash_progress = None
+        self.mksquash_image = None
+        # Path of the squashfs inside the ISO, and its byte offset in the ISO
+        # file when it is unpacked without being extracted first.
+        self.live_root_image = None
+        self.live_root_offset = None
+        self.live_root_size = None
         self.output_iso_path = ElidedLabel()
         self.output_iso_path.setToolTip("Full path will be shown here")
 
@@ -381,13 +218,13 @@ class ISOMasterBuilderApp(QWidget):
         self.step3_progress_bar = QProgressBar()
         self.step3_progress_bar.setRange(0, 100)
         self.step3_progress_bar.setValue(0)
+        self.step3_verification_label = QLabel("")
 
         self.step7_boot_group = QGroupBox("Step 7: Re-create ISO")
         self.step7_progress_bar = QProgressBar()
         self.step7_progress_bar.setRange(0, 100)
         self.step7_progress_bar.setValue(0)
-        self.step7_log_display = QPlainTextEdit()
-        self.step7_log_display.setReadOnly(True)
+        self.step7_log_display = LogView()
         self.step7_log_display.setFont(QFont("Courier New", 10))
 
         self.step8_group = QGroupBox("Step 8: Finished")
@@ -407,8 +244,11 @@ class ISOMasterBuilderApp(QWidget):
         self.kernel_button.clicked.connect(self.show_kernel_selection)
 
         self.advanced_compression_button = QPushButton("Advanced Compression...")
+        self.modify_iso_checkbox = QCheckBox("Only write changed files (copy the rest from the original ISO)")
+        self.modify_iso_checkbox.setChecked(True)
         self.advanced_compression_button.clicked.connect(self.show_advanced_compression_dialog)
         self.compression_options = {}
+        self.available_package_index = None
 
         self._init_ui()
         self._init_step_visibility()
@@ -430,12 +270,25 @@ class ISOMasterBuilderApp(QWidget):
         self.iso_file_line = QLineEdit()
         iso_file_layout.addWidget(self.iso_file_line)
         iso_file_layout.addWidget(QPushButton("Browse", clicked=self.browse_iso_file))
-        iso_file_group.setLayout(iso_file_layout)
+        iso_file_layout.addWidget(QPushButton("Contents...", clicked=self.show_iso_browser))
+        checksums_layout = QHBoxLayout()
+        checksums_layout.addWidget(QLabel("Checksums:"))
+        checksums_layout.addWidget(self.checksums_file_path)
+        checksums_layout.addWidget(QPushButton("Browse", clicked=self.browse_checksums_file))
+        iso_group_layout = QVBoxLayout()
+        iso_group_layout.addLayout(iso_file_layout)
+        iso_group_layout.addLayout(checksums_layout)
+        extraction_layout = QFormLayout()
+        extraction_layout.addRow("Extract only:", self.extract_include_edit)
+        extraction_layout.addRow("Leave in ISO:", self.extract_exclude_edit)
+        iso_group_layout.addLayout(extraction_layout)
+        iso_file_group.setLayout(iso_group_layout)
 
         self.step3_group = QGroupBox("Step 3: ISO Extraction")
         step3_layout = QVBoxLayout()
         step3_layout.addWidget(self.step3_progress_label)
         step3_layout.addWidget(self.step3_progress_bar)
+        step3_layout.addWidget(self.step3_verification_label)
         self.step3_group.setLayout(step3_layout)
 
         self.step4_group = QGroupBox("Step 4: Customize System Configuration")
@@ -468,6 +321,7 @@ class ISOMasterBuilderApp(QWidget):
         step4_removal_layout = QVBoxLayout()
         self.step4_removal_search_line_edit = QLineEdit()
         self.step4_removal_search_line_edit.setPlaceholderText("Search packages to remove...")
+        self.step4_removal_search_line_edit.setToolTip(SEARCH_SYNTAX_HELP)
         step4_removal_layout.addWidget(self.step4_removal_search_line_edit)
         self.step4_removal_package_table_view = QTableView()
         step4_removal_layout.addWidget(self.step4_removal_package_table_view)
@@ -497,6 +351,7 @@ class ISOMasterBuilderApp(QWidget):
         applications_sub_tab_layout = QVBoxLayout()
         self.step4_applications_search_line_edit = QLineEdit()
         self.step4_applications_search_line_edit.setPlaceholderText("Search for applications to add...")
+        self.step4_applications_search_line_edit.setToolTip(SEARCH_SYNTAX_HELP)
         applications_sub_tab_layout.addWidget(self.step4_applications_search_line_edit)
         self.step4_applications_package_table_view = QTableView()
         applications_sub_tab_layout.addWidget(self.step4_applications_package_table_view)
@@ -522,6 +377,15 @@ class ISOMasterBuilderApp(QWidget):
         self.step4_autoremove_checkbox = QCheckBox("Run apt autoremove to clean up")
         self.step4_autoremove_checkbox.setChecked(True)
         settings_tab_layout.addRow("Run apt autoremove:", self.step4_autoremove_checkbox)
+        self.step4_stage_cache_checkbox = QCheckBox("Start from the results of earlier builds where the stages match")
+        self.step4_stage_cache_checkbox.setChecked(True)
+        settings_tab_layout.addRow("Reuse Cached Stages:", self.step4_stage_cache_checkbox)
+        self.step4_stage_cache_budget_spinbox = QSpinBox()
+        self.step4_stage_cache_budget_spinbox.setRange(1, 1024)
+        self.step4_stage_cache_budget_spinbox.setSuffix(" GiB")
+        self.step4_stage_cache_budget_spinbox.setValue(DEFAULT_BUDGET >> 30)
+        self.step4_stage_cache_budget_spinbox.setToolTip("Least recently used stages are removed beyond this size.")
+        settings_tab_layout.addRow("Stage Cache Size:", self.step4_stage_cache_budget_spinbox)
         self.step4_settings_tab.setLayout(settings_tab_layout)
         self.step4_tab_widget.addTab(self.step4_settings_tab, "System Settings")
 
@@ -546,6 +410,7 @@ class ISOMasterBuilderApp(QWidget):
         step7_layout.addWidget(self.preseed_button)
         step7_layout.addWidget(self.kernel_button)
         step7_layout.addWidget(self.advanced_compression_button)
+        step7_layout.addWidget(self.modify_iso_checkbox)
         step7_layout.addWidget(self.step7_progress_bar)
         step7_layout.addWidget(self.step7_log_display)
 
@@ -571,6 +436,7 @@ class ISOMasterBuilderApp(QWidget):
         button_layout = QHBoxLayout()
         button_layout.addWidget(self.back_button)
         button_layout.addStretch(1)
+        button_layout.addWidget(self.busy_indicator)
         button_layout.addWidget(self.next_button)
 
         main_layout = QVBoxLayout()
@@ -596,43 +462,35 @@ class ISOMasterBuilderApp(QWidget):
                 print(f"Preseed file selected: {self.preseed_file}")
 
     def show_kernel_selection(self):
-        if not self.extracted_iso_path or not os.path.exists(self.extracted_iso_path):
+        # The packages live in the unpacked root filesystem, not in the ISO tree around it.
+        if not self.root_fs_path or not os.path.exists(self.root_fs_path):
             QMessageBox.warning(self, "Warning", "ISO must be extracted before selecting a kernel.")
             return
 
-        command = ["chroot", self.extracted_iso_path, "apt-get", "list", "--installed", "linux-image-*"]
-        try:
+        self.kernel_button.setEnabled(False)
+        task = self.executor.submit(read_installed_kernels, self.root_fs_path, description="Looking for kernels")
+        task.finished.connect(self._show_kernel_dialog)
+        task.failed.connect(self._kernel_lookup_failed)
+        task.done.connect(lambda: self.kernel_button.setEnabled(True))
 
-            result = subprocess.run(command, capture_output=True, text=True, check=True)
-            output_lines = result.stdout.strip().split('\n')
-            available_kernels = []
-            current_kernel = ""
-
-            for line in output_lines:
-                if "linux-image-" in line and "installed" in line:
-                    parts = line.split()
-                    kernel_name_parts = parts[0].split("/")
-                    kernel_name = kernel_name_parts[0] if kernel_name_parts else "Unknown"
-                    version_part = parts[1].split(",")
-                    version = version_part[0] if version_part else "Unknown"
-                    available_kernels.append({'name': kernel_name, 'version': version, 'remove': False})
-
-            if not available_kernels:
-                QMessageBox.information(self, "Kernel Selection", "No alternative kernels found.")
-                return
+    def _show_kernel_dialog(self, available_kernels):
+        current_kernel = ""
 
-            dialog = KernelSelectionDialog(available_kernels, current_kernel, self)
-            if dialog.exec():
-                selected_kernel = dialog.get_selected_kernel()
-                if selected_kernel:
-                    print(f"Selected Kernel: {selected_kernel}")
+        if not available_kernels:
+            QMessageBox.information(self, "Kernel Selection", "No alternative kernels found.")
+            return
 
-        except FileNotFoundError:
-            QMessageBox.critical(self, "Error", "'chroot' or 'apt' command not found.")
-        except subprocess.CalledProcessError as e:
-            QMessageBox.critical(self, "Error", f"Error listing kernels: {e.stderr}")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"An unexpected error occurred: {e}")
+        dialog = KernelSelectionDialog(available_kernels, current_kernel, self)
+        if dialog.exec():
+            selected_kernel = dialog.get_selected_kernel()
+            if selected_kernel:
+                print(f"Selected Kernel: {selected_kernel}")
+
+    def _kernel_lookup_failed(self, error):
+        if isinstance(error, OSError):
+            QMessageBox.critical(self, "Error", f"Error reading dpkg status database: {error}")
+        else:
+            QMessageBox.critical(self, "Error", f"An unexpected error occurred: {error}")
 
     def show_advanced_compression_dialog(self):
         dialog = AdvancedCompressionDialog(self)
@@ -645,6 +503,99 @@ class ISOMasterBuilderApp(QWidget):
         if folder_path:
             self.working_folder_path.setText(folder_path)
             print(f"Working folder selected: {folder_path}")
+            self.offer_resume(folder_path)
+
+    def offer_resume(self, working_folder=None):
+        """Offer to resume the unfinished build in `working_folder`, by default the last one used."""
+        if working_folder is None:
+            working_folder = QSettings("MasterLinux", "MasterLinux").value("last_working_folder", "")
+        if not working_folder:
+            return False
+        journal_path = os.path.join(working_folder, ".masterlinux", JOURNAL_FILE)
+        if not os.path.exists(journal_path):
+            return False
+        try:
+            journal = BuildJournal(journal_path)
+            if not journal.resumable():
+                return False
+            warnings = journal.check()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Cannot resume the build in {working_folder}: {e}")
+            return False
+        message = f"An unfinished build was found in {working_folder}:\n\n{journal.summary()}"
+        if warnings:
+            message += "\n\n" + "\n".join(warnings)
+        reply = QMessageBox.question(self, "Resume Build", message + "\n\nResume it where it stopped?",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                     QMessageBox.StandardButton.Yes)
+        if reply != QMessageBox.StandardButton.Yes:
+            return False
+        self._resume_build(working_folder, journal)
+        return True
+
+    def _resume_build(self, working_folder, journal):
+        # Everything extraction set up comes back from the journal, so the
+        # build carries on without extracting again.
+        settings, layout = journal.data['settings'], journal.data['layout']
+        self.journal = journal
+        self.working_folder_path.setText(working_folder)
+        self.iso_file_line.setText(settings['iso_file'])
+        self.iso_file_path.setText(settings['iso_file'])
+        self.checksums_file_path.setText(settings['checksums_file'])
+        self.extract_include_edit.setText(settings['include'])
+        self.extract_exclude_edit.setText(settings['exclude'])
+        self._populate_iso_info()
+        self.extracted_iso_path = layout['extracted_iso_path']
+        self.root_fs_path = layout['root_fs_path']
+        self.live_root_image = layout['live_root_image']
+        self.live_root_offset = layout['live_root_offset']
+        self.live_root_size = layout['live_root_size']
+        self.extraction_selection = Selection(*layout['selection']) if layout['selection'] else None
+        print(f"Resuming the build in {working_folder}")
+
+        start = journal.first_incomplete_stage()
+        recreation = journal.recreation_settings()
+        if start is not None:
+            self.go_to_step(4)
+            self._execute_package_modifications(journal.stages(), start, journal.interrupted_stage() is not None)
+        elif recreation is not None:
+            self.output_iso_path.setText(recreation['output'])
+            self.output_iso_path.setToolTip(recreation['output'])
+            self.compression_options = recreation['compression']
+            self.modify_iso_checkbox.setChecked(recreation['modify_iso'])
+            self.boot_logo_path = recreation['boot_logo']
+            self.preseed_file = recreation['preseed']
+            self.resume_recreation = True
+            self.go_to_step(7)
+            self._start_iso_recreation()
+        else:
+            self.go_to_step(4)
+
+    def _start_journal(self):
+        # A new extraction starts a new build and supersedes the old journal.
+        settings = {"iso_file": self.iso_file_path.text(), "checksums_file": self.checksums_file_path.text(),
+                    "include": self.extract_include_edit.text(), "exclude": self.extract_exclude_edit.text()}
+        self.journal = None
+        try:
+            journal_path = self._cache_path(JOURNAL_FILE)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            journal = BuildJournal(journal_path)
+            journal.start(settings)
+        except (OSError, ValueError) as e:
+            print(f"Could not start the build journal, this build cannot be resumed: {e}")
+            return
+        self.journal = journal
+        QSettings("MasterLinux", "MasterLinux").setValue("last_working_folder", self.working_folder_path.text())
+
+    def _journal_record(self, event, *args, **kwargs):
+        # Without the journal the build only loses the ability to resume.
+        if self.journal is None:
+            return
+        try:
+            getattr(self.journal, event)(*args, **kwargs)
+        except OSError as e:
+            print(f"Could not update the build journal: {e}")
 
     def browse_iso_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select ISO File", "", "ISO Files (*.iso)")
@@ -657,6 +608,20 @@ class ISOMasterBuilderApp(QWidget):
             print(f"ISO file selected: {file_path}")
             self._populate_iso_info()
 
+    def show_iso_browser(self):
+        dialog = IsoBrowserDialog(self.iso_file_path.text(), self.executor, self)
+        if dialog.exec() and dialog.selected_iso() and dialog.selected_iso() != self.iso_file_path.text():
+            self.iso_file_line.setText(dialog.selected_iso())
+            self.iso_file_path.setText(dialog.selected_iso())
+            print(f"ISO file selected: {dialog.selected_iso()}")
+            self._populate_iso_info()
+
+    def browse_checksums_file(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Select SHA256SUMS File", "",
+                                                   "Checksum Files (SHA256SUMS *.sha256 *.txt);;All Files (*)")
+        if file_path:
+            self.checksums_file_path.setText(file_path)
+
     def browse_output_iso_location(self):
         default_filename = f"custom-{os.path.basename(self.iso_file_path.text())}"
         default_path = os.path.join(os.path.dirname(self.iso_file_path.text()), default_filename)
@@ -673,43 +638,35 @@ class ISOMasterBuilderApp(QWidget):
         if not self.iso_file_path.text():
             return
 
-        try:
-            iso_path = self.iso_file_path.text()
-            cmd = ["xorriso", "-indev", iso_path, "-report_system_area", "as_mkisofs"]
-            process = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            output_lines = process.stdout.strip().split('\n')
-            iso_name = "Unknown"
-            iso_version = "Unknown"
-            iso_architecture = "Unknown"
-
-            for line in output_lines:
-                if line.startswith("System_ID="):
-                    iso_name = line.split("=")[1].strip("'")
-                elif line.startswith("Application_ID="):
-                    iso_version = line.split("=")[1].strip("'")
-
-            filename = os.path.basename(iso_path).lower()
-            if "amd64" in filename:
-                iso_architecture = "amd64"
-            elif "i386" in filename:
-                iso_architecture = "i386"
-            elif "arm64" in filename:
-                iso_architecture = "arm64"
-
-            self.iso_name_edit.setText(iso_name)
-            self.iso_version_edit.setText(iso_version)
-            self.iso_architecture_edit.setText(iso_architecture)
-            print("ISO information extracted.")
-
-        except FileNotFoundError:
-            QMessageBox.critical(self, "Error", "xorriso command not found. Is it installed?")
-            print("Error: xorriso not found.")
-        except subprocess.CalledProcessError as e:
-            QMessageBox.critical(self, "Error", f"Error extracting ISO info with xorriso: {e.stderr}")
-            print(f"Error running xorriso: {e.stderr}")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"An unexpected error occurred during ISO info extraction: {e}")
-            print(f"Unexpected error during ISO info extraction: {e}")
+        # A newer ISO selection supersedes a query still in flight.
+        if self.iso_info_task is not None:
+            self.iso_info_task.cancel()
+        self.iso_info_task = self.executor.submit(read_iso_info, self.iso_file_path.text(),
+                                                  description="Reading ISO information")
+        self.iso_info_task.finished.connect(self._iso_info_ready)
+        self.iso_info_task.failed.connect(self._iso_info_failed)
+
+    def _iso_info_ready(self, iso_info):
+        self.iso_name_edit.setText(iso_info['label'] or "Unknown")
+        self.iso_version_edit.setText(iso_info['version'] or "Unknown")
+        self.iso_architecture_edit.setText(iso_info['architecture'] or "Unknown")
+        details = [iso_info['description'] or iso_info['label'] or ""]
+        if iso_info['publisher']:
+            details.append(f"Publisher: {iso_info['publisher']}")
+        if iso_info['created']:
+            details.append(f"Created: {iso_info['created']:%Y-%m-%d %H:%M}")
+        boot = ", ".join(dict.fromkeys(record['platform'] for record in iso_info['boot_records']))
+        details.append(f"Boot: {boot or 'not bootable'}")
+        self.iso_name_edit.setToolTip("\n".join(detail for detail in details if detail))
+        print("ISO information extracted.")
+
+    def _iso_info_failed(self, error):
+        if isinstance(error, ValueError):
+            QMessageBox.critical(self, "Error", f"Not a usable ISO image: {error}")
+            print(f"Error reading ISO info: {error}")
+        else:
+            QMessageBox.critical(self, "Error", f"An unexpected error occurred during ISO info extraction: {error}")
+            print(f"Unexpected error during ISO info extraction: {error}")
 
     def go_to_next_step(self):
         if self.current_step == 1:
@@ -754,60 +711,6 @@ class ISOMasterBuilderApp(QWidget):
         else:
             self.next_button.setText("Next")
 
-    def _extract_iso(self):
-        working_folder = self.working_folder_path.text()
-        iso_file = self.iso_file_path.text()
-        self.extracted_iso_path = os.path.join(working_folder, "extracted_iso")
-        os.makedirs(self.extracted_iso_path, exist_ok=True)
-
-        self.step3_progress_bar.setValue(0)
-        self.step3_progress_bar.setFormat("%p% - Extracting...")
-
-        try:
-            iso_file = self.iso_file_path.text()
-            cmd = ["xorriso", "-osirrox", "on", "-indev", iso_file, "-extract", "/", self.extracted_iso_path]
-
-            self.extraction_thread = CommandRunnerThread(cmd)
-            self.extraction_thread.command_output_signal.connect(self._process_extraction_output)
-            self.extraction_thread.command_finished_signal.connect(self._extraction_finished)
-            self.extraction_thread.start()
-
-        except FileNotFoundError:
-            self.step3_progress_bar.setFormat("Error")
-            QMessageBox.critical(self, "Error", "xorriso command not found. Is it installed?")
-            print("Error: xorriso not found.")
-        except Exception as e:
-            self.step3_progress_bar.setFormat("Error")
-            QMessageBox.critical(self, "Error", f"Unexpected error during ISO extraction: {e}")
-            print(f"Unexpected error during ISO extraction: {e}")
-
-    def _process_extraction_output(self, output_text):
-        if "filesினாலும்" in output_text:
-            try:
-                parts = output_text.split("filesினாலும்")
-                numbers = parts[0].split()
-                current = int(numbers[-2].strip())
-                total = int(numbers[-1].strip())
-                percent = int((current / total) * 100)
-                self.step3_progress_bar.setValue(percent)
-
-            except (ValueError, IndexError):
-                pass
-
-    def _extraction_finished(self, return_code):
-        if return_code == 0:
-            self.step3_progress_bar.setValue(100)
-            self.step3_progress_bar.setFormat("%p% - Extraction Complete")
-            print("ISO extraction completed.")
-            self.back_button.setEnabled(True)
-            self.next_button.setEnabled(True)
-
-        else:
-            self.step3_progress_bar.setFormat("Extraction Failed")
-            QMessageBox.critical(self, "Error", "ISO extraction failed.")
-            print("Error during ISO extraction.")
-            self.back_button.setEnabled(True)
-
     def browse_boot_logo(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select Boot Logo Image", "",
                                                    "Images (*.png *.jpg *.bmp *.svg *.xpm)")
@@ -822,79 +725,80 @@ class ISOMasterBuilderApp(QWidget):
             print(f"Boot logo selected: {file_path}")
 
     def _fetch_installed_packages(self):
-        command = ["apt-get", "list", "--installed"]
-        chroot_command = ["chroot", self.extracted_iso_path] + command
-        try:
-            result = subprocess.run(chroot_command, capture_output=True, text=True, check=True)
-            output_text = result.stdout
-            lines = output_text.strip().split('\n')
-            package_data = []
-            for line in lines:
-                if "/" in line and ",now" in line:
-                    parts = line.split()
-                    package_name_parts = parts[0].split("/")
-                    package_name = package_name_parts[0]
-                    version_part = parts[1].split(",")
-                    version = version_part[0]
-                    package_data.append({'name': package_name, 'version': version, 'remove': False})
-            return package_data
-        except subprocess.CalledProcessError as e:
-            print(f"Error fetching installed packages: {e.stderr}")
-            QMessageBox.critical(self, "Error", f"Error fetching installed packages: {e.stderr}")
-            return []
-        except FileNotFoundError:
-            QMessageBox.critical(self, "Error", "'apt' command not found in system or chroot environment.")
-            return []
+        task = self.executor.submit(read_installed_packages, self.root_fs_path,
+                                    description="Reading installed packages")
+        task.finished.connect(self._installed_packages_ready)
+        task.failed.connect(self._installed_packages_failed)
+        return task
+
+    def _installed_packages_ready(self, package_data):
+        self.step4_removal_package_model.set_row_source(package_data)
+        self.step4_removal_package_table_view.resizeColumnsToContents()
+
+    def _installed_packages_failed(self, error):
+        print(f"Error reading dpkg status database: {error}")
+        QMessageBox.critical(self, "Error", f"Error reading dpkg status database: {error}")
 
     def _fetch_available_packages(self):
-        command = ["apt-get", "list"]
-        chroot_command = ["chroot", self.extracted_iso_path] + command
+        # The index is rebuilt only when the tree's apt lists change.
         try:
-            result = subprocess.run(chroot_command, capture_output=True, text=True, check=True)
-            output_text = result.stdout
-            lines = output_text.strip().split('\n')
-            package_data = []
-            for line in lines:
-                if "/" in line and not line.startswith("Listing..."):
-                    parts = line.split()
-                    package_name_parts = parts[0].split("/")
-                    package_name = package_name_parts[0]
-                    version_part = parts[1].split(",")
-                    version = version_part[0] if version_part else "Unknown"
-                    package_data.append({'name': package_name, 'version': version, 'remove': False})
-            return package_data
-        except subprocess.CalledProcessError as e:
-            print(f"Error fetching available packages: {e.stderr}")
-            QMessageBox.critical(self, "Error", f"Error fetching available packages: {e.stderr}")
-            return []
-        except FileNotFoundError:
-            QMessageBox.critical(self, "Error", "'apt' command not found in system or chroot environment.")
-            return []
+            index_path = self._cache_path("apt-packages.idx")
+        except OSError as e:
+            self._available_packages_failed(e)
+            return None
+        task = self.executor.submit(load_index, self.root_fs_path, index_path,
+                                    description="Indexing available packages")
+        task.finished.connect(self._available_packages_ready)
+        task.failed.connect(self._available_packages_failed)
+        # A load superseded by a newer one still opened its index file.
+        task.discarded.connect(lambda index: index.close())
+        return task
+
+    def _available_packages_ready(self, index):
+        if self.available_package_index:
+            self.available_package_index.close()
+        self.available_package_index = index
+        self.step4_addition_package_model.set_description_loader(index.description)
+        self.step4_addition_package_model.set_row_source(index.iter_packages())
+        self.step4_applications_package_table_view.resizeColumnsToContents()
+
+    def _available_packages_failed(self, error):
+        print(f"Error indexing available packages: {error}")
+        QMessageBox.critical(self, "Error", f"Error indexing available packages: {error}")
 
     def _populate_package_lists_for_checklist(self):
         print("Populating package lists for Step 4 checklist...")
 
-        installed_packages_data = self._fetch_installed_packages()
-        self.step4_removal_package_model = PackageListModel(installed_packages_data)
+        for task in self.package_fetch_tasks:
+            task.cancel()
+
+        # The tables show up empty right away; both lists are read in parallel
+        # on the executor and streamed into their model as each one finishes.
+        self.step4_removal_package_model = PackageListModel()
         self.step4_removal_proxy_model = PackageSortFilterProxyModel()
         self.step4_removal_proxy_model.setSourceModel(self.step4_removal_package_model)
-        self.step4_removal_package_table_view.setModel(self.step4_removal_proxy_model)
-        self.step4_removal_package_table_view.setItemDelegate(CenteredIconDelegate())
-        self.step4_removal_package_table_view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
-        self.step4_removal_package_table_view.setSortingEnabled(True)
+        self._setup_package_table(self.step4_removal_package_table_view, self.step4_removal_proxy_model)
         self.step4_removal_search_line_edit.textChanged.connect(self._filter_removal_package_list)
 
-        available_packages_data = self._fetch_available_packages()
-        self.step4_addition_package_model = PackageListModel(available_packages_data)
+        self.step4_addition_package_model = PackageListModel()
         self.step4_addition_proxy_model = PackageSortFilterProxyModel()
         self.step4_addition_proxy_model.setSourceModel(self.step4_addition_package_model)
-        self.step4_addition_package_table_view.setModel(self.step4_addition_proxy_model)
-        self.step4_addition_package_table_view.setItemDelegate(CenteredIconDelegate())
-        self.step4_addition_package_table_view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
-        self.step4_addition_package_table_view.setSortingEnabled(True)
+        self._setup_package_table(self.step4_applications_package_table_view, self.step4_addition_proxy_model)
         self.step4_applications_search_line_edit.textChanged.connect(self._filter_addition_package_list)
 
-        print("Package lists populated.")
+        self.package_fetch_tasks = [task for task in (self._fetch_installed_packages(),
+                                                      self._fetch_available_packages()) if task]
+
+    def _setup_package_table(self, table_view, proxy_model):
+        table_view.setModel(proxy_model)
+        table_view.setItemDelegate(CenteredIconDelegate())
+        # Size columns from a sample of rows once, instead of measuring every
+        # row on each insert as ResizeToContents would.
+        header = table_view.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.ResizeMode.Interactive)
+        header.setResizeContentsPrecision(self.PACKAGE_COLUMN_SAMPLE_ROWS)
+        header.setStretchLastSection(True)
+        table_view.setSortingEnabled(True)
 
     def _filter_removal_package_list(self, filter_text):
         self.step4_removal_proxy_model.setFilterText(filter_text)
@@ -915,7 +819,7 @@ class ISOMasterBuilderApp(QWidget):
             "--arch", arch,
             "--variant", variant,
             release,
-            self.extracted_iso_path,
+            self.root_fs_path,
             mirror
         ]
         commands.append(("Bootstrap Base System", debootstrap_command))
@@ -1007,7 +911,9 @@ class ISOMasterBuilderApp(QWidget):
         if reply == QMessageBox.StandardButton.Yes:
             self._execute_package_modifications(commands)
 
-    def _execute_package_modifications(self, commands):
+    def _execute_package_modifications(self, commands, resume_at=None, recover=False):
+        # `resume_at` continues a journalled run from that stage; `recover`
+        # first repairs what an interrupted one left behind.
         if not commands:
             return
 
@@ -1015,8 +921,7 @@ class ISOMasterBuilderApp(QWidget):
         self.step4_progress_bar.setRange(0, len(commands))
         self.step4_progress_bar.setValue(0)
         self.step4_progress_label = QLabel("Applying Configuration Changes:")
-        self.step4_log_display = QPlainTextEdit()
-        self.step4_log_display.setReadOnly(True)
+        self.step4_log_display = LogView()
         self.step4_log_display.setFont(QFont("Courier New", 10))
 
         step4_layout = self.step4_group.layout()
@@ -1027,8 +932,106 @@ class ISOMasterBuilderApp(QWidget):
         self.step4_progress_bar.show()
         self.step4_log_display.show()
 
-        self.current_modification_command_index = 0
+        self.current_modification_command_index = resume_at or 0
         self.modification_commands = commands
+        self.stage_keys = []
+        if resume_at is not None:
+            self.step4_progress_bar.setValue(resume_at)
+            self._resume_stage_cache(recover)
+            if recover:
+                self._recover_interrupted_stage()
+            else:
+                self._execute_next_modification_command()
+            return
+        self._journal_record("start_stages", commands)
+        if not self._find_cached_stages():
+            self._execute_next_modification_command()
+
+    def _resume_stage_cache(self, recover):
+        # The tree is what the last finished stage left, so its key still
+        # holds; after a repair it matches no key.
+        if recover or not self.step4_stage_cache_checkbox.isChecked() or not self.journal.stage_keys():
+            return
+        try:
+            budget = self.step4_stage_cache_budget_spinbox.value() << 30
+            self.stage_cache = StageCache(self._cache_path("stages"), budget)
+        except OSError as e:
+            print(f"Stage cache unavailable: {e}")
+            self.step4_log_display.append_text(f"Stage cache not used: {e}\n")
+            return
+        self.stage_keys = self.journal.stage_keys()
+
+    def _recover_interrupted_stage(self):
+        self.step4_progress_label.setText("Repairing the interrupted stage...")
+        self.step4_log_display.append_text("$ " + " ".join(RECOVERY_COMMAND) + "\n")
+        self.modification_thread = SessionCommandThread(self._get_chroot_session(), RECOVERY_COMMAND)
+        self.modification_thread.command_output_signal.connect(self._process_modification_output)
+        self.modification_thread.command_finished_signal.connect(
+            lambda _return_code: self._execute_next_modification_command())
+        self.modification_thread.start()
+
+    def _find_cached_stages(self):
+        # Skips the leading stages whose result an earlier build left in the
+        # stage cache. Returns False when the cache is not used.
+        if not self.step4_stage_cache_checkbox.isChecked():
+            return False
+        try:
+            budget = self.step4_stage_cache_budget_spinbox.value() << 30
+            self.stage_cache = StageCache(self._cache_path("stages"), budget)
+            baseline = self._cache_path("root_fs-manifest.sqlite")
+        except OSError as e:
+            print(f"Stage cache unavailable: {e}")
+            self.step4_log_display.append_text(f"Stage cache not used: {e}\n")
+            return False
+        # The mirror decides what apt installs at every stage, not only in debootstrap.
+        inputs = [self.step4_arch_combo.currentText(), self.step4_variant_combo.currentText(),
+                  self.step4_release_combo.currentText(), self.step4_mirror_line_edit.text()]
+        self._close_chroot_session()
+        self.step4_progress_label.setText("Looking for cached stages...")
+        task = self.executor.submit(self._restore_cached_stages, self.stage_cache, self.root_fs_path, baseline,
+                                    self.modification_commands, inputs,
+                                    self.step4_mirror_line_edit.text(), self.step4_release_combo.currentText(),
+                                    description="Restoring cached stages")
+        task.finished.connect(self._cached_stages_restored)
+        task.failed.connect(self._cached_stages_failed)
+        return True
+
+    @staticmethod
+    def _restore_cached_stages(cache, root, baseline, commands, inputs, mirror, release):
+        # Returns the stage keys and how many stages were restored, or
+        # (None, 0) when the tree no longer matches the extracted one.
+        base = cache.base_key(root, baseline)
+        if base is None:
+            return None, 0
+        # Same commands and mirror install other versions once the archive is
+        # republished, so the stages are keyed by the index they fetch.
+        keys = stage_keys(base, commands, inputs + [release_date(mirror, release)])
+        restored = cache.deepest(keys)
+        if restored:
+            cache.restore(keys[restored - 1], root)
+        return keys, restored
+
+    def _cached_stages_restored(self, result):
+        keys, restored = result
+        if keys is None:
+            self.step4_log_display.append_text(
+                "The root filesystem has changed since it was extracted; stage results will not be cached.\n")
+        else:
+            self.stage_keys = keys
+            self._journal_record("set_stage_keys", keys)
+            tree = tree_signature(self.root_fs_path)
+            for index, (operation_name, _command) in enumerate(self.modification_commands[:restored]):
+                self.step4_log_display.append_text(f"{operation_name}: restored from the stage cache\n")
+                self._journal_record("stage_finished", index, 0, None, tree, cached=True)
+        self.current_modification_command_index = restored
+        self.step4_progress_bar.setValue(restored)
+        self._execute_next_modification_command()
+
+    def _cached_stages_failed(self, error):
+        # A half-restored tree would not match any stage key; run everything.
+        print(f"Could not restore cached stages: {error}")
+        self.step4_log_display.append_text(f"Stage cache not used: {error}\n")
+        self.stage_keys = []
         self._execute_next_modification_command()
 
     def _execute_next_modification_command(self):
@@ -1038,30 +1041,68 @@ class ISOMasterBuilderApp(QWidget):
 
         operation_name, command = self.modification_commands[self.current_modification_command_index]
         self.step4_progress_label.setText(f"Applying Changes: {operation_name}...")
+        self._journal_record("stage_started", self.current_modification_command_index)
 
         use_chroot = operation_name not in ["Bootstrap Base System"]
-        chroot_path_val = self.extracted_iso_path if use_chroot else None
-        is_dpkg_command_val = use_chroot
-
-        self.modification_thread = CommandRunnerThread(command, chroot_path=chroot_path_val, is_dpkg_command=is_dpkg_command_val)
+        if use_chroot:
+            self.modification_thread = SessionCommandThread(self._get_chroot_session(), command)
+        else:
+            self.modification_thread = CommandRunnerThread(command)
         self.modification_thread.command_output_signal.connect(self._process_modification_output)
+        self.modification_thread.command_completed_signal.connect(self._report_modification_status)
         self.modification_thread.command_finished_signal.connect(self._handle_modification_command_finished)
         self.modification_thread.start()
 
     def _handle_modification_command_finished(self, return_code):
+        self._journal_record("stage_finished", self.current_modification_command_index, return_code,
+                             self.modification_thread.wall_time, tree_signature(self.root_fs_path))
         if return_code == 0:
             print(f"Package modification command finished successfully.")
         else:
             QMessageBox.warning(self, "Warning", f"Package modification command failed with return code: {return_code}")
+            # The tree no longer is what the following stage keys describe.
+            self.stage_keys = []
+
+        if self.stage_keys:
+            self._store_stage()
+        else:
+            self._advance_modification_command()
 
+    def _advance_modification_command(self):
         self.current_modification_command_index += 1
         self.step4_progress_bar.setValue(self.current_modification_command_index)
         self._execute_next_modification_command()
 
+    def _store_stage(self):
+        index = self.current_modification_command_index
+        operation_name, _command = self.modification_commands[index]
+        previous = self.stage_keys[index - 1] if index else None
+        try:
+            baseline = self._cache_path("root_fs-manifest.sqlite")
+        except OSError as e:
+            self._stage_store_failed(e)
+            self._advance_modification_command()
+            return
+        self.step4_progress_label.setText(f"Caching {operation_name}...")
+        task = self.executor.submit(self.stage_cache.store, self.stage_keys[index], self.root_fs_path, baseline,
+                                    operation_name, previous, description=f"Caching {operation_name}")
+        task.finished.connect(self._stage_stored)
+        task.failed.connect(self._stage_store_failed)
+        task.done.connect(self._advance_modification_command)
+
+    def _stage_stored(self, used):
+        print(f"Stage cache: {format_size(used)} of {format_size(self.stage_cache.budget)} used.")
+
+    def _stage_store_failed(self, error):
+        print(f"Could not cache the stage, later builds will rerun it: {error}")
+        self.step4_log_display.append_text(f"Could not cache the stage, later builds will rerun it: {error}\n")
+
+    def _report_modification_status(self, return_code, wall_time):
+        operation_name, _command = self.modification_commands[self.current_modification_command_index]
+        self.step4_log_display.append_text(f"\n{operation_name}: {format_exit_status(return_code, wall_time)}\n")
+
     def _process_modification_output(self, output_text):
-        self.step4_log_display.moveCursor(QTextCursor.MoveOperation.End)
-        self.step4_log_display.insertPlainText(output_text)
-        self.step4_log_display.moveCursor(QTextCursor.MoveOperation.End)
+        self.step4_log_display.append_text(output_text)
 
     def _package_modifications_finished(self):
         self.modification_thread = None
@@ -1070,98 +1111,6 @@ class ISOMasterBuilderApp(QWidget):
 
         print("System configuration modifications finished.")
 
-    def _start_iso_recreation(self):
-        output_iso_file = self.output_iso_path.text()
-
-        if not output_iso_file:
-            QMessageBox.warning(self, "Warning", "Please specify output ISO path.")
-            return
-        if not self.compression_options:
-            self.compression_options = {"method": "gzip", "level": 6, "threads": 0, "custom_command": ""}
-
-        self.step7_log_display.clear()
-        self.step7_progress_bar.setValue(0)
-        self.step7_progress_bar.show()
-        self.step7_log_display.show()
-        self.next_button.setEnabled(False)
-        self.back_button.setEnabled(False)
-
-        cmd = [
-            "xorriso",
-            "-as", "mkisofs",
-            "-r",
-            "-J",
-            "-joliet-long",
-            "-l",
-            "-cache-inodes",
-            "-follow-links",
-            "-o", output_iso_file,
-            "-b", "isolinux/isolinux.bin",
-            "-c", "isolinux/boot.cat",
-            "-no-emul-boot",
-            "-boot-load-size", "4",
-            "-boot-info-table",
-            "-isohybrid-mbr", "isolinux/isohdpfx.bin",
-            "-eltorito-alt-boot",
-            "-e", "boot/grub/efi.img",
-            "-no-emul-boot",
-            "-isohybrid-gpt-basdat",
-        ]
-
-        if self.preseed_file and os.path.exists(self.preseed_file):
-            cmd.extend(["-preseed", self.preseed_file])
-
-        if self.boot_logo_path and os.path.exists(self.boot_logo_path):
-            isolinux_dir = os.path.join(self.extracted_iso_path, "isolinux")
-            if not os.path.exists(isolinux_dir):
-                os.makedirs(isolinux_dir)
-
-            logo_dest_path = os.path.join(isolinux_dir, "logo.png")
-            try:
-                shutil.copy(self.boot_logo_path, logo_dest_path)
-
-                cfg_path = os.path.join(isolinux_dir, "isolinux.cfg")
-                if os.path.exists(cfg_path):
-                    with open(cfg_path, "a") as cfg_file:
-                        cfg_file.write(f"\nUI vesamenu.c32\nMENU BACKGROUND logo.png\n")
-            except (shutil.Error, IOError) as e:
-                QMessageBox.warning(self, "Warning", f"Failed to copy boot logo: {e}")
-
-        cmd.append(self.extracted_iso_path)
-
-        self.iso_recreation_thread = CommandRunnerThread(cmd,
-                                                        working_dir=self.working_folder_path.text())
-        self.iso_recreation_thread.command_output_signal.connect(self._process_iso_recreation_output)
-        self.iso_recreation_thread.command_finished_signal.connect(self._iso_recreation_finished)
-        self.iso_recreation_thread.start()
-
-    def _process_iso_recreation_output(self, output_text):
-        self.step7_log_display.moveCursor(QTextCursor.MoveOperation.End)
-        self.step7_log_display.insertPlainText(output_text)
-        self.step7_log_display.moveCursor(QTextCursor.MoveOperation.End)
-
-        if "xorriso : UPDATE : " in output_text:
-            try:
-                parts = output_text.split(":")
-                progress_part = parts[-1].strip()
-                if progress_part.endswith("%"):
-                    progress_percent = int(progress_part[:-1])
-                    self.step7_progress_bar.setValue(progress_percent)
-            except (ValueError, IndexError):
-                pass
-
-    def _iso_recreation_finished(self, return_code):
-        self.next_button.setEnabled(True)
-        self.back_button.setEnabled(True)
-        if return_code == 0:
-            self.step7_progress_bar.setValue(100)
-        else:
-            self.step7_progress_bar.setFormat("ISO Creation Failed")
-            QMessageBox.critical(self, "Error", f"ISO re-creation failed with return code {return_code}.")
-
-        self.iso_recreation_thread = None
-        self.go_to_step(8)
-
     def _open_output_folder(self):
         output_dir = os.path.dirname(self.output_iso_path.text())
         if os.path.exists(output_dir):
@@ -1177,15 +1126,36 @@ class ISOMasterBuilderApp(QWidget):
             QMessageBox.warning(self, "Warning", "Output folder does not exist.")
 
     def delete_temp_files(self):
-        if self.extracted_iso_path and os.path.exists(self.extracted_iso_path):
+        self._close_chroot_session()
+        # The unpacked root filesystem lives next to the ISO tree, or is it.
+        temp_dirs = [path for path in dict.fromkeys((self.root_fs_path, self.extracted_iso_path))
+                     if path and os.path.exists(path)]
+        # Never recurse into a bind mount of the host's /dev or similar.
+        leftover_mounts = [mount for path in temp_dirs for mount in mounts_under(path)]
+        if leftover_mounts:
+            QMessageBox.warning(self, "Warning", "Not deleting temporary files, these are still mounted:\n" + "\n".join(leftover_mounts))
+            return
+        for path in temp_dirs:
             try:
-                shutil.rmtree(self.extracted_iso_path)
-                print(f"Deleted temporary directory: {self.extracted_iso_path}")
+                shutil.rmtree(path)
+                print(f"Deleted temporary directory: {path}")
             except Exception as e:
                 QMessageBox.warning(self, "Warning", f"Failed to delete temporary files: {e}")
+        self._journal_record("remove")
+
+    def closeEvent(self, event):
+        # Kill running queries and commands instead of waiting for them on exit.
+        self.executor.shutdown()
+        for thread in (self.extraction_thread, self.modification_thread, self.iso_recreation_thread):
+            if thread is not None and thread.isRunning():
+                thread.stop_thread()
+                thread.wait()
+        self._close_chroot_session()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = ISOMasterBuilderApp()
     window.show()
+    window.offer_resume()
     sys.exit(app.exec())
\ No newline at end of file
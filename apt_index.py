@@ -0,0 +1,247 @@
+import bisect
+import glob
+import json
+import mmap
+import os
+import struct
+import sys
+import urllib.error
+import urllib.request
+
+from dpkg_status import compare_versions, iter_stanzas, parse_fields, read_field
+
+APT_LISTS_PATH = os.path.join("var", "lib", "apt", "lists")
+
+_MAGIC = b"MLAPTIX\x01"
+_HEADER_LENGTH = struct.Struct("<I")
+# name offset/length into the names blob, pool ids for version, architecture,
+# section and priority, Installed-Size in bytes, then where the full stanza
+# lives: source file id, offset and length.
+_RECORD = struct.Struct("<IHIIIIQHQI")
+_NAME = struct.Struct("<IH")
+
+_PACKAGES_FIELDS = {
+    b"Package": "name",
+    b"Version": "version",
+    b"Architecture": "architecture",
+    b"Installed-Size": "installed_size",
+    b"Section": "section",
+    b"Priority": "priority",
+}
+
+
+def list_sources(root):
+    """Return (path, size, mtime_ns) for every Packages list under `root`."""
+    sources = []
+    for path in sorted(glob.glob(os.path.join(root, APT_LISTS_PATH, "*_Packages"))):
+        stat = os.stat(path)
+        sources.append((path, stat.st_size, stat.st_mtime_ns))
+    return sources
+
+
+def release_date(mirror, suite, timeout=30):
+    """Return the Date field of the Release file `mirror` currently serves for `suite`.
+
+    It changes whenever the archive is republished. Only the start of the
+    file, where the field is, is downloaded. Raises OSError when the
+    mirror cannot be reached and ValueError when the file has no Date.
+    """
+    for name in ("InRelease", "Release"):
+        url = f"{mirror.rstrip('/')}/dists/{suite}/{name}"
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                head = response.read(8192)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                continue
+            raise
+        date = read_field(head, "Date")
+        if not date:
+            raise ValueError(f"No Date in {url}")
+        return date
+    raise FileNotFoundError(f"No Release file for {suite} at {mirror}")
+
+
+def _scan_source(path, file_id, best):
+    with open(path, "rb") as list_file:
+        if os.fstat(list_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(list_file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for offset, length in iter_stanzas(buf):
+                fields = parse_fields(buf[offset:offset + length], _PACKAGES_FIELDS)
+                if "name" not in fields:
+                    continue
+                key = (fields["name"], fields.get("architecture", ""))
+                current = best.get(key)
+                # Several pockets can carry the same package; keep the newest,
+                # which is what apt would pick as the candidate.
+                if current is None or compare_versions(fields.get("version", ""), current[0].get("version", "")) > 0:
+                    best[key] = (fields, file_id, offset, length)
+
+
+def build_index(sources, index_path):
+    """Index the Packages lists in `sources` and write the result to `index_path`."""
+    best = {}
+    for file_id, (path, _size, _mtime) in enumerate(sources):
+        _scan_source(path, file_id, best)
+
+    pool = [""]
+    pool_ids = {"": 0}
+
+    def intern(value):
+        pool_id = pool_ids.get(value)
+        if pool_id is None:
+            pool_id = pool_ids[value] = len(pool)
+            pool.append(value)
+        return pool_id
+
+    names = bytearray()
+    records = bytearray()
+    for key in sorted(best):
+        fields, file_id, offset, length = best[key]
+        name = fields["name"].encode()
+        try:
+            installed_size = int(fields.get("installed_size", "0")) * 1024
+        except ValueError:
+            installed_size = 0
+        records += _RECORD.pack(len(names), len(name),
+                                intern(fields.get("version", "")),
+                                intern(fields.get("architecture", "")),
+                                intern(fields.get("section", "")),
+                                intern(fields.get("priority", "")),
+                                installed_size, file_id, offset, length)
+        names += name
+
+    pool_blob = "\0".join(pool).encode()
+    header = {
+        "sources": sources,
+        "count": len(best),
+        "records_offset": 0,
+        "names_offset": len(records),
+        "pool_offset": len(records) + len(names),
+        "pool_length": len(pool_blob),
+    }
+    header_blob = json.dumps(header).encode()
+    # Section offsets are relative to the end of the header.
+    base = len(_MAGIC) + _HEADER_LENGTH.size + len(header_blob)
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as index_file:
+        index_file.write(_MAGIC)
+        index_file.write(_HEADER_LENGTH.pack(len(header_blob)))
+        index_file.write(header_blob)
+        assert index_file.tell() == base
+        index_file.write(records)
+        index_file.write(names)
+        index_file.write(pool_blob)
+    os.replace(tmp_path, index_path)
+
+
+class AvailablePackageIndex:
+    """Read-only, memory-mapped view of an index written by build_index.
+
+    Only the fixed-size records and the small string pool are touched when
+    listing packages; long fields such as Description are read from the
+    original Packages file on demand.
+    """
+
+    def __init__(self, index_path):
+        self.path = index_path
+        self._file = open(index_path, "rb")
+        try:
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Empty package index: {index_path}")
+        if self._buf[:len(_MAGIC)] != _MAGIC:
+            self.close()
+            raise ValueError(f"Not a package index: {index_path}")
+        (header_length,) = _HEADER_LENGTH.unpack_from(self._buf, len(_MAGIC))
+        base = len(_MAGIC) + _HEADER_LENGTH.size
+        header = json.loads(self._buf[base:base + header_length])
+        base += header_length
+        self.sources = [tuple(source) for source in header["sources"]]
+        self._count = header["count"]
+        self._records_offset = base + header["records_offset"]
+        self._names_offset = base + header["names_offset"]
+        pool_offset = base + header["pool_offset"]
+        pool_blob = self._buf[pool_offset:pool_offset + header["pool_length"]]
+        self._pool = [sys.intern(value) for value in pool_blob.decode().split("\0")]
+
+    def close(self):
+        # Readers still holding rows from a closed index get ValueError.
+        self._buf.close()
+        self._file.close()
+
+    def __len__(self):
+        return self._count
+
+    def name(self, row):
+        name_offset, name_length = _NAME.unpack_from(self._buf, self._records_offset + row * _RECORD.size)
+        start = self._names_offset + name_offset
+        return self._buf[start:start + name_length].decode()
+
+    def package(self, row):
+        return self._package_row(_RECORD.unpack_from(self._buf, self._records_offset + row * _RECORD.size))
+
+    def _package_row(self, record):
+        name_offset, name_length, version, architecture, section, priority, installed_size = record[:7]
+        start = self._names_offset + name_offset
+        return {
+            'name': self._buf[start:start + name_length].decode(),
+            'version': self._pool[version],
+            'architecture': self._pool[architecture],
+            'installed_size': installed_size,
+            'section': self._pool[section],
+            'priority': self._pool[priority],
+            'remove': False,
+        }
+
+    def iter_packages(self):
+        # Copy the record table rather than holding a view on the mmap, so the
+        # index can be closed while a consumer is still part-way through.
+        records = self._buf[self._records_offset:self._records_offset + self._count * _RECORD.size]
+        for record in _RECORD.iter_unpack(records):
+            yield self._package_row(record)
+
+    def find(self, name):
+        """Return the first row for `name`, or -1."""
+        row = bisect.bisect_left(range(self._count), name, key=self.name)
+        if row < self._count and self.name(row) == name:
+            return row
+        return -1
+
+    def read_stanza(self, row):
+        record = _RECORD.unpack_from(self._buf, self._records_offset + row * _RECORD.size)
+        file_id, offset, length = record[7:]
+        with open(self.sources[file_id][0], "rb") as list_file:
+            list_file.seek(offset)
+            return list_file.read(length)
+
+    def description(self, name):
+        try:
+            row = self.find(name)
+            if row == -1:
+                return ""
+            return read_field(self.read_stanza(row), "Description")
+        except (OSError, ValueError):
+            return ""
+
+
+def load_index(root, index_path):
+    """Open the index for `root`, rebuilding it if the apt lists changed.
+
+    The index is keyed by the path, size and mtime of every Packages list,
+    so an unchanged tree is served straight from the memory-mapped file.
+    """
+    sources = list_sources(root)
+    try:
+        index = AvailablePackageIndex(index_path)
+        if index.sources == sources:
+            return index
+        index.close()
+    except (OSError, ValueError, KeyError):
+        pass
+    build_index(sources, index_path)
+    return AvailablePackageIndex(index_path)
@@ -0,0 +1,705 @@
+"""Timing harness for MasterLinux's hot paths.
+
+Usage: python benchmarks.py <benchmark> [args...]
+Run without arguments to list the available benchmarks.
+"""
+import os
+import posixpath
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from apt_index import build_index, list_sources, load_index
+from build_journal import BuildJournal, tree_signature
+from checksums import sha256_file, verify_md5sums, write_md5sums
+from dpkg_status import read_installed_packages
+from iso9660 import IsoImage, export_file, is_directory, read_iso_info
+from iso_selection import change_arguments, parse_patterns, plan_extraction, under
+from manifest import TreeManifest, changes_since, snapshot_tree
+from package_search import PackageSearchIndex, TrigramIndex
+from package_store import PackageStore
+from squashfs import (COMPRESSION_LEVELS, DEFAULT_COMPRESSION_OPTIONS, MksquashProgress, mksquash_command,
+                      read_superblock, record_build, stage_layer, unsquash_command, write_whiteouts)
+from stage_cache import StageCache, stage_keys
+
+
+def _best_of(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def _report(label, seconds, detail=""):
+    timing = f"{seconds * 1000:10.2f} ms" if seconds is not None else " " * 13
+    print(f"{label:<40} {timing}  {detail}")
+
+
+def _apt_list_installed(root):
+    # The path MasterLinux used before reading dpkg's database directly.
+    command = ["chroot", root, "apt", "list", "--installed"]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    package_data = []
+    for line in result.stdout.strip().split('\n'):
+        if "/" in line and "[installed" in line:
+            parts = line.split()
+            package_data.append({'name': parts[0].split("/")[0], 'version': parts[1].split(",")[0], 'remove': False})
+    return package_data
+
+
+def bench_installed_packages(root, repeat="5"):
+    """Compare the dpkg status parser with `chroot <root> apt list --installed`."""
+    repeat = int(repeat)
+    seconds, packages = _best_of(lambda: read_installed_packages(root), repeat)
+    _report("dpkg status parser", seconds, f"{len(packages)} packages")
+    try:
+        seconds, packages = _best_of(lambda: _apt_list_installed(root), repeat)
+        _report("chroot apt list --installed", seconds, f"{len(packages)} packages")
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"chroot apt list --installed skipped: {e}")
+
+
+def bench_available_index(root, index_path, repeat="5"):
+    """Time building the apt lists index versus reopening it from disk."""
+    repeat = int(repeat)
+    sources = list_sources(root)
+    seconds, _ = _best_of(lambda: build_index(sources, index_path), 1)
+    _report("build index", seconds, f"{len(sources)} lists")
+    seconds, index = _best_of(lambda: load_index(root, index_path), repeat)
+    _report("reopen index", seconds, f"{len(index)} packages")
+    seconds, _ = _best_of(lambda: sum(1 for _ in index.iter_packages()), repeat)
+    _report("iterate rows", seconds)
+    index.close()
+
+
+def _synthetic_row(i):
+    return {
+        'name': f"package-{i:06d}",
+        'version': f"{i % 300}.{i % 7}-{i % 3}ubuntu1",
+        'architecture': "amd64" if i % 5 else "all",
+        'installed_size': (i % 5000) * 1024,
+        'section': ("admin", "libs", "utils", "doc", "net")[i % 5],
+        'priority': ("optional", "important", "required")[i % 3],
+        'remove': False,
+    }
+
+
+def _measure_memory(build):
+    tracemalloc.start()
+    container = build()
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, container
+
+
+def bench_package_store(rows="100000", updates="200"):
+    """Compare dict-per-row package storage with PackageStore (memory, status updates)."""
+    rows, updates = int(rows), int(updates)
+    names = [f"package-{i:06d}" for i in random.Random(0).sample(range(rows), updates)]
+
+    size, dict_rows = _measure_memory(lambda: [_synthetic_row(i) for i in range(rows)])
+    _report("dict rows: memory", None, f"{size / 2**20:.1f} MiB")
+
+    def dict_updates():
+        # The previous set_package_status: a linear scan per call.
+        for name in names:
+            for row in range(len(dict_rows)):
+                if dict_rows[row]['name'] == name:
+                    dict_rows[row]['status'] = 'removed'
+    seconds, _ = _best_of(dict_updates, 1)
+    _report("dict rows: status updates", seconds, f"{seconds / updates * 1e6:.1f} us each")
+    del dict_rows
+
+    size, store = _measure_memory(lambda: PackageStore(_synthetic_row(i) for i in range(rows)))
+    _report("PackageStore: memory", None, f"{size / 2**20:.1f} MiB")
+
+    def store_updates():
+        for name in names:
+            for row in store.rows_of(name):
+                store.set_status(row, 'removed')
+    seconds, _ = _best_of(store_updates, 3)
+    _report("PackageStore: status updates", seconds, f"{seconds / updates * 1e6:.1f} us each")
+
+
+def bench_package_search(rows="100000", query="package-01234"):
+    """Time the trigram search, then the whole proxy refresh, per keystroke while `query` is typed."""
+    rows = int(rows)
+    index = TrigramIndex()
+
+    def build():
+        for i in range(rows):
+            pkg = _synthetic_row(i)
+            index.add(pkg['name'], pkg['version'])
+    seconds, _ = _best_of(build, 1)
+    _report("build trigram index", seconds, f"{rows} rows")
+
+    previous, result = "", None
+    for length in range(1, len(query) + 1):
+        typed = query[:length]
+        # Same narrowing rule as PackageSortFilterProxyModel.
+        candidates = result if previous and previous in typed else None
+        start = time.perf_counter()
+        result = index.search(typed, candidates)
+        _report(f"keystroke {typed!r}", time.perf_counter() - start, f"{len(result)} matches")
+        previous = typed
+
+    # The same keystrokes through PackageSortFilterProxyModel: search, row
+    # filter and the reset of a table view sorted by name. Painting is left
+    # out. Set QT_QPA_PLATFORM=offscreen to run without a display.
+    from PyQt6.QtCore import Qt
+    from PyQt6.QtWidgets import QApplication, QTableView
+    from package_models import PackageListModel, PackageSortFilterProxyModel
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    model = PackageListModel([_synthetic_row(i) for i in range(rows)])
+    proxy = PackageSortFilterProxyModel()
+    proxy.setSourceModel(model)
+    view = QTableView()
+    view.setModel(proxy)
+    view.setSortingEnabled(True)
+    view.sortByColumn(1, Qt.SortOrder.AscendingOrder)
+    seconds, _ = _best_of(proxy._sync_search_index, 1)
+    _report("build search index", seconds, f"{rows} rows")
+    for typed in [query[:length] for length in range(1, len(query) + 1)] + [""]:
+        proxy.setFilterText(typed)
+        start = time.perf_counter()
+        proxy._apply_filter()
+        _report(f"proxy refresh {typed!r}", time.perf_counter() - start, f"{proxy.rowCount()} rows shown")
+    app.processEvents()
+
+
+def bench_package_query(rows="100000", *queries):
+    """Time structured queries (section:, size>, priority:, regex) over synthetic rows."""
+    rows = int(rows)
+    queries = queries or ("section:doc size>1M !priority:required", "size>4M priority:required !arch:all",
+                          "/^package-0+12/", "!section:libs 0042")
+    index = PackageSearchIndex()
+    seconds, _ = _best_of(lambda: [index.add(_synthetic_row(i)) for i in range(rows)], 1)
+    _report("build search index", seconds, f"{rows} rows")
+    for query in queries:
+        seconds, result = _best_of(lambda: index.query(query), 3)
+        _report(query, seconds, f"{len(result)} matches")
+
+
+def _write_apt_log(path, lines):
+    # Something shaped like `apt-get install` output for a large desktop.
+    with open(path, "w") as log:
+        for i in range(lines):
+            name, version = f"package-{i // 4:06d}", f"{i // 4 % 300}.{i // 4 % 7}-{i // 4 % 3}ubuntu1"
+            log.write((
+                f"Get:{i // 4} http://archive.ubuntu.com/ubuntu noble/main amd64 {name} amd64 {version} [{i % 900} kB]\n",
+                f"Selecting previously unselected package {name}.\n",
+                f"Unpacking {name} ({version}) ...\n",
+                f"Setting up {name} ({version}) ...\n",
+            )[i % 4])
+
+
+def bench_output_streaming(log_path="", lines="200000"):
+    """Replay an apt log through CommandRunnerThread and measure GUI-thread time."""
+    from PyQt6.QtCore import QEventLoop, QThread, pyqtSignal
+    from PyQt6.QtGui import QTextCursor
+    from PyQt6.QtWidgets import QApplication, QPlainTextEdit
+    from threads import CommandRunnerThread
+
+    class LineRunnerThread(QThread):
+        # The previous behaviour: one signal per readline().
+        command_output_signal = pyqtSignal(str)
+        command_finished_signal = pyqtSignal(int)
+
+        def __init__(self, command):
+            super().__init__()
+            self.command = command
+
+        def run(self):
+            process = subprocess.Popen(self.command, stdout=subprocess.PIPE, text=True, bufsize=1)
+            for line in process.stdout:
+                self.command_output_signal.emit(line)
+            self.command_finished_signal.emit(process.wait())
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    if not log_path:
+        log_path = os.path.join(tempfile.mkdtemp(), "apt.log")
+        _write_apt_log(log_path, int(lines))
+    with open(log_path, "rb") as log:
+        line_count = sum(1 for _ in log)
+
+    def replay(thread):
+        view = QPlainTextEdit()
+        view.setReadOnly(True)
+        signals = 0
+        loop = QEventLoop()
+
+        def append(text):
+            nonlocal signals
+            signals += 1
+            view.moveCursor(QTextCursor.MoveOperation.End)
+            view.insertPlainText(text)
+            view.moveCursor(QTextCursor.MoveOperation.End)
+        thread.command_output_signal.connect(append)
+        thread.command_finished_signal.connect(lambda return_code: loop.quit())
+        wall, cpu = time.perf_counter(), time.thread_time()
+        thread.start()
+        loop.exec()
+        thread.wait()
+        return time.perf_counter() - wall, time.thread_time() - cpu, signals
+
+    for label, thread in (("per-line signals", LineRunnerThread(["cat", log_path])),
+                          ("CommandRunnerThread batches", CommandRunnerThread(["cat", log_path]))):
+        wall, cpu, signals = replay(thread)
+        _report(f"{label}: wall", wall, f"{line_count} lines")
+        _report(f"{label}: GUI thread CPU", cpu, f"{signals} output signals")
+    app.processEvents()
+
+
+def bench_squashfs_unpack(image, destination="", processors=""):
+    """Time unsquashfs on one thread versus all CPUs (e.g. a 3 GB filesystem.squashfs)."""
+    superblock = read_superblock(image)
+    print(f"{image}: {superblock['compression']}, {superblock['bytes_used'] / 2**20:.0f} MiB, "
+          f"{superblock['inodes']} inodes")
+    parallel = int(processors) if processors else os.cpu_count() or 1
+    work_dir = tempfile.mkdtemp(dir=destination or None)
+    try:
+        timings = {}
+        for threads in dict.fromkeys((1, parallel)):
+            target = os.path.join(work_dir, f"root-{threads}")
+            command = unsquash_command(image, target, threads)
+            start = time.perf_counter()
+            subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+            timings[threads] = seconds = time.perf_counter() - start
+            shutil.rmtree(target)
+            rate = superblock['bytes_used'] / 2**20 / seconds
+            _report(f"unsquashfs -processors {threads}", seconds, f"{rate:.0f} MiB/s of image")
+        if len(timings) > 1:
+            print(f"speed-up: {timings[1] / timings[parallel]:.2f}x on {parallel} processors")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_squashfs_build(source, destination="", *methods):
+    """Pack a tree with each compressor (default: all) and compare size and speed."""
+    work_dir = tempfile.mkdtemp(dir=destination or None)
+    try:
+        log_path = os.path.join(work_dir, "builds.jsonl")
+        for method in methods or COMPRESSION_LEVELS:
+            image = os.path.join(work_dir, f"{method}.squashfs")
+            options = dict(DEFAULT_COMPRESSION_OPTIONS, method=method)
+            levels = COMPRESSION_LEVELS.get(method)
+            if levels is not None:
+                options['level'] = levels[2]
+            progress = MksquashProgress()
+            start = time.perf_counter()
+            result = subprocess.run(mksquash_command(source, image, options), capture_output=True,
+                                    text=True, check=True)
+            seconds = time.perf_counter() - start
+            progress.feed(result.stdout)
+            build = record_build(log_path, image, options, seconds, progress.unpacked_bytes)
+            detail = f"{build['packed_bytes'] / 2**20:.0f} MiB"
+            if build['ratio'] is not None:
+                detail += f", {build['ratio']:.1%} of input, {build['throughput'] / 2**20:.0f} MiB/s"
+            _report(f"mksquashfs -comp {method}", seconds, detail)
+            os.remove(image)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _walk_tree(root):
+    # A single-threaded os.walk with an lstat per entry, as a baseline.
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            os.lstat(os.path.join(dirpath, name))
+            count += 1
+    return count
+
+
+def bench_manifest(root, workers=""):
+    """Time a full index of a tree (e.g. an unpacked root_fs) against incremental refreshes."""
+    import manifest
+    if workers:
+        manifest.SCAN_WORKERS = int(workers)
+    seconds, count = _best_of(lambda: _walk_tree(root), 1)
+    _report("os.walk + lstat", seconds, f"{count} entries")
+    work_dir = tempfile.mkdtemp()
+    try:
+        with TreeManifest(os.path.join(work_dir, "manifest.sqlite"), root) as tree:
+            seconds, changes = _best_of(tree.refresh, 1)
+            _report("full index", seconds, f"{len(changes.added)} entries, {manifest.SCAN_WORKERS} workers")
+            seconds, _ = _best_of(tree.refresh, 3)
+            _report("refresh, stat files", seconds)
+            seconds, _ = _best_of(lambda: tree.refresh(check_files=False), 3)
+            _report("refresh, directories only", seconds)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_md5sums(tree, workers=""):
+    """Regenerate md5sum.txt for a copy of an ISO tree: one thread, all threads, then from the cache."""
+    import checksums
+    parallel = int(workers) if workers else os.cpu_count() or 1
+    work_dir = tempfile.mkdtemp()
+    try:
+        # Hash a copy so the tree's own md5sum.txt is left alone; hard links keep it cheap.
+        copy = os.path.join(work_dir, "tree")
+        shutil.copytree(tree, copy, symlinks=True, copy_function=os.link)
+        for threads in dict.fromkeys((1, parallel)):
+            checksums.HASH_WORKERS = threads
+            manifest_path = os.path.join(work_dir, f"manifest-{threads}.sqlite")
+            seconds, (listed, hashed) = _best_of(lambda: write_md5sums(copy, manifest_path), 1)
+            _report(f"md5sum.txt, {threads} threads", seconds, f"{listed} files, {hashed} hashed")
+        seconds, (listed, hashed) = _best_of(lambda: write_md5sums(copy, manifest_path), 3)
+        _report("md5sum.txt, cached digests", seconds, f"{listed} files, {hashed} hashed")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_iso_info(iso):
+    """Time reading the ISO's label, boot records and architecture in-process against an xorriso query."""
+    seconds, info = _best_of(lambda: read_iso_info(iso), 5)
+    _report("read_iso_info", seconds,
+            f"{info['label']!r}, {info['architecture']}, {len(info['boot_records'])} boot records")
+    with IsoImage(iso) as image:
+        seconds, entries = _best_of(lambda: sum(len(records) for _path, records in image.walk()), 1)
+    _report("walk directory tree", seconds, f"{entries} entries")
+    try:
+        seconds, _ = _best_of(lambda: subprocess.run(["xorriso", "-indev", iso, "-report_system_area", "as_mkisofs"],
+                                                     capture_output=True, check=True), 1)
+        _report("xorriso -report_system_area", seconds)
+    except FileNotFoundError:
+        _report("xorriso -report_system_area", None, "xorriso not installed")
+
+
+def bench_iso_browse(iso, path=""):
+    """Time opening an ISO, listing its root and previewing and exporting `path` without extracting."""
+    def open_and_list():
+        with IsoImage(iso) as image:
+            return len(image.listdir(image.root))
+    seconds, entries = _best_of(open_and_list, 5)
+    _report("open ISO and list /", seconds, f"{entries} entries")
+    if not path:
+        return
+    with IsoImage(iso) as image:
+        seconds, record = _best_of(lambda: image.lookup(path), 5)
+        if record is None or is_directory(record):
+            print(f"{path} is not a file in {iso}")
+            return
+        _report(f"look up {path}", seconds)
+        seconds, data = _best_of(lambda: image.read(record, 0, 64 * 1024), 5)
+        _report("64 KiB preview", seconds, f"{len(data)} bytes")
+    work_dir = tempfile.mkdtemp()
+    try:
+        destination = os.path.join(work_dir, os.path.basename(path))
+        seconds, written = _best_of(lambda: export_file(iso, record, destination), 1)
+        _report("export from extent", seconds, f"{written / 2**20:.1f} MiB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_iso_selection(iso, include="", exclude=""):
+    """Time planning a selective extraction (patterns are space-separated, e.g. "pool/ dists/")."""
+    include, exclude = parse_patterns(include), parse_patterns(exclude)
+    seconds, selection = _best_of(lambda: plan_extraction(iso, include, exclude, always=["md5sum.txt"]), 5)
+    with IsoImage(iso) as image:
+        sizes = {}
+        for path, records in image.walk():
+            for record in records:
+                if not is_directory(record):
+                    sizes[posixpath.join(path, record['name'])] = record['size']
+    extracted = sum(size for path, size in sizes.items() if under(path, selection.extracted))
+    _report("plan extraction", seconds,
+            f"{len(selection.extracted)} paths extracted ({extracted / 2**20:.1f} MiB), "
+            f"{len(selection.skipped)} left in the ISO ({(sum(sizes.values()) - extracted) / 2**20:.1f} MiB)")
+
+
+def bench_iso_modify(tree, changed="10", iso=""):
+    """Find `changed` edited files in an ISO tree; with `iso`, write only them into it versus a full remaster."""
+    work_dir = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(work_dir, "tree")
+        shutil.copytree(tree, copy, symlinks=True)
+        baseline = os.path.join(work_dir, "baseline.sqlite")
+        seconds, entries = _best_of(lambda: snapshot_tree(copy, baseline), 1)
+        _report("snapshot ISO tree", seconds, f"{entries} entries")
+        paths = sorted(os.path.join(dirpath, name) for dirpath, _dirs, names in os.walk(copy) for name in names)
+        for path in random.Random(0).sample(paths, min(int(changed), len(paths))):
+            with open(path, "ab") as edited:
+                edited.write(b"\n")
+        seconds, (changes, current) = _best_of(lambda: changes_since(copy, baseline), 3)
+        arguments = change_arguments(copy, changes, current)
+        _report("find changes", seconds, f"{len(changes.changed)} changed, {len(arguments) // 3} xorriso commands")
+        if not iso:
+            return
+        output = os.path.join(work_dir, "out.iso")
+        commands = {
+            "modify original ISO": ["xorriso", "-indev", iso, "-outdev", output,
+                                    "-boot_image", "any", "replay"] + arguments,
+            "full remaster": ["xorriso", "-as", "mkisofs", "-r", "-J", "-o", output, copy],
+        }
+        for label, command in commands.items():
+            if os.path.exists(output):
+                os.remove(output)
+            try:
+                seconds, _ = _best_of(lambda: subprocess.run(command, capture_output=True, check=True), 1)
+            except FileNotFoundError:
+                _report(label, None, "xorriso not installed")
+                return
+            _report(label, seconds, f"{os.path.getsize(output) / 2**20:.1f} MiB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _drop_cache(path):
+    # Clean pages only, which is all a just-read ISO has; no root needed.
+    with open(path, "rb") as cached:
+        os.posix_fadvise(cached.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _read_through(path):
+    with open(path, "rb", buffering=0) as data:
+        while data.read(4 << 20):
+            pass
+
+
+def bench_iso_verify(iso, tree=""):
+    """Time hashing the ISO after extraction versus alongside it, then checking `tree` against its md5sum.txt."""
+    _drop_cache(iso)
+    seconds, _ = _best_of(lambda: _read_through(iso), 1)
+    _report("read (stand-in for extraction)", seconds)
+    _drop_cache(iso)
+    seconds, _ = _best_of(lambda: (_read_through(iso), sha256_file(iso)), 1)
+    _report("read, then SHA-256", seconds)
+    _drop_cache(iso)
+
+    def concurrent():
+        hasher = threading.Thread(target=sha256_file, args=(iso,))
+        hasher.start()
+        _read_through(iso)
+        hasher.join()
+    seconds, _ = _best_of(concurrent, 1)
+    _report("read and SHA-256 together", seconds)
+    if tree:
+        work_dir = tempfile.mkdtemp()
+        try:
+            manifest_path = os.path.join(work_dir, "manifest.sqlite")
+            seconds, result = _best_of(lambda: verify_md5sums(tree, manifest_path), 1)
+            _report("check md5sum.txt", seconds,
+                    f"{result['checked']} files, {len(result['mismatched'])} mismatched, {len(result['missing'])} missing")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _write_synthetic_file(path, rng, size):
+    # Half random, half repeated text: compresses about as well as a root filesystem.
+    with open(path, "wb") as synthetic_file:
+        synthetic_file.write(rng.randbytes(size // 2) + b"Setting up package ...\n" * (size // 46))
+
+
+def bench_squashfs_incremental(files="20000", changed="2", method="xz", destination=""):
+    """Compare a full mksquashfs rebuild with a delta layer after changing `changed`% of the files, and their boot cost."""
+    files, changed = int(files), float(changed)
+    rng = random.Random(0)
+    options = dict(DEFAULT_COMPRESSION_OPTIONS, method=method)
+    work_dir = tempfile.mkdtemp(dir=destination or None)
+    try:
+        root = os.path.join(work_dir, "root")
+        for i in range(files):
+            directory = os.path.join(root, f"dir-{i % 200:03d}")
+            os.makedirs(directory, exist_ok=True)
+            _write_synthetic_file(os.path.join(directory, f"file-{i:06d}"), rng, rng.randrange(1024, 128 * 1024))
+        image = os.path.join(work_dir, "base.squashfs")
+        subprocess.run(mksquash_command(root, image, options), stdout=subprocess.DEVNULL, check=True)
+        manifest_path = os.path.join(work_dir, "root-manifest.sqlite")
+        seconds, entries = _best_of(lambda: snapshot_tree(root, manifest_path), 1)
+        _report("snapshot tree", seconds, f"{entries} entries")
+
+        # Rewrite some files, delete as many and add a few new ones.
+        paths = sorted(os.path.join(dirpath, name) for dirpath, _dirs, names in os.walk(root) for name in names)
+        count = max(1, int(files * changed / 100))
+        for path in rng.sample(paths, count):
+            _write_synthetic_file(path, rng, rng.randrange(1024, 128 * 1024))
+        for path in rng.sample(paths, count // 4):
+            if os.path.exists(path):
+                os.remove(path)
+        for i in range(count // 4):
+            _write_synthetic_file(os.path.join(root, f"dir-{i % 200:03d}", f"new-{i:06d}"), rng, 64 * 1024)
+
+        full_image = os.path.join(work_dir, "full.squashfs")
+        seconds, _ = _best_of(lambda: subprocess.run(mksquash_command(root, full_image, options),
+                                                     stdout=subprocess.DEVNULL, check=True), 1)
+        _report("full rebuild", seconds, f"{os.path.getsize(full_image) / 2**20:.1f} MiB")
+
+        def incremental():
+            staging = os.path.join(work_dir, "layer")
+            shutil.rmtree(staging, ignore_errors=True)
+            changes, current = changes_since(root, manifest_path)
+            pseudo_file = os.path.join(work_dir, "whiteouts.pseudo")
+            write_whiteouts(stage_layer(root, changes, current, staging), pseudo_file)
+            layer = os.path.join(work_dir, "layer.squashfs")
+            subprocess.run(mksquash_command(staging, layer, options, pseudo_file), stdout=subprocess.DEVNULL,
+                           check=True)
+            return changes, layer
+        seconds, (changes, layer) = _best_of(incremental, 1)
+        _report("scan + stage + delta layer", seconds,
+                f"{os.path.getsize(layer) / 2**20:.1f} MiB layer, {len(changes.added)} added, "
+                f"{len(changes.changed)} changed, {len(changes.removed)} removed")
+        _bench_layer_boot(work_dir, full_image, image, layer)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _cold_read(root):
+    # Stat and read every file with an empty page cache, like a first boot.
+    os.sync()
+    with open("/proc/sys/vm/drop_caches", "w") as drop_caches:
+        drop_caches.write("3\n")
+    start = time.perf_counter()
+    for dirpath, _dirs, names in os.walk(root):
+        for name in names:
+            with open(os.path.join(dirpath, name), "rb") as data:
+                while data.read(1 << 20):
+                    pass
+    return time.perf_counter() - start
+
+
+def _bench_layer_boot(work_dir, full_image, image, layer):
+    # What the delta layer costs the live system: casper loop-mounts it as
+    # well and stacks it over the original image with overlayfs. Needs root.
+    mounts = []
+
+    def mount(*args):
+        target = os.path.join(work_dir, f"mnt-{len(mounts)}")
+        os.makedirs(target)
+        subprocess.run(["mount", *args, target], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        mounts.append(target)
+        return target
+    try:
+        start = time.perf_counter()
+        full_root = mount("-t", "squashfs", "-o", "loop,ro", full_image)
+        _report("boot: mount full image", time.perf_counter() - start)
+        start = time.perf_counter()
+        lower = mount("-t", "squashfs", "-o", "loop,ro", image)
+        upper = mount("-t", "squashfs", "-o", "loop,ro", layer)
+        layered_root = mount("-t", "overlay", "overlay", "-o", f"lowerdir={upper}:{lower}")
+        _report("boot: mount image + layer + overlay", time.perf_counter() - start)
+        _report("boot: cold read, full image", _cold_read(full_root))
+        _report("boot: cold read, image + layer", _cold_read(layered_root))
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"boot-time layer cost skipped: {getattr(e, 'stderr', None) or e}")
+    finally:
+        for target in reversed(mounts):
+            subprocess.run(["umount", target], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def bench_stage_cache(files="20000", changed="5", stages="3", destination=""):
+    """Time caching `stages` stages that each touch `changed`% of a tree, then restoring the last onto a fresh copy."""
+    files, changed, stages = int(files), float(changed), int(stages)
+    rng = random.Random(0)
+    work_dir = tempfile.mkdtemp(dir=destination or None)
+    try:
+        pristine = os.path.join(work_dir, "pristine")
+        for i in range(files):
+            directory = os.path.join(pristine, f"dir-{i % 200:03d}")
+            os.makedirs(directory, exist_ok=True)
+            _write_synthetic_file(os.path.join(directory, f"file-{i:06d}"), rng, rng.randrange(1024, 32 * 1024))
+        root = os.path.join(work_dir, "root")
+        shutil.copytree(pristine, root)
+        manifest_path = os.path.join(work_dir, "root-manifest.sqlite")
+        snapshot_tree(root, manifest_path)
+        cache = StageCache(os.path.join(work_dir, "stages"), 1 << 40)
+        base = cache.base_key(root, manifest_path)
+        keys = stage_keys(base, [(f"stage {i}", ["true", str(i)]) for i in range(stages)])
+        paths = sorted(os.path.join(dirpath, name) for dirpath, _dirs, names in os.walk(root) for name in names)
+        count = max(1, int(files * changed / 100))
+        for i, key in enumerate(keys):
+            for path in rng.sample(paths, count):
+                _write_synthetic_file(path, rng, rng.randrange(1024, 32 * 1024))
+            seconds, used = _best_of(lambda: cache.store(key, root, manifest_path, f"stage {i}",
+                                                         keys[i - 1] if i else None), 1)
+            _report(f"store stage {i}", seconds, f"cache {used / 2**20:.1f} MiB")
+
+        seconds, _ = _best_of(lambda: shutil.copytree(pristine, os.path.join(work_dir, "copy")), 1)
+        _report("full copy of the tree", seconds)
+        restored = os.path.join(work_dir, "restored")
+        shutil.copytree(pristine, restored)
+        seconds, _ = _best_of(lambda: cache.restore(keys[-1], restored), 1)
+        _report("restore last stage", seconds, f"{len(cache.stages())} stages cached")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_build_journal(stages="200", destination=""):
+    """Time recording `stages` journalled stages (each an fsynced rewrite) and reloading the journal to resume."""
+    stages = int(stages)
+    work_dir = tempfile.mkdtemp(dir=destination or None)
+    try:
+        iso = os.path.join(work_dir, "base.iso")
+        root = os.path.join(work_dir, "root")
+        os.makedirs(os.path.join(root, "var", "lib", "dpkg"))
+        with open(iso, "wb") as iso_file:
+            iso_file.write(b"\0" * 2048)
+        journal = BuildJournal(os.path.join(work_dir, "journal.json"))
+        journal.start({"iso_file": iso, "checksums_file": "", "include": "", "exclude": ""})
+        journal.extraction_finished({"extracted_iso_path": work_dir, "root_fs_path": root, "live_root_image": None,
+                                     "live_root_offset": None, "live_root_size": None, "selection": None},
+                                    tree_signature(root))
+        journal.start_stages([(f"Remove package-{i}", ["apt-get", "purge", "-y", f"package-{i}"])
+                              for i in range(stages)])
+
+        def record():
+            for index in range(stages):
+                journal.stage_started(index)
+                journal.stage_finished(index, 0, 1.0, tree_signature(root))
+        seconds, _ = _best_of(record, 1)
+        _report("record stages", seconds, f"{seconds / (stages * 2) * 1000:.2f} ms per fsynced write")
+
+        def resume():
+            resumed = BuildJournal(journal.path)
+            return resumed.check(), resumed.first_incomplete_stage()
+        seconds, (warnings, start) = _best_of(resume, 5)
+        _report("load + check", seconds, f"{os.path.getsize(journal.path)} bytes, resume at {start}, "
+                f"{len(warnings)} warnings")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+BENCHMARKS = {
+    "installed-packages": bench_installed_packages,
+    "available-index": bench_available_index,
+    "package-store": bench_package_store,
+    "package-search": bench_package_search,
+    "package-query": bench_package_query,
+    "output-streaming": bench_output_streaming,
+    "squashfs-unpack": bench_squashfs_unpack,
+    "squashfs-build": bench_squashfs_build,
+    "squashfs-incremental": bench_squashfs_incremental,
+    "manifest": bench_manifest,
+    "md5sums": bench_md5sums,
+    "iso-verify": bench_iso_verify,
+    "iso-info": bench_iso_info,
+    "iso-browse": bench_iso_browse,
+    "iso-selection": bench_iso_selection,
+    "iso-modify": bench_iso_modify,
+    "stage-cache": bench_stage_cache,
+    "build-journal": bench_build_journal,
+}
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in BENCHMARKS:
+        print(__doc__)
+        for name, func in BENCHMARKS.items():
+            print(f"  {name:<24} {func.__doc__}")
+        return 1
+    BENCHMARKS[argv[1]](*argv[2:])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
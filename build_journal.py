@@ -0,0 +1,213 @@
+import json
+import os
+import time
+
+JOURNAL_FILE = "journal.json"
+_VERSION = 1
+
+# Run before resuming after a stage was interrupted: finishes configuring the
+# packages a killed dpkg left half-installed.
+RECOVERY_COMMAND = ["dpkg", "--configure", "-a"]
+
+# Rewritten by every dpkg transaction and by the settings stages. Their sizes
+# and mtimes stand in for the state of the tree between two stages, without
+# walking it.
+_SIGNATURE_FILES = ("var/lib/dpkg/status", "etc/hostname", "etc/default/locale")
+
+
+def file_signature(path):
+    """[size, mtime_ns] of `path`, or None if it does not exist."""
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    return [status.st_size, status.st_mtime_ns]
+
+
+def tree_signature(root):
+    """Cheap fingerprint of the tree at `root`: the signatures of the files package changes rewrite."""
+    return {path: file_signature(os.path.join(root, path)) for path in _SIGNATURE_FILES}
+
+
+class BuildJournal:
+    """What a build in a working folder has done so far, kept on disk so it can be resumed.
+
+    The journal is a JSON file, rewritten (written, fsynced, renamed) on every
+    change, so a crash leaves either the previous or the new version. It
+    holds the settings the build started from, where extraction put the
+    trees, the command list being run and which of its stages finished, and
+    the ISO rebuild steps already done. Each completed step also records a
+    tree_signature() of the root filesystem, so a resume can tell whether
+    the tree is still the one the journal describes. Raises ValueError for
+    a file that is not a journal.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        try:
+            with open(path) as journal_file:
+                self.data = json.load(journal_file)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            raise ValueError(f"Unreadable build journal {path}: {e}")
+        if not isinstance(self.data, dict) or self.data.get("version") != _VERSION:
+            self.data = {}
+
+    def _save(self):
+        self.data["version"] = _VERSION
+        self.data["updated"] = time.time()
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as journal_file:
+            json.dump(self.data, journal_file, indent=1)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(temporary, self.path)
+        # The rename itself only survives a crash once the directory is synced.
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.data = {}
+
+    # Recording
+
+    def start(self, settings):
+        """Begin a new build from `settings` (the ISO and extraction options), dropping any earlier record."""
+        self.data = {"settings": settings, "iso": file_signature(settings["iso_file"])}
+        self._save()
+
+    def extraction_finished(self, layout, tree):
+        self.data["layout"] = layout
+        self.data["tree"] = tree
+        self._save()
+
+    def start_stages(self, stages, keys=()):
+        """Begin running `stages`, a list of (name, command); `keys` are their stage cache keys, if any."""
+        self.data["stages"] = {"commands": [[name, list(command)] for name, command in stages],
+                               "keys": list(keys), "finished": [], "running": None}
+        # Whatever was rebuilt before no longer matches the tree.
+        self.data.pop("recreation", None)
+        self._save()
+
+    def set_stage_keys(self, keys):
+        self.data["stages"]["keys"] = list(keys)
+        self._save()
+
+    def stage_started(self, index):
+        self.data["stages"]["running"] = index
+        self._save()
+
+    def stage_finished(self, index, return_code, wall_time, tree, cached=False):
+        stages = self.data["stages"]
+        stages["finished"].append({"index": index, "name": stages["commands"][index][0], "return_code": return_code,
+                                   "wall_time": wall_time, "cached": cached, "at": time.time()})
+        stages["running"] = None
+        self.data["tree"] = tree
+        self._save()
+
+    def start_recreation(self, settings, resume=False):
+        """Begin rebuilding the ISO with `settings`.
+
+        With `resume`, the steps an interrupted rebuild with the same settings
+        already finished are kept.
+        """
+        recreation = self.data.get("recreation")
+        if not resume or recreation is None or recreation["settings"] != settings:
+            self.data["recreation"] = {"settings": settings, "finished": {}}
+        self.data.pop("finished", None)
+        self._save()
+
+    def recreation_step_finished(self, step, tree, **outputs):
+        self.data["recreation"]["finished"][step] = dict(outputs, tree=tree, at=time.time())
+        self._save()
+
+    def build_finished(self, output_iso):
+        self.data["finished"] = {"output": output_iso, "at": time.time()}
+        self._save()
+
+    # Resuming
+
+    def resumable(self):
+        """True if extraction completed and the build did not."""
+        return "layout" in self.data and "finished" not in self.data
+
+    def stages(self):
+        """Return the [(name, command)] of the stage run, or []."""
+        stages = self.data.get("stages")
+        return [(name, command) for name, command in stages["commands"]] if stages else []
+
+    def stage_keys(self):
+        """The stage cache keys of the stages, or [] once one failed and the tree left their path."""
+        stages = self.data.get("stages")
+        if not stages or any(stage["return_code"] != 0 for stage in stages["finished"]):
+            return []
+        return stages["keys"]
+
+    def first_incomplete_stage(self):
+        """Index of the first stage that did not finish, or None if they all did (or none were run)."""
+        stages = self.data.get("stages")
+        if not stages:
+            return None
+        finished = {stage["index"] for stage in stages["finished"]}
+        for index in range(len(stages["commands"])):
+            if index not in finished:
+                return index
+        return None
+
+    def interrupted_stage(self):
+        """Index of a stage that was running when the build stopped, or None."""
+        stages = self.data.get("stages")
+        return stages["running"] if stages else None
+
+    def recreation_settings(self):
+        recreation = self.data.get("recreation")
+        return recreation["settings"] if recreation else None
+
+    def recreation_step_done(self, step, tree):
+        """True if `step` of the ISO rebuild finished and the tree has not changed since."""
+        recreation = self.data.get("recreation")
+        if recreation is None or step not in recreation["finished"]:
+            return False
+        return recreation["finished"][step]["tree"] == tree
+
+    def check(self):
+        """Raise ValueError if the build cannot be resumed; return warnings about changes since it stopped."""
+        settings, layout = self.data["settings"], self.data["layout"]
+        if file_signature(settings["iso_file"]) != self.data["iso"]:
+            raise ValueError(f"{settings['iso_file']} is missing or has changed.")
+        for path in (layout["extracted_iso_path"], layout["root_fs_path"]):
+            if not os.path.isdir(path):
+                raise ValueError(f"{path} is missing.")
+        warnings = []
+        # An interrupted stage leaves the tree somewhere between two records.
+        if self.interrupted_stage() is None and tree_signature(layout["root_fs_path"]) != self.data["tree"]:
+            warnings.append("The root filesystem was changed after the last recorded step.")
+        return warnings
+
+    def summary(self):
+        """A few lines describing how far the build got, for the resume prompt."""
+        settings = self.data["settings"]
+        lines = [f"ISO: {settings['iso_file']}", "Extraction: done"]
+        stages = self.data.get("stages")
+        if stages:
+            finished = {stage["index"] for stage in stages["finished"]}
+            for index, (name, _command) in enumerate(stages["commands"]):
+                if index in finished:
+                    state = "done"
+                elif index == stages["running"]:
+                    state = "interrupted"
+                else:
+                    state = "not started"
+                lines.append(f"{name}: {state}")
+        recreation = self.data.get("recreation")
+        if recreation is not None:
+            done = ", ".join(recreation["finished"]) or "nothing finished"
+            lines.append(f"ISO rebuild to {recreation['settings']['output']}: {done}")
+        return "\n".join(lines)
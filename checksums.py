@@ -0,0 +1,189 @@
+import hashlib
+import os
+import re
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from iso_selection import under
+from manifest import TreeManifest
+
+MD5SUM_FILE = "md5sum.txt"
+
+# "<digest>  ./path" or "<digest> *path", as written by md5sum and sha256sum.
+_SUM_LINE = re.compile(r"^([0-9a-fA-F]+) [ *](?:\./)?(.+)$")
+
+# Never listed: the list itself, the El Torito boot catalog xorriso writes, and
+# isolinux.bin, which -boot-info-table patches inside the ISO.
+EXCLUDED_PATHS = {
+    MD5SUM_FILE,
+    os.path.join("isolinux", "boot.cat"),
+    "boot.catalog",
+    os.path.join("isolinux", "isolinux.bin"),
+}
+
+# md5 releases the GIL on large updates, so threads hash files in parallel.
+HASH_WORKERS = os.cpu_count() or 1
+READ_SIZE = 4 << 20
+
+_buffers = threading.local()
+
+
+def _hash_file(digest, path, offset=0, size=None, cancel_event=None):
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None:
+        buffer = _buffers.buffer = bytearray(READ_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as data:
+        # Let the kernel read ahead aggressively; this is one long sequential read.
+        os.posix_fadvise(data.fileno(), offset, size or 0, os.POSIX_FADV_SEQUENTIAL)
+        data.seek(offset)
+        remaining = size
+        while remaining is None or remaining > 0:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            count = data.readinto(view if remaining is None or remaining >= READ_SIZE else view[:remaining])
+            if not count:
+                break
+            digest.update(view[:count])
+            if remaining is not None:
+                remaining -= count
+    if remaining:
+        raise ValueError(f"{path} ends {remaining} bytes early")
+    return digest.digest()
+
+
+def md5_file(path, offset=0, size=None):
+    """Return the md5 digest of the file at `path` as bytes.
+
+    With `offset` and `size` only that range is hashed, e.g. a file's extent
+    inside an ISO.
+    """
+    return _hash_file(hashlib.md5(), path, offset, size)
+
+
+def sha256_file(path, cancel_event=None):
+    """Return the SHA-256 digest of `path` as bytes, or None when cancelled."""
+    return _hash_file(hashlib.sha256(), path, cancel_event=cancel_event)
+
+
+def read_sums(path):
+    """Return {path: hex digest} from an md5sum.txt or SHA256SUMS file."""
+    sums = {}
+    with open(path, encoding="utf-8", errors="surrogateescape") as sums_file:
+        for line in sums_file:
+            match = _SUM_LINE.match(line.rstrip("\n"))
+            if match:
+                sums[match.group(2)] = match.group(1).lower()
+    return sums
+
+
+def verify_iso(iso_path, sums_path=None, cancel_event=None):
+    """Hash the ISO and look it up in the SHA256SUMS file at `sums_path`, if any.
+
+    Returns a dict with the 'sha256' hex digest and the 'expected' one
+    (None when there is no SUMS file or the ISO is not listed in it), or
+    None when cancelled.
+    """
+    expected = read_sums(sums_path).get(os.path.basename(iso_path)) if sums_path else None
+    digest = sha256_file(iso_path, cancel_event)
+    if digest is None:
+        return None
+    return {'sha256': digest.hex(), 'expected': expected}
+
+
+def write_md5sums(tree, manifest_path, cancel_event=None, skipped=()):
+    """Regenerate `tree`/md5sum.txt for every regular file in `tree`.
+
+    Digests are cached in the TreeManifest at `manifest_path`; a file whose
+    inode, size and mtime have not changed since the last run is not read
+    again. Lines are "<md5>  ./<path>" in byte order of the path, as
+    md5sum.txt on Debian and Ubuntu media. Paths under `skipped`, left in
+    the ISO rather than extracted, keep their lines from the old list
+    unless they are on disk. Returns (files listed, files hashed), or None
+    when cancelled.
+    """
+    sums_path = os.path.join(tree, MD5SUM_FILE)
+    kept = {}
+    if skipped and os.path.exists(sums_path):
+        kept = {path: bytes.fromhex(digest) for path, digest in read_sums(sums_path).items()
+                if under(path, skipped)}
+    with TreeManifest(manifest_path, tree) as manifest:
+        manifest.refresh()
+        entries = manifest.entries()
+        files = sorted((path for path, entry in entries.items()
+                        if stat.S_ISREG(entry.mode) and path not in EXCLUDED_PATHS), key=os.fsencode)
+        digests = manifest.digests()
+        # Biggest first, so one large image does not start last and run alone.
+        missing = sorted((path for path in files if path not in digests),
+                         key=lambda path: entries[path].size, reverse=True)
+
+        def hash_one(path):
+            if cancel_event is not None and cancel_event.is_set():
+                return path, None
+            return path, md5_file(os.path.join(tree, path))
+
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="md5sum") as pool:
+            computed = dict(pool.map(hash_one, missing))
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        manifest.store_digests(computed)
+        digests.update(computed)
+
+    for path, digest in kept.items():
+        if path not in entries:
+            files.append(path)
+            digests[path] = digest
+    files.sort(key=os.fsencode)
+    temporary_path = os.path.join(tree, MD5SUM_FILE + ".tmp")
+    with open(temporary_path, "w", encoding="utf-8", errors="surrogateescape") as md5sums:
+        for path in files:
+            md5sums.write(f"{digests[path].hex()}  ./{path}\n")
+    os.replace(temporary_path, sums_path)
+    return len(files), len(missing)
+
+
+def verify_md5sums(tree, manifest_path, extents=None, cancel_event=None, skipped=()):
+    """Check the files in `tree` against the md5sum.txt that came with them.
+
+    `extents` maps paths that were not extracted to the (file, offset,
+    size) holding their data, such as a squashfs read in place from the ISO.
+    Paths under `skipped` that were not extracted are not checked.
+    Files are hashed on a thread pool and the digests stored in the
+    TreeManifest at `manifest_path`, so write_md5sums() later only rereads
+    what changed. Returns a dict of 'checked' count and 'mismatched' and
+    'missing' paths, or None when cancelled.
+    """
+    extents = extents or {}
+    listed = {path: digest for path, digest in read_sums(os.path.join(tree, MD5SUM_FILE)).items()
+              if path not in EXCLUDED_PATHS}
+    if skipped:
+        listed = {path: digest for path, digest in listed.items()
+                  if path in extents or not under(path, skipped) or os.path.lexists(os.path.join(tree, path))}
+    with TreeManifest(manifest_path, tree) as manifest:
+        manifest.refresh()
+        entries = manifest.entries()
+        digests = manifest.digests()
+        present = [path for path in listed if path in entries and stat.S_ISREG(entries[path].mode)]
+        missing = sorted(path for path in listed if path not in entries and path not in extents)
+        to_hash = sorted((path for path in present if path not in digests),
+                         key=lambda path: entries[path].size, reverse=True)
+        to_hash += [path for path in listed if path in extents and path not in entries]
+
+        def hash_one(path):
+            if cancel_event is not None and cancel_event.is_set():
+                return path, None
+            if path in extents:
+                return path, md5_file(*extents[path])
+            return path, md5_file(os.path.join(tree, path))
+
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="md5sum") as pool:
+            computed = dict(pool.map(hash_one, to_hash))
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        manifest.store_digests({path: digest for path, digest in computed.items() if path in entries})
+        digests.update(computed)
+
+    checked = [path for path in listed if path in digests]
+    mismatched = sorted(path for path in checked if digests[path].hex() != listed[path])
+    return {'checked': len(checked), 'mismatched': mismatched, 'missing': missing}
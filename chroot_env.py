@@ -0,0 +1,172 @@
+import os
+import re
+import shutil
+import signal
+import subprocess
+import threading
+import time
+
+# Mounted in this order, unmounted in reverse. Paths are relative to the root.
+CHROOT_MOUNTS = (
+    ("proc", ["-t", "proc", "proc"]),
+    ("sys", ["-t", "sysfs", "sysfs"]),
+    ("dev", ["--bind", "/dev"]),
+    ("dev/pts", ["--bind", "/dev/pts"]),
+    ("run", ["-t", "tmpfs", "tmpfs"]),
+)
+
+
+class ChrootEnvironmentError(Exception):
+    pass
+
+
+def _mount_namespace(pid):
+    return os.readlink(f"/proc/{pid}/ns/mnt")
+
+
+def _is_mount_point(path):
+    # os.path.ismount() resolves ".." with realpath(), which would leave the
+    # namespace when `path` goes through /proc/<pid>/root.
+    try:
+        status = os.lstat(path)
+        parent = os.lstat(os.path.join(path, ".."))
+    except OSError:
+        return False
+    return status.st_dev != parent.st_dev or status.st_ino == parent.st_ino
+
+
+def mounts_under(root):
+    """Return the mount points of this mount namespace at or below `root`."""
+    root = os.path.realpath(root)
+    mounts = []
+    with open("/proc/self/mountinfo") as mountinfo:
+        for line in mountinfo:
+            # Octal escapes such as \040 stand for spaces in the mount point.
+            mount_point = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), line.split()[4])
+            if mount_point == root or mount_point.startswith(root + os.sep):
+                mounts.append(mount_point)
+    return mounts
+
+
+class ChrootEnvironment:
+    """/proc, /sys, /dev, /dev/pts and /run for a chroot, shared by refcount.
+
+    The first acquire() sets the mounts up and the last release() removes
+    them, so concurrent commands (and a long-lived ChrootSession) share one
+    set of mounts.
+
+    When unshare and nsenter are available the mounts are made inside a
+    private mount namespace held open by a keeper process; they are never
+    visible on the host and vanish with the namespace. Commands must then be
+    started through wrap(). Otherwise the host's namespace is used and the
+    mounts are lazily unmounted on teardown.
+    """
+    NAMESPACE_TIMEOUT = 5.0
+
+    def __init__(self, root, use_namespace=None):
+        self.root = root
+        if use_namespace is None:
+            use_namespace = bool(shutil.which("unshare") and shutil.which("nsenter"))
+        self.use_namespace = use_namespace
+        self._refs = 0
+        self._keeper = None
+        self._mounted = []
+        self._lock = threading.RLock()
+
+    def acquire(self):
+        with self._lock:
+            if self._refs == 0:
+                self._setup()
+            self._refs += 1
+
+    def release(self):
+        with self._lock:
+            if self._refs == 0:
+                return
+            self._refs -= 1
+            if self._refs == 0:
+                self._teardown()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def wrap(self, command):
+        """Return `command` adjusted to run in the environment's mount namespace."""
+        keeper = self._keeper
+        if keeper is None:
+            return list(command)
+        return ["nsenter", f"--target={keeper.pid}", "--mount", "--"] + list(command)
+
+    def _setup(self):
+        if self.use_namespace:
+            try:
+                self._start_keeper()
+            except (OSError, ChrootEnvironmentError) as e:
+                print(f"Private mount namespace unavailable, mounting on the host: {e}")
+                self._stop_keeper()
+        try:
+            for target, args in CHROOT_MOUNTS:
+                path = os.path.join(os.path.abspath(self.root), target)
+                if not os.path.isdir(self._visible_path(path)):
+                    continue
+                # Leave mounts made by someone else alone.
+                if _is_mount_point(self._visible_path(path)):
+                    continue
+                self._run(["mount"] + args + [path])
+                self._mounted.append(path)
+        except (OSError, ChrootEnvironmentError):
+            self._teardown()
+            raise
+
+    def _visible_path(self, path):
+        # How `path` looks from inside the namespace, e.g. dev/pts only
+        # exists once dev has been bind-mounted there.
+        if self._keeper is None:
+            return path
+        return f"/proc/{self._keeper.pid}/root{path}"
+
+    def _start_keeper(self):
+        self._keeper = subprocess.Popen(["unshare", "--mount", "--propagation", "private", "sleep", "infinity"],
+                                        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE, start_new_session=True)
+        host_namespace = _mount_namespace("self")
+        deadline = time.monotonic() + self.NAMESPACE_TIMEOUT
+        while time.monotonic() < deadline:
+            if self._keeper.poll() is not None:
+                error = self._keeper.stderr.read().decode(errors="replace").strip()
+                raise ChrootEnvironmentError(error or f"unshare exited with {self._keeper.returncode}")
+            try:
+                if _mount_namespace(self._keeper.pid) != host_namespace:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.01)
+        raise ChrootEnvironmentError("Timed out waiting for unshare")
+
+    def _stop_keeper(self):
+        if self._keeper is not None:
+            if self._keeper.poll() is None:
+                self._keeper.send_signal(signal.SIGKILL)
+            self._keeper.wait()
+            self._keeper.stderr.close()
+            self._keeper = None
+
+    def _run(self, command):
+        result = subprocess.run(self.wrap(command), capture_output=True, text=True)
+        if result.returncode != 0:
+            raise ChrootEnvironmentError(f"{' '.join(command)}: {result.stderr.strip()}")
+
+    def _teardown(self):
+        if self._keeper is not None:
+            # The namespace, and every mount in it, goes away with its last
+            # process.
+            self._stop_keeper()
+        else:
+            for path in reversed(self._mounted):
+                # Lazy, so a process still using the mount cannot block it.
+                subprocess.run(["umount", "--lazy", path], capture_output=True)
+        self._mounted = []
@@ -0,0 +1,197 @@
+import codecs
+import fcntl
+import itertools
+import os
+import re
+import select
+import shlex
+import signal
+import subprocess
+import termios
+import threading
+import time
+
+# Printed after every command as "\x1eML-DONE <token> <exit code>\x1e\n".
+_SENTINEL = re.compile(rb"\x1eML-DONE (\S+) (-?\d+)\x1e\n")
+# A sentinel split across two reads is held back at most this long.
+_SENTINEL_MAX = 64
+
+# Sent once when the shell starts. Commands run through __ml_run, which
+# reports the exit code in-band after the command's own output; __ml_done
+# re-synchronises after a cancelled command.
+_SETUP = (
+    "PS1=''; PS2=''; PROMPT_COMMAND=''; set +o history; stty -echo -onlcr; "
+    "export DEBIAN_FRONTEND=noninteractive TERM=dumb; "
+    "__ml_done() { printf '\\036ML-DONE %s %d\\036\\n' \"$1\" \"$2\"; }; "
+    "__ml_run() { eval \"$1\" < /dev/null; __ml_done \"$2\" \"$?\"; }; "
+    "__ml_done ready 0\n"
+)
+
+
+class ChrootSessionError(Exception):
+    pass
+
+
+def _make_controlling_tty():
+    # Runs in the child after setsid(): the pty on stdin becomes the
+    # controlling terminal, so bash gets job control and Ctrl+C works.
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+
+class ChrootSession:
+    """A long-lived interactive bash inside a chroot, driven through a PTY.
+
+    The shell keeps its working directory, variables and functions between
+    commands, and the chroot and bash start-up cost is paid once. Each
+    command's exit code is reported in-band by a sentinel line that is
+    stripped from the output. Commands run one at a time with stdin from
+    /dev/null, like CommandRunnerThread.
+    """
+    START_TIMEOUT = 15.0
+    KILL_TIMEOUT = 5.0
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, root, environment=None):
+        self.root = root
+        # Optional ChrootEnvironment; held for as long as the shell runs.
+        self.environment = environment
+        self._environment_held = False
+        self._process = None
+        self._master = None
+        self._tokens = itertools.count(1)
+        self._lock = threading.RLock()
+
+    def is_alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        command = ["chroot", self.root, "/bin/bash", "--noprofile", "--norc", "--noediting", "-i"]
+        if self.environment is not None and not self._environment_held:
+            self.environment.acquire()
+            self._environment_held = True
+            command = self.environment.wrap(command)
+        master, slave = os.openpty()
+        try:
+            self._process = subprocess.Popen(command, stdin=slave, stdout=slave, stderr=slave,
+                                             start_new_session=True, preexec_fn=_make_controlling_tty)
+        except OSError:
+            os.close(master)
+            self._release_environment()
+            raise
+        finally:
+            os.close(slave)
+        self._master = master
+        os.write(master, _SETUP.encode())
+        deadline = time.monotonic() + self.START_TIMEOUT
+        return_code = self._read_until("ready", lambda text: None,
+                                       lambda: time.monotonic() < deadline)
+        if return_code != 0:
+            self.close()
+            raise ChrootSessionError(f"Could not start a shell in {self.root}")
+
+    def run(self, command, on_output, poll=None):
+        """Run `command` (a string or an argument list) and return its exit code.
+
+        Output is passed to on_output(text) as it arrives. poll(), if given,
+        is called several times a second; when it returns False the command
+        is interrupted like Ctrl+C and killed after KILL_TIMEOUT seconds.
+        Returns -1 if the shell itself went away.
+        """
+        if not isinstance(command, str):
+            command = shlex.join(command)
+        with self._lock:
+            if not self.is_alive():
+                self.start()
+            token = str(next(self._tokens))
+            os.write(self._master, f"__ml_run {shlex.quote(command)} {token}\n".encode())
+            return self._read_until(token, on_output, poll)
+
+    def _read_until(self, token, on_output, poll):
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        pending = b""
+        interrupted_at = None
+        killed = False
+        while True:
+            if interrupted_at is None and poll is not None and not poll():
+                self._interrupt(token)
+                interrupted_at = time.monotonic()
+            elif interrupted_at is not None and not killed and time.monotonic() - interrupted_at >= self.KILL_TIMEOUT:
+                self._kill_foreground()
+                killed = True
+
+            readable, _, _ = select.select([self._master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, self.READ_SIZE)
+            except OSError:
+                # EIO once the shell has exited and the slave side is closed.
+                data = b""
+            if not data:
+                if pending:
+                    on_output(decoder.decode(pending, final=True))
+                self._close_fds()
+                return -1
+            pending += data
+
+            match = _SENTINEL.search(pending)
+            while match:
+                before, pending = pending[:match.start()], pending[match.end():]
+                if before:
+                    on_output(decoder.decode(before))
+                if match.group(1).decode() == token:
+                    return int(match.group(2))
+                # Left over from a command that was cancelled earlier.
+                match = _SENTINEL.search(pending)
+
+            cut = pending.rfind(b"\x1e")
+            if cut == -1 or len(pending) - cut > _SENTINEL_MAX:
+                cut = len(pending)
+            if cut:
+                on_output(decoder.decode(pending[:cut]))
+                pending = pending[cut:]
+
+    def _interrupt(self, token):
+        # Ctrl+C goes to the foreground job; the shell then abandons the rest
+        # of the __ml_run line, so report the command as interrupted.
+        os.write(self._master, b"\x03")
+        os.write(self._master, f"__ml_done {token} 130\n".encode())
+
+    def _kill_foreground(self):
+        try:
+            group = os.tcgetpgrp(self._master)
+            if group != self._process.pid:
+                os.killpg(group, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def _close_fds(self):
+        if self._master is not None:
+            os.close(self._master)
+            self._master = None
+
+    def _release_environment(self):
+        if self._environment_held:
+            self._environment_held = False
+            self.environment.release()
+
+    def close(self):
+        """End the shell, killing whatever still runs in its session."""
+        with self._lock:
+            if self._process is None:
+                self._release_environment()
+                return
+            if self.is_alive():
+                try:
+                    os.write(self._master, b"\x03exit\n")
+                    self._process.wait(timeout=1)
+                except (OSError, subprocess.TimeoutExpired):
+                    pass
+            try:
+                os.killpg(self._process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+            self._process.wait()
+            self._process = None
+            self._close_fds()
+            self._release_environment()
@@ -1,7 +1,12 @@
 import os
 from PyQt6.QtWidgets import (QDialog, QLabel, QLineEdit, QPushButton, QVBoxLayout, 
                              QHBoxLayout, QFileDialog, QGroupBox, QFormLayout, QListView, QComboBox, 
-                             QSpinBox, QCheckBox, QMessageBox)
+                             QSpinBox, QCheckBox, QMessageBox, QTreeView, QPlainTextEdit, QSplitter)
+from PyQt6.QtGui import QFontDatabase
+from iso9660 import export_file
+from iso_models import IsoTreeModel
+from package_models import format_size
+from squashfs import BLOCK_SIZES, COMPRESSION_LEVELS, DEFAULT_BLOCK_SIZE
 
 class PreseedDialog(QDialog):
     def __init__(self, parent=None):
@@ -61,7 +66,7 @@ class KernelSelectionDialog(QDialog):
     def get_selected_kernel(self):
         selected_indexes = self.kernel_list.selectedIndexes()
         if selected_indexes:
-            return self.kernel_model._package_data[selected_indexes[0].row()]['name']
+            return self.kernel_model.package_name(selected_indexes[0].row())
         return None
 
 class AdvancedCompressionDialog(QDialog):
@@ -69,27 +74,40 @@ class AdvancedCompressionDialog(QDialog):
         super().__init__(parent)
         self.setWindowTitle("Advanced Compression Options")
         self.compression_method_combo = QComboBox()
-        self.compression_method_combo.addItems(["gzip", "xz", "bzip2", "lzma", "Custom"])
+        self.compression_method_combo.addItems(list(COMPRESSION_LEVELS) + ["Custom"])
         self.compression_method_combo.currentIndexChanged.connect(self.toggle_custom_options)
         self.custom_options_group = QGroupBox("Custom Options")
         self.custom_command = QLineEdit()
-        self.custom_command.setPlaceholderText("e.g., xz -9 --threads=0")
+        self.custom_command.setPlaceholderText("mksquashfs options, e.g., -comp xz -Xbcj x86 -b 1M")
         custom_layout = QVBoxLayout()
         custom_layout.addWidget(QLabel("Custom Command:"))
         custom_layout.addWidget(self.custom_command)
         self.custom_options_group.setLayout(custom_layout)
         self.custom_options_group.hide()
         self.level_spinbox = QSpinBox()
-        self.level_spinbox.setRange(0, 9)
-        self.level_spinbox.setValue(6)
         self.threads_spinbox = QSpinBox()
         self.threads_spinbox.setRange(0, os.cpu_count())
         self.threads_spinbox.setValue(0)
         self.threads_spinbox.setToolTip("0 = All available cores")
+        self.block_size_combo = QComboBox()
+        for block_size in BLOCK_SIZES:
+            self.block_size_combo.addItem(f"{block_size // 1024}K", block_size)
+        self.block_size_combo.setCurrentIndex(BLOCK_SIZES.index(DEFAULT_BLOCK_SIZE))
+        self.block_size_combo.setToolTip("Larger blocks compress better but make random reads slower")
+        self.fragments_combo = QComboBox()
+        self.fragments_combo.addItem("Pack small files into fragments", "default")
+        self.fragments_combo.addItem("No fragments", "none")
+        self.fragments_combo.addItem("Always use fragments", "always")
+        self.incremental_checkbox = QCheckBox("Only compress files changed since extraction")
+        self.incremental_checkbox.setChecked(True)
+        self.incremental_checkbox.setToolTip("Keeps the original image and adds the changes as a layer on top of it")
         layout = QFormLayout()
         layout.addRow("Compression Method:", self.compression_method_combo)
         layout.addRow("Compression Level:", self.level_spinbox)
         layout.addRow("Threads", self.threads_spinbox)
+        layout.addRow("Block Size:", self.block_size_combo)
+        layout.addRow("Fragments:", self.fragments_combo)
+        layout.addRow(self.incremental_checkbox)
         layout.addRow(self.custom_options_group)
         button_box = QHBoxLayout()
         ok_button = QPushButton("OK")
@@ -100,12 +118,22 @@ class AdvancedCompressionDialog(QDialog):
         button_box.addWidget(cancel_button)
         layout.addRow(button_box)
         self.setLayout(layout)
+        self.toggle_custom_options()
 
     def toggle_custom_options(self):
-        if self.compression_method_combo.currentText() == "Custom":
-            self.custom_options_group.show()
-        else:
-            self.custom_options_group.hide()
+        method = self.compression_method_combo.currentText()
+        custom = method == "Custom"
+        self.custom_options_group.setVisible(custom)
+        self.block_size_combo.setEnabled(not custom)
+        self.fragments_combo.setEnabled(not custom)
+        # Each compressor has its own level range; xz has none.
+        levels = COMPRESSION_LEVELS.get(method)
+        self.level_spinbox.setEnabled(levels is not None)
+        if levels is not None:
+            lowest, highest, default = levels
+            self.level_spinbox.setRange(lowest, highest)
+            self.level_spinbox.setValue(default)
+        self.level_spinbox.setToolTip("0 = normal, 1 = high compression" if method == "lz4" else "")
 
     def get_compression_options(self):
         method = self.compression_method_combo.currentText()
@@ -116,5 +144,155 @@ class AdvancedCompressionDialog(QDialog):
             "method": method,
             "level": level,
             "threads": threads,
+            "block_size": self.block_size_combo.currentData(),
+            "fragments": self.fragments_combo.currentData(),
             "custom_command": custom_command,
+            "incremental": self.incremental_checkbox.isChecked(),
         }
+
+class IsoBrowserDialog(QDialog):
+    # Bytes read for the preview pane; the rest of the file is never touched.
+    PREVIEW_SIZE = 64 * 1024
+
+    def __init__(self, iso_path="", executor=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("ISO Contents")
+        self.resize(900, 600)
+        self.executor = executor
+        self._selected_iso = None
+        self.model = IsoTreeModel(parent=self)
+
+        self.iso_label = QLabel("No ISO opened")
+        open_button = QPushButton("Open ISO...")
+        open_button.clicked.connect(self.browse_iso_file)
+        self.tree_view = QTreeView()
+        self.tree_view.setModel(self.model)
+        self.tree_view.setUniformRowHeights(True)
+        self.tree_view.setColumnWidth(0, 320)
+        self.tree_view.selectionModel().currentChanged.connect(self.show_preview)
+        self.preview = QPlainTextEdit()
+        self.preview.setReadOnly(True)
+        self.preview.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        splitter = QSplitter()
+        splitter.addWidget(self.tree_view)
+        splitter.addWidget(self.preview)
+        self.status_label = QLabel("")
+
+        layout = QVBoxLayout()
+        iso_layout = QHBoxLayout()
+        iso_layout.addWidget(self.iso_label, 1)
+        iso_layout.addWidget(open_button)
+        layout.addLayout(iso_layout)
+        layout.addWidget(splitter, 1)
+        layout.addWidget(self.status_label)
+        button_box = QHBoxLayout()
+        self.export_button = QPushButton("Export...")
+        self.export_button.setEnabled(False)
+        self.export_button.clicked.connect(self.export_selected)
+        use_button = QPushButton("Use This ISO")
+        use_button.clicked.connect(self.accept)
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(self.reject)
+        button_box.addWidget(self.export_button)
+        button_box.addStretch()
+        button_box.addWidget(use_button)
+        button_box.addWidget(close_button)
+        layout.addLayout(button_box)
+        self.setLayout(layout)
+
+        if iso_path:
+            self.open_iso(iso_path)
+
+    def browse_iso_file(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Select ISO File", "", "ISO Files (*.iso);;All Files (*)")
+        if file_path:
+            self.open_iso(file_path)
+
+    def open_iso(self, iso_path):
+        try:
+            self.model.set_iso(iso_path)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Error", f"Could not read {iso_path}: {e}")
+            return False
+        self.iso_label.setText(iso_path)
+        self.preview.clear()
+        self.status_label.setText("")
+        self.export_button.setEnabled(False)
+        return True
+
+    def show_preview(self, current, previous=None):
+        record = self.model.record(current)
+        self.export_button.setEnabled(self.model.is_file(current))
+        if record is None:
+            self.preview.clear()
+        elif record['target'] is not None:
+            self.preview.setPlainText(f"Symbolic link to {record['target']}")
+        elif not self.model.is_file(current):
+            self.preview.setPlainText(f"/{self.model.path(current)}")
+        else:
+            try:
+                data = self.model.read(current, self.PREVIEW_SIZE)
+            except ValueError as e:
+                self.preview.setPlainText(f"Could not read the file: {e}")
+                return
+            self.preview.setPlainText(_preview_text(data, record['size']))
+
+    def export_selected(self):
+        index = self.tree_view.currentIndex()
+        if not self.model.is_file(index):
+            return
+        record = self.model.record(index)
+        destination, _ = QFileDialog.getSaveFileName(self, "Export File", record['name'])
+        if not destination:
+            return
+        iso_path = self.model.iso_path()
+        if self.executor is None:
+            try:
+                written = export_file(iso_path, record, destination)
+            except (OSError, ValueError) as e:
+                self._export_failed(e)
+                return
+            self._export_finished(destination, written)
+            return
+        self.status_label.setText(f"Exporting {record['name']}...")
+        task = self.executor.submit(export_file, iso_path, record, destination,
+                                    description=f"Exporting {record['name']}", cancellable=True)
+        task.finished.connect(lambda written: self._export_finished(destination, written))
+        task.failed.connect(self._export_failed)
+
+    def _export_finished(self, destination, written):
+        if written is None:
+            self.status_label.setText("Export cancelled.")
+        else:
+            self.status_label.setText(f"Exported {format_size(written) or '0 B'} to {destination}")
+
+    def _export_failed(self, error):
+        self.status_label.setText("")
+        QMessageBox.critical(self, "Error", f"Could not export the file: {error}")
+
+    def selected_iso(self):
+        return self._selected_iso
+
+    def done(self, result):
+        self._selected_iso = self.model.iso_path()
+        self.model.close()
+        super().done(result)
+
+
+def _preview_text(data, size):
+    truncated = f"\n... ({format_size(size)} in total)" if size > len(data) else ""
+    if b"\0" not in data:
+        try:
+            return data.decode("utf-8") + truncated
+        except UnicodeDecodeError as e:
+            # A multi-byte character cut in half at the end of the preview.
+            if truncated and e.start > len(data) - 4:
+                return data[:e.start].decode("utf-8") + truncated
+    lines = []
+    for offset in range(0, min(len(data), 4096), 16):
+        row = data[offset:offset + 16]
+        text = "".join(chr(byte) if 32 <= byte < 127 else "." for byte in row)
+        lines.append(f"{offset:08x}  {row.hex(' '):<47}  {text}")
+    if size > 4096:
+        lines.append(f"... ({format_size(size)} in total)")
+    return "\n".join(lines)
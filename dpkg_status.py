@@ -0,0 +1,206 @@
+import mmap
+import os
+
+DPKG_STATUS_PATH = os.path.join("var", "lib", "dpkg", "status")
+
+# dpkg states that still have a current version unpacked on disk. Packages in
+# "not-installed" or "config-files" are left out, matching `apt list --installed`.
+_INSTALLED_STATES = {
+    "installed",
+    "half-installed",
+    "unpacked",
+    "half-configured",
+    "triggers-awaited",
+    "triggers-pending",
+}
+
+# Field name -> key in the package rows handed to PackageListModel.
+_STATUS_FIELDS = {
+    b"Package": "name",
+    b"Version": "version",
+    b"Architecture": "architecture",
+    b"Installed-Size": "installed_size",
+    b"Section": "section",
+    b"Priority": "priority",
+    b"Status": "status",
+}
+
+
+def iter_stanzas(buf, start=0):
+    """Yield (offset, length) for each paragraph of a deb822 buffer.
+
+    Works on bytes or an mmap, so callers can stream a multi-megabyte file
+    one stanza at a time without reading it into memory.
+    """
+    size = len(buf)
+    pos = start
+    while pos < size:
+        # Skip the blank line(s) separating paragraphs.
+        while pos < size and buf[pos:pos + 1] == b"\n":
+            pos += 1
+        if pos >= size:
+            break
+        end = buf.find(b"\n\n", pos)
+        if end == -1:
+            end = size
+        yield pos, end - pos
+        pos = end + 2
+
+
+def parse_fields(stanza, wanted):
+    """Return the fields of a single stanza that appear in `wanted`.
+
+    Continuation lines (long Description, Conffiles...) are skipped and only
+    the wanted values are decoded.
+    """
+    fields = {}
+    for line in stanza.split(b"\n"):
+        if not line or line[:1] in (b" ", b"\t"):
+            continue
+        key, sep, value = line.partition(b":")
+        if not sep:
+            continue
+        name = wanted.get(key)
+        if name is not None:
+            fields[name] = value.strip().decode("utf-8", "replace")
+    return fields
+
+
+def _is_installed(status):
+    # Status is "<want> <error flag> <state>", e.g. "install ok installed".
+    parts = status.split()
+    return len(parts) == 3 and parts[2] in _INSTALLED_STATES
+
+
+def _package_row(fields):
+    try:
+        # Installed-Size is given in KiB.
+        installed_size = int(fields.get("installed_size", "0")) * 1024
+    except ValueError:
+        installed_size = 0
+    return {
+        'name': fields["name"],
+        'version': fields.get("version", ""),
+        'architecture': fields.get("architecture", ""),
+        'installed_size': installed_size,
+        'section': fields.get("section", ""),
+        'priority': fields.get("priority", ""),
+        'remove': False,
+    }
+
+
+def _iter_status_file(status_file):
+    try:
+        if os.fstat(status_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(status_file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for offset, length in iter_stanzas(buf):
+                fields = parse_fields(buf[offset:offset + length], _STATUS_FIELDS)
+                if "name" not in fields or not _is_installed(fields.get("status", "")):
+                    continue
+                yield _package_row(fields)
+    finally:
+        status_file.close()
+
+
+def iter_installed_packages(root):
+    """Stream package rows for everything installed in the tree at `root`.
+
+    Reads <root>/var/lib/dpkg/status directly, so no chroot, apt or root
+    privileges are needed. The database is opened before returning, so an
+    OSError surfaces here rather than on the first row.
+    """
+    return _iter_status_file(open(os.path.join(root, DPKG_STATUS_PATH), "rb"))
+
+
+def read_installed_packages(root):
+    """Return the installed packages of `root` sorted by name, like `apt list`."""
+    return sorted(iter_installed_packages(root), key=lambda pkg: (pkg['name'], pkg['architecture']))
+
+
+def read_installed_kernels(root):
+    """Return the installed linux-image-* packages of `root`, e.g. an unpacked live root filesystem."""
+    return [pkg for pkg in read_installed_packages(root) if pkg['name'].startswith("linux-image-")]
+
+
+def read_field(stanza, field):
+    """Return the full value of `field` in a stanza, continuation lines included."""
+    prefix = field.encode() + b":"
+    lines = stanza.split(b"\n")
+    for i, line in enumerate(lines):
+        if line.startswith(prefix):
+            value = [line[len(prefix):].strip()]
+            for cont in lines[i + 1:]:
+                if cont[:1] not in (b" ", b"\t"):
+                    break
+                # A lone "." marks an empty line in multi-line fields.
+                cont = cont[1:]
+                value.append(b"" if cont.strip() == b"." else cont)
+            return b"\n".join(value).decode("utf-8", "replace")
+    return ""
+
+
+def _char_order(c):
+    # Sort order used by dpkg for the non-digit parts of a version.
+    if c == "~":
+        return -1
+    if c.isdigit() or not c:
+        return 0
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+
+def _compare_part(a, b):
+    i = j = 0
+    while i < len(a) or j < len(b):
+        while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+            ac = _char_order(a[i] if i < len(a) else "")
+            bc = _char_order(b[j] if j < len(b) else "")
+            if ac != bc:
+                return ac - bc
+            i += 1
+            j += 1
+        while i < len(a) and a[i] == "0":
+            i += 1
+        while j < len(b) and b[j] == "0":
+            j += 1
+        first_diff = 0
+        while i < len(a) and a[i].isdigit() and j < len(b) and b[j].isdigit():
+            if not first_diff:
+                first_diff = ord(a[i]) - ord(b[j])
+            i += 1
+            j += 1
+        if i < len(a) and a[i].isdigit():
+            return 1
+        if j < len(b) and b[j].isdigit():
+            return -1
+        if first_diff:
+            return first_diff
+    return 0
+
+
+def _split_version(version):
+    epoch, sep, rest = version.partition(":")
+    if not sep:
+        epoch, rest = "0", version
+    upstream, sep, revision = rest.rpartition("-")
+    if not sep:
+        upstream, revision = rest, ""
+    try:
+        epoch = int(epoch)
+    except ValueError:
+        epoch = 0
+    return epoch, upstream, revision
+
+
+def compare_versions(a, b):
+    """Compare two Debian versions like `dpkg --compare-versions`.
+
+    Returns a negative number, zero or a positive number.
+    """
+    a_epoch, a_upstream, a_revision = _split_version(a)
+    b_epoch, b_upstream, b_revision = _split_version(b)
+    if a_epoch != b_epoch:
+        return a_epoch - b_epoch
+    return _compare_part(a_upstream, b_upstream) or _compare_part(a_revision, b_revision)
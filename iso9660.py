@@ -0,0 +1,536 @@
+import datetime
+import mmap
+import os
+import posixpath
+import re
+import struct
+import zlib
+
+SECTOR_SIZE = 2048
+# Volume descriptors start at sector 16.
+_DESCRIPTORS_START = 16
+_BOOT_RECORD = 0
+_PRIMARY_DESCRIPTOR = 1
+_SUPPLEMENTARY_DESCRIPTOR = 2
+_TERMINATOR = 255
+_ROOT_RECORD_OFFSET = 156
+# Escape sequences of the three Joliet levels (UCS-2 names).
+_JOLIET_ESCAPES = (b"%/@", b"%/C", b"%/E")
+_EL_TORITO = b"EL TORITO SPECIFICATION"
+
+# Bytes per copy_file_range() call, so an export can be cancelled part way.
+_COPY_CHUNK = 64 << 20
+
+_FLAG_DIRECTORY = 0x02
+# The file continues in the next record (files over 4 GiB).
+_FLAG_MULTI_EXTENT = 0x80
+
+_BOTH_ENDIAN_U32 = struct.Struct("<I4x")
+_PATH_TABLE_ENTRY = struct.Struct("<BBIH")
+
+_BOOT_PLATFORMS = {0x00: "BIOS", 0x01: "PowerPC", 0x02: "Mac", 0xEF: "EFI"}
+_BOOT_MEDIA = {0: "no emulation", 1: "1.2M floppy", 2: "1.44M floppy", 3: "2.88M floppy", 4: "hard disk"}
+
+# Machine fields of PE (EFI loaders, kernels with an EFI stub) and ELF
+# headers, by Debian architecture name.
+_PE_MACHINES = {0x014C: "i386", 0x8664: "amd64", 0x01C2: "armhf", 0x01C4: "armhf", 0xAA64: "arm64",
+                0x5064: "riscv64", 0x6264: "loong64"}
+_ELF_MACHINES = {3: "i386", 62: "amd64", 40: "armhf", 183: "arm64", 21: "ppc64el", 22: "s390x",
+                 243: "riscv64", 258: "loong64"}
+# Where live and installer media keep their kernels.
+_KERNEL_DIRECTORIES = ("casper", "live", "install.amd", "install.386", "install.a64", "install", "boot", "isolinux")
+
+
+def _text(field):
+    return bytes(field).decode("ascii", "replace").strip(" \0")
+
+
+def _volume_date(field):
+    # "YYYYMMDDHHMMSScc" and an offset from UTC in 15 minute steps; unset is all "0".
+    digits = bytes(field[:16])
+    if not digits.strip(b"0 \0"):
+        return None
+    try:
+        zone = datetime.timezone(datetime.timedelta(minutes=15 * struct.unpack("b", field[16:17])[0]))
+        return datetime.datetime.strptime(digits[:14].decode("ascii"), "%Y%m%d%H%M%S").replace(tzinfo=zone)
+    except ValueError:
+        return None
+
+
+def _record_date(field):
+    # Years since 1900, month, day, hour, minute, second, offset from UTC.
+    year, month, day, hour, minute, second, offset = struct.unpack("6Bb", field)
+    try:
+        zone = datetime.timezone(datetime.timedelta(minutes=15 * offset))
+        return datetime.datetime(1900 + year, month, day, hour, minute, second, tzinfo=zone)
+    except ValueError:
+        return None
+
+
+def _iso_name(name):
+    # "FILESYSTEM.SQUASHFS;1" -> "filesystem.squashfs"; \0 and \1 are . and ..
+    if name in (b"\0", b"\1"):
+        return name.decode()
+    name = name.decode("ascii", "replace").split(";")[0]
+    return name.rstrip(".").lower()
+
+
+def _joliet_name(name):
+    if name in (b"\0", b"\1"):
+        return name.decode()
+    return name.decode("utf-16-be", "replace").split(";")[0]
+
+
+class IsoImage:
+    """Read-only view of an ISO 9660 image through mmap.
+
+    Parses the volume descriptors, the El Torito boot catalog and the path
+    table, and lists directories on demand. Names come from Rock Ridge when
+    the image has it, else from Joliet, else the plain ISO 9660 names.
+    Directory records are dicts with 'name', 'extent', 'size', 'flags',
+    'mode' (Rock Ridge only), 'target' (symlinks), 'date' and 'extents', the
+    list of (sector, size) pieces the data is stored in.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as iso_file:
+            try:
+                self._map = mmap.mmap(iso_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"{path} is empty")
+        try:
+            self._read_descriptors()
+        except Exception:
+            self._map.close()
+            raise
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _sectors(self, lba, size):
+        start = lba * SECTOR_SIZE
+        if start + size > len(self._map):
+            raise ValueError("ISO image is truncated")
+        return self._map[start:start + size]
+
+    def _read_descriptors(self):
+        primary = joliet = None
+        self.boot_catalog = None
+        lba = _DESCRIPTORS_START
+        while True:
+            descriptor = self._sectors(lba, SECTOR_SIZE)
+            if descriptor[1:6] != b"CD001":
+                raise ValueError("Not an ISO 9660 image")
+            kind = descriptor[0]
+            if kind == _TERMINATOR:
+                break
+            if kind == _PRIMARY_DESCRIPTOR and primary is None:
+                primary = descriptor
+            elif kind == _SUPPLEMENTARY_DESCRIPTOR and bytes(descriptor[88:91]) in _JOLIET_ESCAPES:
+                joliet = descriptor
+            elif kind == _BOOT_RECORD and bytes(descriptor[7:7 + len(_EL_TORITO)]) == _EL_TORITO:
+                self.boot_catalog, = struct.unpack_from("<I", descriptor, 71)
+            lba += 1
+        if primary is None:
+            raise ValueError("ISO image has no primary volume descriptor")
+
+        self.system_id = _text(primary[8:40])
+        self.volume_id = _text(primary[40:72])
+        self.volume_size, = _BOTH_ENDIAN_U32.unpack_from(primary, 80)
+        self.volume_size *= SECTOR_SIZE
+        self.volume_set_id = _text(primary[190:318])
+        self.publisher = _text(primary[318:446])
+        self.preparer = _text(primary[446:574])
+        self.application_id = _text(primary[574:702])
+        self.created = _volume_date(primary[813:830])
+        self.modified = _volume_date(primary[830:847])
+        self._path_table_size, = _BOTH_ENDIAN_U32.unpack_from(primary, 132)
+        self._path_table, = struct.unpack_from("<I", primary, 140)
+
+        self.joliet = False
+        self.root = self._parse_record(primary[_ROOT_RECORD_OFFSET:_ROOT_RECORD_OFFSET + 34])
+        # The root's "." record carries the SUSP "SP" entry when Rock Ridge is used.
+        dot = next(self._records(self.root), None)
+        self.rock_ridge = dot is not None and dot['rock_ridge']
+        if not self.rock_ridge and joliet is not None:
+            self.joliet = True
+            self.root = self._parse_record(joliet[_ROOT_RECORD_OFFSET:_ROOT_RECORD_OFFSET + 34])
+        self.root['name'] = ""
+
+    def _parse_record(self, record):
+        # length, extended attribute length, extent (both-endian), size
+        # (both-endian), date, flags, unit size, gap, volume number, name length.
+        extent, = _BOTH_ENDIAN_U32.unpack_from(record, 2)
+        size, = _BOTH_ENDIAN_U32.unpack_from(record, 10)
+        flags = record[25]
+        name_length = record[32]
+        name = bytes(record[33:33 + name_length])
+        entry = {
+            'name': _joliet_name(name) if self.joliet else _iso_name(name),
+            'extent': extent,
+            'size': size,
+            'flags': flags,
+            'mode': None,
+            'target': None,
+            'date': _record_date(record[18:25]),
+            'extents': [(extent, size)],
+            'rock_ridge': False,
+        }
+        if not self.joliet:
+            # The system use area (Rock Ridge) follows the name, padded to even.
+            self._rock_ridge(record[33 + name_length + (1 - name_length % 2):record[0]], entry)
+        return entry
+
+    def _rock_ridge(self, system_use, entry):
+        # SUSP entries: signature, length, version, data. A "CE" entry moves
+        # the rest of the area to a continuation block; "NM" and "SL" may be split.
+        names, links = [], []
+        areas = [system_use]
+        while areas:
+            area = areas.pop()
+            pos = 0
+            while pos + 4 <= len(area):
+                signature, length = bytes(area[pos:pos + 2]), area[pos + 2]
+                if length < 4 or pos + length > len(area):
+                    break
+                data = area[pos + 4:pos + length]
+                if signature in (b"SP", b"RR", b"PX", b"NM", b"SL", b"TF"):
+                    entry['rock_ridge'] = True
+                if signature == b"NM":
+                    names.append(bytes(data[1:]))
+                elif signature == b"PX":
+                    entry['mode'], = _BOTH_ENDIAN_U32.unpack_from(data, 0)
+                elif signature == b"SL":
+                    links.append(bytes(data[1:]))
+                elif signature == b"CE":
+                    block, = _BOTH_ENDIAN_U32.unpack_from(data, 0)
+                    offset, = _BOTH_ENDIAN_U32.unpack_from(data, 8)
+                    size, = _BOTH_ENDIAN_U32.unpack_from(data, 16)
+                    try:
+                        areas.append(self._sectors(block, offset + size)[offset:])
+                    except ValueError:
+                        pass
+                elif signature == b"ST":
+                    break
+                pos += length
+        if names:
+            entry['name'] = b"".join(names).decode("utf-8", "replace")
+        if links:
+            entry['target'] = _symlink_target(b"".join(links))
+
+    def _records(self, record):
+        data = self._sectors(record['extent'], record['size'])
+        pos = 0
+        while pos < len(data):
+            length = data[pos]
+            if length == 0:
+                # Records never straddle sectors; the rest of this one is padding.
+                pos = (pos // SECTOR_SIZE + 1) * SECTOR_SIZE
+                continue
+            yield self._parse_record(data[pos:pos + length])
+            pos += length
+
+    def listdir(self, directory):
+        """Return the records in the directory record `directory`, without . and .."""
+        entries = []
+        pending = None
+        for entry in self._records(directory):
+            if entry['name'] in ("\0", "\1"):
+                continue
+            if pending is not None:
+                # The next piece of a multi-extent file; it repeats the name.
+                pending['extents'].append((entry['extent'], entry['size']))
+                pending['size'] += entry['size']
+                if not entry['flags'] & _FLAG_MULTI_EXTENT:
+                    pending = None
+                continue
+            entries.append(entry)
+            if entry['flags'] & _FLAG_MULTI_EXTENT:
+                pending = entry
+        return entries
+
+    def lookup(self, path):
+        """Return the record of `path` (relative to the root), or None."""
+        record = self.root
+        for component in path.strip("/").split("/"):
+            if not component:
+                continue
+            if not record['flags'] & _FLAG_DIRECTORY:
+                return None
+            record = _lookup(self.listdir(record), component)
+            if record is None:
+                return None
+        return record
+
+    def walk(self, top=""):
+        """Yield (directory path, records) for `top` and every directory below it."""
+        stack = [(top.strip("/"), self.lookup(top))]
+        while stack:
+            path, record = stack.pop()
+            if record is None or not record['flags'] & _FLAG_DIRECTORY:
+                continue
+            entries = self.listdir(record)
+            yield path, entries
+            for entry in reversed(entries):
+                if entry['flags'] & _FLAG_DIRECTORY:
+                    stack.append((posixpath.join(path, entry['name']), entry))
+
+    def directories(self):
+        """Return the directory paths listed in the path table, without reading any directory.
+
+        The path table only has ISO 9660 names (8.3 on older media), returned
+        in lower case like the other plain ISO 9660 names.
+        """
+        table = self._sectors(self._path_table, self._path_table_size)
+        paths = []
+        pos = 0
+        while pos + _PATH_TABLE_ENTRY.size <= len(table):
+            name_length, _attributes, _extent, parent = _PATH_TABLE_ENTRY.unpack_from(table, pos)
+            if name_length == 0:
+                break
+            name = bytes(table[pos + 8:pos + 8 + name_length])
+            if not paths:
+                paths.append("")
+            elif 0 < parent <= len(paths):
+                paths.append(posixpath.join(paths[parent - 1], _iso_name(name)))
+            pos += 8 + name_length + name_length % 2
+        return paths
+
+    def read(self, record, offset=0, size=None):
+        """Return `size` bytes of the file `record`, starting at `offset`."""
+        end = record['size'] if size is None else min(record['size'], offset + size)
+        chunks = []
+        for extent, extent_size in record['extents']:
+            if offset < extent_size and offset < end:
+                chunks.append(self._sectors(extent, extent_size)[offset:min(extent_size, end)])
+            offset = max(0, offset - extent_size)
+            end -= extent_size
+            if end <= 0:
+                break
+        return b"".join(chunks)
+
+    def boot_records(self):
+        """Return the El Torito boot entries as dicts, the default entry first."""
+        if self.boot_catalog is None:
+            return []
+        catalog = self._sectors(self.boot_catalog, SECTOR_SIZE)
+        if catalog[0] != 1 or bytes(catalog[30:32]) != b"\x55\xaa":
+            return []
+        records = [_boot_entry(catalog[32:64], catalog[1])]
+        pos = 64
+        while pos + 32 <= len(catalog) and catalog[pos] in (0x90, 0x91):
+            platform, count = catalog[pos + 1], struct.unpack_from("<H", catalog, pos + 2)[0]
+            last = catalog[pos] == 0x91
+            pos += 32
+            for _ in range(count):
+                if pos + 32 > len(catalog):
+                    break
+                records.append(_boot_entry(catalog[pos:pos + 32], platform))
+                pos += 32
+            if last:
+                break
+        return records
+
+    def architecture(self):
+        """Guess the Debian architecture name from the EFI loaders or the kernel's header, or None."""
+        efi_boot = self.lookup("efi/boot")
+        found = []
+        if efi_boot is not None and efi_boot['flags'] & _FLAG_DIRECTORY:
+            for entry in self.listdir(efi_boot):
+                if entry['name'].lower().startswith("boot") and entry['name'].lower().endswith(".efi"):
+                    found.append(executable_architecture(self.read(entry, 0, 4096)))
+        found = [architecture for architecture in dict.fromkeys(found) if architecture]
+        # Media for one architecture sometimes carry a 32-bit EFI loader for
+        # old firmware too; the kernel settles it.
+        if len(found) == 1:
+            return found[0]
+        for directory in _KERNEL_DIRECTORIES:
+            record = self.lookup(directory)
+            if record is None or not record['flags'] & _FLAG_DIRECTORY:
+                continue
+            for entry in self.listdir(record):
+                if entry['name'].startswith("vmlinu") and not entry['flags'] & _FLAG_DIRECTORY:
+                    architecture = executable_architecture(self.read(entry, 0, 64 * 1024))
+                    if architecture:
+                        return architecture
+        return found[0] if found else None
+
+
+def is_directory(record):
+    return bool(record['flags'] & _FLAG_DIRECTORY)
+
+
+def _symlink_target(data):
+    # SL component records: flags, length, content. Flag bits mark
+    # continuation (1), "." (2), ".." (4) and the root (8).
+    parts, pos, current = [], 0, ""
+    while pos + 2 <= len(data):
+        flags, length = data[pos], data[pos + 1]
+        content = data[pos + 2:pos + 2 + length].decode("utf-8", "replace")
+        if flags & 0x08:
+            parts, current = [""], ""
+            pos += 2 + length
+            continue
+        current += "." if flags & 0x02 else ".." if flags & 0x04 else content
+        if not flags & 0x01:
+            parts.append(current)
+            current = ""
+        pos += 2 + length
+    if parts == [""]:
+        return "/"
+    return "/".join(parts)
+
+
+def _boot_entry(entry, platform):
+    sectors, lba = struct.unpack_from("<HI", entry, 6)
+    return {
+        'platform': _BOOT_PLATFORMS.get(platform, f"0x{platform:02x}"),
+        'bootable': entry[0] == 0x88,
+        'media': _BOOT_MEDIA.get(entry[1] & 0x0F, "unknown"),
+        'lba': lba,
+        # Counted in 512 byte sectors; 0 or 1 for EFI images means "to the end".
+        'sectors': sectors,
+    }
+
+
+def _lookup(entries, name):
+    # Rock Ridge names are case-sensitive; plain ISO 9660 names are not.
+    fallback = None
+    for entry in entries:
+        if entry['name'] == name:
+            return entry
+        if fallback is None and entry['name'].lower() == name.lower():
+            fallback = entry
+    return fallback
+
+
+def executable_architecture(header):
+    """Return the architecture of an ELF or PE executable or Linux kernel from its first bytes, or None."""
+    header = bytes(header)
+    if header[:2] == b"\x1f\x8b":
+        # A gzip-compressed kernel (arm64 vmlinuz); the header is in the first block.
+        try:
+            header = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(header, 4096)
+        except zlib.error:
+            return None
+    if header[:4] == b"\x7fELF" and len(header) >= 20:
+        byte_order = "<" if header[5] == 1 else ">"
+        machine, = struct.unpack_from(byte_order + "H", header, 18)
+        architecture = _ELF_MACHINES.get(machine)
+        if architecture == "ppc64el" and byte_order == ">":
+            return "ppc64"
+        return architecture
+    # A raw arm64 Image carries its own magic even without an EFI stub.
+    if header[56:60] == b"ARM\x64":
+        return "arm64"
+    if header[:2] == b"MZ" and len(header) >= 64:
+        pe_offset, = struct.unpack_from("<I", header, 0x3C)
+        if header[pe_offset:pe_offset + 4] == b"PE\0\0":
+            machine, = struct.unpack_from("<H", header, pe_offset + 4)
+            if machine in _PE_MACHINES:
+                return _PE_MACHINES[machine]
+    # An x86 bzImage without an EFI stub: the setup header's XLF_KERNEL_64 flag.
+    if header[0x202:0x206] == b"HdrS" and len(header) >= 0x238:
+        xloadflags, = struct.unpack_from("<H", header, 0x236)
+        return "amd64" if xloadflags & 0x01 else "i386"
+    return None
+
+
+def copy_range(source_file, offset, size, destination_file, cancel_event=None):
+    """Append the `size` bytes at `offset` in `source_file` to `destination_file`.
+
+    Returns the number of bytes copied, which is short when the source ends
+    early or `cancel_event` is set.
+    """
+    start = destination_file.tell()
+    copied = 0
+    try:
+        # In-kernel copy; reflinks the extent where the filesystem can.
+        while copied < size and not (cancel_event is not None and cancel_event.is_set()):
+            count = os.copy_file_range(source_file.fileno(), destination_file.fileno(),
+                                       min(size - copied, _COPY_CHUNK), offset + copied)
+            if not count:
+                break
+            copied += count
+    except OSError:
+        source_file.seek(offset + copied)
+        destination_file.seek(start + copied)
+        while copied < size and not (cancel_event is not None and cancel_event.is_set()):
+            chunk = source_file.read(min(size - copied, 1 << 20))
+            if not chunk:
+                break
+            destination_file.write(chunk)
+            copied += len(chunk)
+    return copied
+
+
+def export_file(iso_path, record, destination, cancel_event=None):
+    """Write the file `record` of the ISO at `iso_path` to `destination`, straight from its extents.
+
+    Returns the number of bytes written, or None when cancelled (the partial
+    file is removed).
+    """
+    written = 0
+    with open(iso_path, "rb") as iso_file, open(destination, "wb", buffering=0) as destination_file:
+        for extent, size in record['extents']:
+            copied = copy_range(iso_file, extent * SECTOR_SIZE, size, destination_file, cancel_event)
+            written += copied
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if copied != size:
+                raise ValueError("ISO image is truncated")
+    if cancel_event is not None and cancel_event.is_set():
+        os.remove(destination)
+        return None
+    return written
+
+
+def read_iso_info(iso_path):
+    """Return a dict describing the ISO at `iso_path`, reading only its metadata.
+
+    Keys: 'label', 'version', 'architecture' (each may be None), 'system_id',
+    'publisher', 'preparer', 'application_id', 'created', 'modified'
+    (datetimes or None), 'boot_records', 'directories' (the path table
+    count), 'rock_ridge' and 'joliet'. ValueError if it is not an ISO 9660 image.
+    """
+    with IsoImage(iso_path) as image:
+        # Debian and Ubuntu media describe themselves in .disk/info.
+        disk_info = image.lookup(".disk/info")
+        description = image.read(disk_info).decode("utf-8", "replace").strip() if disk_info else ""
+        version = re.search(r"\b\d+(?:\.\d+)+\b", description) or re.search(r"\b\d+(?:\.\d+)+\b", image.volume_id)
+        return {
+            'label': image.volume_id or None,
+            'version': version.group(0) if version else None,
+            'description': description or None,
+            'architecture': image.architecture(),
+            'system_id': image.system_id,
+            'publisher': image.publisher,
+            'preparer': image.preparer,
+            'application_id': image.application_id,
+            'created': image.created,
+            'modified': image.modified,
+            'boot_records': image.boot_records(),
+            'directories': len(image.directories()),
+            'rock_ridge': image.rock_ridge,
+            'joliet': image.joliet,
+        }
+
+
+def find_extent(iso_path, path):
+    """Return (byte offset, size) of the file at `path` inside the ISO, or None.
+
+    Only the volume descriptors and the directories along `path` are read.
+    Files split over several extents are not handled and give None.
+    """
+    with IsoImage(iso_path) as image:
+        record = image.lookup(path)
+    if record is None or is_directory(record) or len(record['extents']) > 1:
+        return None
+    return record['extent'] * SECTOR_SIZE, record['size']
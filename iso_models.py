@@ -0,0 +1,152 @@
+import posixpath
+import stat
+
+from PyQt6.QtCore import Qt, QAbstractItemModel, QModelIndex
+
+from iso9660 import IsoImage, is_directory
+from package_models import format_size
+
+
+class _Node:
+    __slots__ = ("record", "parent", "row", "path", "children")
+
+    def __init__(self, record, parent, row, path):
+        self.record = record
+        self.parent = parent
+        self.row = row
+        self.path = path
+        # None until the directory is listed.
+        self.children = None
+
+
+class IsoTreeModel(QAbstractItemModel):
+    """Directory tree of an ISO image, read straight from the image.
+
+    Only the root is listed up front; a directory's records are read when
+    the view expands it (canFetchMore/fetchMore), so opening a multi-GB ISO
+    costs a few sector reads.
+    """
+
+    def __init__(self, iso_path=None, parent=None):
+        super().__init__(parent)
+        self._image = None
+        self._root = _Node(None, None, 0, "")
+        self._headers = ["Name", "Size", "Modified"]
+        if iso_path:
+            self.set_iso(iso_path)
+
+    def set_iso(self, iso_path):
+        """Show `iso_path`; raises ValueError or OSError and keeps the current ISO if it cannot be read."""
+        image = IsoImage(iso_path)
+        self.beginResetModel()
+        if self._image is not None:
+            self._image.close()
+        self._image = image
+        self._root = _Node(image.root, None, 0, "")
+        self.endResetModel()
+
+    def iso_path(self):
+        return self._image.path if self._image is not None else None
+
+    def close(self):
+        if self._image is not None:
+            self.beginResetModel()
+            self._image.close()
+            self._image = None
+            self._root = _Node(None, None, 0, "")
+            self.endResetModel()
+
+    def _node(self, index):
+        return index.internalPointer() if index.isValid() else self._root
+
+    def index(self, row, column, parent=QModelIndex()):
+        children = self._node(parent).children
+        if children is None or not 0 <= row < len(children) or not 0 <= column < len(self._headers):
+            return QModelIndex()
+        return self.createIndex(row, column, children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self._root:
+            return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        children = self._node(parent).children
+        return len(children) if children is not None else 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self._headers)
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self._node(parent)
+        if node.record is None or not is_directory(node.record):
+            return False
+        return node.children is None or bool(node.children)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        node = self._node(parent)
+        return node.record is not None and is_directory(node.record) and node.children is None
+
+    def fetchMore(self, parent=QModelIndex()):
+        node = self._node(parent)
+        if not self.canFetchMore(parent):
+            return
+        try:
+            records = self._image.listdir(node.record)
+        except ValueError as e:
+            print(f"Error listing {node.path or '/'} in the ISO: {e}")
+            records = []
+        # Directories first, like a file manager.
+        records.sort(key=lambda record: (not is_directory(record), record['name'].lower()))
+        children = [_Node(record, node, row, posixpath.join(node.path, record['name']))
+                    for row, record in enumerate(records)]
+        if children:
+            self.beginInsertRows(parent, 0, len(children) - 1)
+            node.children = children
+            self.endInsertRows()
+        else:
+            node.children = children
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        record = node.record
+        if role == Qt.ItemDataRole.DisplayRole:
+            if index.column() == 0:
+                return f"{record['name']} -> {record['target']}" if record['target'] else record['name']
+            if index.column() == 1:
+                return "" if is_directory(record) else format_size(record['size']) or "0 B"
+            if index.column() == 2:
+                return f"{record['date']:%Y-%m-%d %H:%M}" if record['date'] else ""
+        elif role == Qt.ItemDataRole.ToolTipRole:
+            return "/" + node.path
+        elif role == Qt.ItemDataRole.TextAlignmentRole and index.column() == 1:
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self._headers[section]
+        return None
+
+    def record(self, index):
+        return self._node(index).record if index.isValid() else None
+
+    def path(self, index):
+        return self._node(index).path
+
+    def is_file(self, index):
+        record = self.record(index)
+        if record is None or is_directory(record) or record['target'] is not None:
+            return False
+        return record['mode'] is None or stat.S_ISREG(record['mode'])
+
+    def read(self, index, size):
+        """Return up to `size` bytes from the start of the file at `index`."""
+        return self._image.read(self.record(index), 0, size)
@@ -0,0 +1,752 @@
+import os
+import shutil
+
+from PyQt6.QtWidgets import QMessageBox
+
+from build_journal import tree_signature
+from checksums import MD5SUM_FILE, verify_iso, verify_md5sums, write_md5sums
+from chroot_env import ChrootEnvironment
+from chroot_session import ChrootSession
+from iso_selection import change_arguments, extract_arguments, graft_arguments, parse_patterns, plan_extraction
+from manifest import changes_since, snapshot_tree
+from package_models import format_size
+from squashfs import (find_live_root, locate_live_root, read_superblock, unsquash_command, UnsquashProgress,
+                      mksquash_command, MksquashProgress, record_build, DEFAULT_COMPRESSION_OPTIONS,
+                      copy_image, layer_image_path, stage_layer, update_module_list, write_whiteouts,
+                      replace_tree, staging_path)
+from threads import CommandRunnerThread, format_exit_status
+
+
+class IsoPipelineMixin:
+    """ISO extraction and rebuild steps shared by both MasterLinux windows.
+
+    Covers extracting and verifying the ISO, unpacking the live root, the
+    chroot session, the incremental squashfs layer and the xorriso run. The
+    window provides the widgets (working_folder_path, step7_progress_bar...),
+    the executor and build journal, and the state set up in its __init__.
+    """
+
+    def _extraction_layout(self):
+        selection = self.extraction_selection
+        return {"extracted_iso_path": self.extracted_iso_path, "root_fs_path": self.root_fs_path,
+                "live_root_image": self.live_root_image, "live_root_offset": self.live_root_offset,
+                "live_root_size": self.live_root_size,
+                "selection": [selection.extracted, selection.skipped] if selection is not None else None}
+
+    def _recreation_settings(self):
+        return {"output": self.output_iso_path.text(), "compression": self.compression_options,
+                "modify_iso": self.modify_iso_checkbox.isChecked(), "boot_logo": self.boot_logo_path,
+                "preseed": self.preseed_file}
+
+    def _extract_iso(self):
+        working_folder = self.working_folder_path.text()
+        iso_file = self.iso_file_path.text()
+        self.extracted_iso_path = os.path.join(working_folder, "extracted_iso")
+        os.makedirs(self.extracted_iso_path, exist_ok=True)
+        self.root_fs_path = self.extracted_iso_path
+
+        self.live_root_image = None
+        self.live_root_offset = None
+        self.live_root_size = None
+        try:
+            live_root = locate_live_root(iso_file)
+        except (OSError, ValueError) as e:
+            print(f"Could not look for a live root filesystem in the ISO: {e}")
+            live_root = None
+        if live_root:
+            self.live_root_image, self.live_root_offset, self.live_root_size = live_root
+            # A rebuilt image from an earlier run; this extraction leaves it out.
+            stale_image = os.path.join(self.extracted_iso_path, self.live_root_image)
+            if os.path.exists(stale_image):
+                os.remove(stale_image)
+
+        include = parse_patterns(self.extract_include_edit.text())
+        exclude = parse_patterns(self.extract_exclude_edit.text())
+        self.extraction_selection = None
+        if include or exclude:
+            never = [self.live_root_image] if self.live_root_offset is not None else []
+            try:
+                # md5sum.txt is needed to carry the skipped files' sums over.
+                selection = plan_extraction(iso_file, include, exclude, always=[MD5SUM_FILE], never=never)
+                # Leftovers of an earlier extraction would replace the ISO's own copies.
+                for path in selection.skipped:
+                    stale_path = os.path.join(self.extracted_iso_path, path)
+                    if os.path.isdir(stale_path) and not os.path.islink(stale_path):
+                        shutil.rmtree(stale_path)
+                    elif os.path.lexists(stale_path):
+                        os.remove(stale_path)
+            except (OSError, ValueError) as e:
+                self.step3_progress_bar.setFormat("Error")
+                QMessageBox.critical(self, "Error", f"Cannot apply the extraction patterns: {e}")
+                self.back_button.setEnabled(True)
+                return
+            if selection.extracted != [""]:
+                self.extraction_selection = selection
+                print(f"Extracting {len(selection.extracted)} paths, leaving {len(selection.skipped)} in the ISO")
+
+        self._start_journal()
+        self.step3_progress_bar.setValue(0)
+        self.step3_progress_bar.setFormat("%p% - Extracting...")
+
+        # A new extraction supersedes checks still running on the previous one.
+        for task in self.verification_tasks:
+            task.cancel()
+        self.verification_tasks = []
+        self.verification_status = {}
+        self._start_iso_verification(iso_file)
+
+        try:
+            iso_file = self.iso_file_path.text()
+            cmd = ["xorriso", "-osirrox", "on", "-indev", iso_file]
+            if self.extraction_selection is not None:
+                cmd += extract_arguments(self.extraction_selection, self.extracted_iso_path)
+            else:
+                if self.live_root_offset is not None:
+                    # Leave the packed root filesystem out of the copy; it is
+                    # unpacked straight from the ISO afterwards.
+                    cmd += ["-rm", "/" + self.live_root_image, "--"]
+                cmd += ["-extract", "/", self.extracted_iso_path]
+
+            self.extraction_thread = CommandRunnerThread(cmd)
+            self.extraction_thread.command_output_signal.connect(self._process_extraction_output)
+            self.extraction_thread.command_finished_signal.connect(self._extraction_finished)
+            self.extraction_thread.start()
+
+        except FileNotFoundError:
+            self.step3_progress_bar.setFormat("Error")
+            QMessageBox.critical(self, "Error", "xorriso command not found. Is it installed?")
+            print("Error: xorriso not found.")
+        except Exception as e:
+            self.step3_progress_bar.setFormat("Error")
+            QMessageBox.critical(self, "Error", f"Unexpected error during ISO extraction: {e}")
+            print(f"Unexpected error during ISO extraction: {e}")
+
+    def _process_extraction_output(self, output_text):
+        if "filesினாலும்" in output_text:
+            try:
+                parts = output_text.split("filesினாலும்")
+                numbers = parts[0].split()
+                current = int(numbers[-2].strip())
+                total = int(numbers[-1].strip())
+                percent = int((current / total) * 100)
+                self.step3_progress_bar.setValue(percent)
+
+            except (ValueError, IndexError):
+                pass
+
+    def _start_iso_verification(self, iso_file):
+        # Runs while xorriso and unsquashfs read the same file, so the ISO
+        # comes off the disk once instead of in a separate sha256sum pass.
+        sums_path = self.checksums_file_path.text() or None
+        self._set_verification_status('iso', "Computing SHA-256 of the ISO...")
+        task = self.executor.submit(verify_iso, iso_file, sums_path,
+                                    description="Computing ISO SHA-256", cancellable=True)
+        task.finished.connect(self._iso_verified)
+        task.failed.connect(self._iso_verification_failed)
+        task.cancelled.connect(lambda: self._verification_cancelled(task, 'iso', "SHA-256 not computed: cancelled"))
+        self.verification_tasks.append(task)
+
+    def _iso_verified(self, result):
+        sums_name = os.path.basename(self.checksums_file_path.text())
+        if result['expected'] is None:
+            status = f"SHA-256: {result['sha256']}"
+            if sums_name:
+                status += f" (not listed in {sums_name})"
+        elif result['expected'] == result['sha256']:
+            status = f"SHA-256 matches {sums_name}"
+        else:
+            status = f"SHA-256 does not match {sums_name}"
+            QMessageBox.critical(self, "Error", f"The ISO's SHA-256 does not match {sums_name}; the image is corrupt "
+                                 f"or not the one listed.\n\nExpected: {result['expected']}\nActual: {result['sha256']}")
+        print(status)
+        self._set_verification_status('iso', status)
+
+    def _iso_verification_failed(self, error):
+        print(f"Could not verify the ISO: {error}")
+        self._set_verification_status('iso', f"ISO not verified: {error}")
+
+    def _start_file_verification(self):
+        if not os.path.exists(os.path.join(self.extracted_iso_path, MD5SUM_FILE)):
+            return
+        extents = {}
+        if self.live_root_offset is not None:
+            # Not extracted; checked straight from its extent in the ISO.
+            extents[self.live_root_image] = (self.iso_file_path.text(), self.live_root_offset, self.live_root_size)
+        try:
+            manifest_path = self._cache_path("iso_tree-manifest.sqlite")
+        except OSError as e:
+            self._file_verification_failed(e)
+            return
+        self._set_verification_status('files', f"Checking files against {MD5SUM_FILE}...")
+        task = self.executor.submit(verify_md5sums, self.extracted_iso_path, manifest_path, extents,
+                                    skipped=self._skipped_paths(),
+                                    description=f"Checking files against {MD5SUM_FILE}", cancellable=True)
+        task.finished.connect(self._files_verified)
+        task.failed.connect(self._file_verification_failed)
+        task.cancelled.connect(lambda: self._verification_cancelled(task, 'files', "Files not verified: cancelled"))
+        self.verification_tasks.append(task)
+
+    def _files_verified(self, result):
+        mismatched, missing = result['mismatched'], result['missing']
+        if not mismatched and not missing:
+            self._set_verification_status('files', f"{result['checked']} files match {MD5SUM_FILE}")
+            return
+        status = f"{len(mismatched)} files differ from {MD5SUM_FILE}, {len(missing)} missing"
+        print(status)
+        self._set_verification_status('files', status)
+        problems = mismatched + [f"{path} (missing)" for path in missing]
+        shown = "\n".join(problems[:20]) + ("\n..." if len(problems) > 20 else "")
+        QMessageBox.warning(self, "Warning", f"The extracted ISO does not match its {MD5SUM_FILE}; "
+                            f"the image may be corrupt:\n\n{shown}")
+
+    def _file_verification_failed(self, error):
+        print(f"Could not check files against {MD5SUM_FILE}: {error}")
+        self._set_verification_status('files', f"Files not verified: {error}")
+
+    def _verification_cancelled(self, task, key, text):
+        # Checks of an earlier extraction, cancelled by a new one, leave its status alone.
+        if task in self.verification_tasks:
+            self._set_verification_status(key, text)
+
+    def _set_verification_status(self, key, text):
+        self.verification_status[key] = text
+        self.step3_verification_label.setText("\n".join(self.verification_status.values()))
+
+    def _extraction_finished(self, return_code):
+        if return_code == 0:
+            self._start_file_verification()
+            self.extraction_steps_pending = 1
+            try:
+                task = self._snapshot_iso_tree()
+            except OSError as e:
+                self._iso_tree_snapshot_failed(e)
+            else:
+                self.extraction_steps_pending += 1
+                task.done.connect(self._extraction_step_done)
+            if self.live_root_offset is not None:
+                self._unpack_live_root(self.iso_file_path.text(), self.live_root_offset)
+                return
+            squashfs_image = find_live_root(self.extracted_iso_path)
+            if squashfs_image:
+                self.live_root_image = os.path.relpath(squashfs_image, self.extracted_iso_path)
+                self._unpack_live_root(squashfs_image)
+                return
+            self._extraction_step_done()
+
+        else:
+            self.step3_progress_bar.setFormat("Extraction Failed")
+            QMessageBox.critical(self, "Error", "ISO extraction failed.")
+            print("Error during ISO extraction.")
+            self.back_button.setEnabled(True)
+
+    def _unpack_live_root(self, squashfs_image, offset=0):
+        # The live system's root filesystem is what the chroot steps need to
+        # change; the ISO tree only holds the boot files around it. With an
+        # offset the image is read in place from the ISO file.
+        try:
+            superblock = read_superblock(squashfs_image, offset)
+        except (OSError, ValueError) as e:
+            self.step3_progress_bar.setFormat("Extraction Failed")
+            QMessageBox.critical(self, "Error", f"Cannot read {squashfs_image}: {e}")
+            print(f"Error reading squashfs image: {e}")
+            self.back_button.setEnabled(True)
+            return
+
+        self.root_fs_path = os.path.join(self.working_folder_path.text(), "root_fs")
+        self.unsquash_progress = UnsquashProgress(superblock)
+        self.step3_progress_bar.setValue(0)
+        self.step3_progress_bar.setFormat("%p% - Unpacking root filesystem...")
+        print(f"Unpacking {self.live_root_image} ({superblock['compression']}, "
+              f"{format_size(superblock['bytes_used'])}, {superblock['inodes']} inodes)")
+
+        # Unpacked next to the current tree, which is only replaced once this succeeds.
+        self._close_chroot_session()
+        staging = staging_path(self.root_fs_path)
+        shutil.rmtree(staging, ignore_errors=True)
+        cmd = unsquash_command(squashfs_image, staging, offset=offset)
+        self.extraction_thread = CommandRunnerThread(cmd)
+        self.extraction_thread.command_output_signal.connect(self._process_unpack_output)
+        self.extraction_thread.command_finished_signal.connect(self._unpack_finished)
+        self.extraction_thread.start()
+
+    def _process_unpack_output(self, output_text):
+        progress = self.unsquash_progress
+        if progress.feed(output_text):
+            self.step3_progress_bar.setValue(progress.percent)
+            self.step3_progress_bar.setFormat(
+                f"%p% - Unpacking root filesystem: {format_size(progress.bytes_done)} / "
+                f"{format_size(progress.bytes_total)}, {progress.inodes_done} / {progress.inodes_total} inodes")
+
+    def _unpack_finished(self, return_code):
+        if return_code == 0:
+            self.step3_progress_bar.setFormat("%p% - Replacing root filesystem...")
+            task = self.executor.submit(replace_tree, staging_path(self.root_fs_path), self.root_fs_path,
+                                        description="Replacing root filesystem")
+            task.finished.connect(self._root_fs_replaced)
+            task.failed.connect(self._root_fs_replace_failed)
+        else:
+            self.step3_progress_bar.setFormat("Unpacking Failed")
+            QMessageBox.critical(self, "Error", "Unpacking the root filesystem failed. Is squashfs-tools installed?")
+            print("Error unpacking the root filesystem.")
+            self.back_button.setEnabled(True)
+
+    def _root_fs_replaced(self, _result):
+        self.step3_progress_bar.setFormat("%p% - Indexing root filesystem...")
+        try:
+            self._snapshot_root_fs().done.connect(self._extraction_step_done)
+        except OSError as e:
+            self._root_fs_snapshot_failed(e)
+            self._extraction_step_done()
+
+    def _root_fs_replace_failed(self, error):
+        self.step3_progress_bar.setFormat("Unpacking Failed")
+        QMessageBox.critical(self, "Error", f"Cannot replace {self.root_fs_path}: {error}")
+        print(f"Error replacing the root filesystem: {error}")
+        self.back_button.setEnabled(True)
+
+    def _snapshot_root_fs(self):
+        # Baseline for incremental rebuilds: the tree as the squashfs image holds it.
+        manifest_path = self._cache_path("root_fs-manifest.sqlite")
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        task = self.executor.submit(snapshot_tree, self.root_fs_path, manifest_path,
+                                    description="Indexing root filesystem")
+        task.failed.connect(self._root_fs_snapshot_failed)
+        return task
+
+    def _snapshot_iso_tree(self):
+        # Baseline for writing only the changed files into the new ISO.
+        manifest_path = self._cache_path("iso_tree-baseline.sqlite")
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        task = self.executor.submit(snapshot_tree, self.extracted_iso_path, manifest_path,
+                                    description="Indexing ISO tree")
+        task.failed.connect(self._iso_tree_snapshot_failed)
+        return task
+
+    def _iso_tree_snapshot_failed(self, error):
+        print(f"Could not index the extracted ISO, it will be written in full: {error}")
+
+    def _root_fs_snapshot_failed(self, error):
+        print(f"Could not index the root filesystem, the next rebuild will not be incremental: {error}")
+
+    def _extraction_step_done(self):
+        self.extraction_steps_pending -= 1
+        if self.extraction_steps_pending == 0:
+            self._extraction_complete()
+
+    def _extraction_complete(self):
+        self.step3_progress_bar.setValue(100)
+        self.step3_progress_bar.setFormat("%p% - Extraction Complete")
+        print("ISO extraction completed.")
+        self._journal_record("extraction_finished", self._extraction_layout(), tree_signature(self.root_fs_path))
+        self.back_button.setEnabled(True)
+        self.next_button.setEnabled(True)
+
+    def _get_chroot_session(self):
+        if self.chroot_session is None or self.chroot_session.root != self.root_fs_path:
+            self._close_chroot_session()
+            # /proc, /sys, /dev and /run are mounted when the shell starts
+            # and removed when it is closed.
+            self.chroot_session = ChrootSession(self.root_fs_path, ChrootEnvironment(self.root_fs_path))
+        return self.chroot_session
+
+    def _close_chroot_session(self):
+        if self.chroot_session is not None:
+            self.chroot_session.close()
+            self.chroot_session = None
+
+    def _cache_path(self, name):
+        cache_dir = os.path.join(self.working_folder_path.text(), ".masterlinux")
+        os.makedirs(cache_dir, exist_ok=True)
+        return os.path.join(cache_dir, name)
+
+    def _start_iso_recreation(self):
+        output_iso_file = self.output_iso_path.text()
+
+        if not output_iso_file:
+            QMessageBox.warning(self, "Warning", "Please specify output ISO path.")
+            return
+        if not self.compression_options:
+            self.compression_options = dict(DEFAULT_COMPRESSION_OPTIONS)
+
+        self.step7_log_display.clear()
+        self.step7_progress_bar.setValue(0)
+        self.step7_progress_bar.show()
+        self.step7_log_display.show()
+        self.next_button.setEnabled(False)
+        self.back_button.setEnabled(False)
+
+        resume, self.resume_recreation = self.resume_recreation, False
+        self._journal_record("start_recreation", self._recreation_settings(), resume)
+        if self.live_root_image and self.root_fs_path != self.extracted_iso_path:
+            if resume and self.journal.recreation_step_done("live_root", tree_signature(self.root_fs_path)):
+                self.step7_log_display.append_text("Root filesystem already rebuilt before the restart.\n")
+                self._master_iso()
+            elif self.compression_options["incremental"]:
+                self._prepare_live_root_layer()
+            else:
+                self._rebuild_live_root()
+        else:
+            self._master_iso()
+
+    def _rebuild_live_root(self):
+        # The chroot steps changed the unpacked tree, not the image the ISO
+        # boots from; pack it again before mastering.
+        image = os.path.join(self.extracted_iso_path, self.live_root_image)
+        layer = layer_image_path(image)
+        try:
+            # A full image replaces any layer from an earlier incremental
+            # build, and the extraction baseline no longer describes it.
+            if os.path.exists(layer):
+                os.remove(layer)
+            update_module_list(layer)
+            baseline = self._cache_path("root_fs-manifest.sqlite")
+            if os.path.exists(baseline):
+                os.remove(baseline)
+        except OSError as e:
+            self._iso_recreation_failed(f"Cannot rebuild the root filesystem: {e}")
+            return
+        self._run_mksquashfs(self.root_fs_path, image)
+
+    def _prepare_live_root_layer(self):
+        try:
+            baseline = self._cache_path("root_fs-manifest.sqlite")
+            staging = self._cache_path("layer")
+        except OSError as e:
+            self._iso_recreation_failed(f"Cannot rebuild the root filesystem: {e}")
+            return
+        if not os.path.exists(baseline):
+            print("No snapshot of the extracted root filesystem, rebuilding it in full.")
+            self._rebuild_live_root()
+            return
+
+        self.step7_progress_bar.setFormat("Finding changed files...")
+        image = os.path.join(self.extracted_iso_path, self.live_root_image)
+        # When xorriso starts from the original ISO, the original image is
+        # carried over from it and never needs a copy on disk.
+        offset = None if self.extraction_selection is not None or self._modifies_iso() else self.live_root_offset
+        task = self.executor.submit(self._stage_live_root_layer, self.root_fs_path, baseline, staging, image,
+                                    self.iso_file_path.text(), offset, self.live_root_size,
+                                    description="Finding changed files")
+        task.finished.connect(self._live_root_layer_staged)
+        task.failed.connect(self._live_root_layer_failed)
+
+    @staticmethod
+    def _stage_live_root_layer(root, baseline, staging, image, iso_path, offset, size):
+        changes, entries = changes_since(root, baseline)
+        # The original image stays as the bottom layer, byte for byte. When
+        # it was unpacked in place it still has to come out of the ISO.
+        if offset is not None and not os.path.exists(image):
+            copy_image(iso_path, offset, size, image)
+        shutil.rmtree(staging, ignore_errors=True)
+        whiteouts = stage_layer(root, changes, entries, staging) if any(changes) else []
+        return changes, whiteouts
+
+    def _live_root_layer_staged(self, result):
+        changes, whiteouts = result
+        image = os.path.join(self.extracted_iso_path, self.live_root_image)
+        layer = layer_image_path(image)
+        self.step7_log_display.append_text(
+            f"Since extraction: {len(changes.added)} added, {len(changes.changed)} changed, "
+            f"{len(changes.removed)} removed\n")
+        try:
+            if not any(changes):
+                if os.path.exists(layer):
+                    os.remove(layer)
+                update_module_list(layer)
+                self._journal_record("recreation_step_finished", "live_root", tree_signature(self.root_fs_path),
+                                     image=None)
+                self._master_iso()
+                return
+            pseudo_file = None
+            if whiteouts:
+                pseudo_file = self._cache_path("whiteouts.pseudo")
+                write_whiteouts(whiteouts, pseudo_file)
+        except OSError as e:
+            self._iso_recreation_failed(f"Cannot rebuild the root filesystem: {e}")
+            return
+        self._run_mksquashfs(self._cache_path("layer"), layer, pseudo_file)
+
+    def _live_root_layer_failed(self, error):
+        print(f"Incremental rebuild not possible ({error}), rebuilding the root filesystem in full.")
+        self._rebuild_live_root()
+
+    def _run_mksquashfs(self, source, image, pseudo_file=None):
+        try:
+            os.makedirs(os.path.dirname(image), exist_ok=True)
+            cmd = mksquash_command(source, image, self.compression_options, pseudo_file)
+        except (OSError, ValueError) as e:
+            self._iso_recreation_failed(f"Cannot rebuild the root filesystem: {e}")
+            return
+
+        self.mksquash_image = image
+        self.mksquash_progress = MksquashProgress()
+        self.step7_progress_bar.setFormat("%p% - Compressing root filesystem...")
+        self.step7_log_display.append_text("$ " + " ".join(cmd) + "\n")
+        self.iso_recreation_thread = CommandRunnerThread(cmd)
+        self.iso_recreation_thread.command_output_signal.connect(self._process_mksquash_output)
+        self.iso_recreation_thread.command_completed_signal.connect(self._report_mksquash_status)
+        self.iso_recreation_thread.command_finished_signal.connect(self._live_root_rebuilt)
+        self.iso_recreation_thread.start()
+
+    def _process_mksquash_output(self, output_text):
+        self.step7_log_display.append_text(output_text)
+        if self.mksquash_progress.feed(output_text):
+            self.step7_progress_bar.setValue(self.mksquash_progress.percent)
+
+    def _report_mksquash_status(self, return_code, wall_time):
+        self.step7_log_display.append_text(f"\nmksquashfs finished: {format_exit_status(return_code, wall_time)}\n")
+
+    def _live_root_rebuilt(self, return_code):
+        image = self.mksquash_image
+        full_rebuild = image == os.path.join(self.extracted_iso_path, self.live_root_image)
+        if not full_rebuild:
+            shutil.rmtree(self._cache_path("layer"), ignore_errors=True)
+        if return_code != 0:
+            self._iso_recreation_failed("Rebuilding the root filesystem failed. Is squashfs-tools installed?")
+            return
+
+        if not full_rebuild:
+            try:
+                update_module_list(image)
+            except OSError as e:
+                self._iso_recreation_failed(f"Cannot add {image} to the live media: {e}")
+                return
+
+        # Keep size and speed of every build so compression settings can be compared.
+        try:
+            build = record_build(self._cache_path("squashfs-builds.jsonl"), image, self.compression_options,
+                                 self.iso_recreation_thread.wall_time, self.mksquash_progress.unpacked_bytes)
+        except OSError as e:
+            print(f"Could not record squashfs build statistics: {e}")
+        else:
+            summary = f"{os.path.relpath(image, self.extracted_iso_path)}: {format_size(build['packed_bytes'])}"
+            if build['ratio'] is not None:
+                summary += (f" ({build['ratio']:.1%} of {format_size(build['unpacked_bytes'])}, "
+                            f"{format_size(build['throughput'])}/s)")
+            self.step7_log_display.append_text(summary + "\n")
+            print(summary)
+        if full_rebuild:
+            # The new image is the baseline for the next incremental rebuild.
+            try:
+                self._snapshot_root_fs()
+            except OSError as e:
+                self._root_fs_snapshot_failed(e)
+        self._journal_record("recreation_step_finished", "live_root", tree_signature(self.root_fs_path), image=image)
+        self._master_iso()
+
+    def _master_iso(self):
+        if self.boot_logo_path and os.path.exists(self.boot_logo_path):
+            isolinux_dir = os.path.join(self.extracted_iso_path, "isolinux")
+            if not os.path.exists(isolinux_dir):
+                os.makedirs(isolinux_dir)
+
+            logo_dest_path = os.path.join(isolinux_dir, "logo.png")
+            try:
+                shutil.copy(self.boot_logo_path, logo_dest_path)
+
+                cfg_path = os.path.join(isolinux_dir, "isolinux.cfg")
+                if os.path.exists(cfg_path):
+                    with open(cfg_path, "a") as cfg_file:
+                        cfg_file.write(f"\nUI vesamenu.c32\nMENU BACKGROUND logo.png\n")
+            except (shutil.Error, IOError) as e:
+                QMessageBox.warning(self, "Warning", f"Failed to copy boot logo: {e}")
+
+        # Live media check themselves against md5sum.txt, so it has to match
+        # the rebuilt files.
+        if not os.path.exists(os.path.join(self.extracted_iso_path, MD5SUM_FILE)):
+            self._run_xorriso()
+            return
+        try:
+            manifest_path = self._cache_path("iso_tree-manifest.sqlite")
+        except OSError as e:
+            self._iso_recreation_failed(f"Cannot update {MD5SUM_FILE}: {e}")
+            return
+        self.step7_progress_bar.setFormat(f"Updating {MD5SUM_FILE}...")
+        task = self.executor.submit(write_md5sums, self.extracted_iso_path, manifest_path,
+                                    skipped=self._skipped_paths(),
+                                    description=f"Updating {MD5SUM_FILE}", cancellable=True)
+        task.finished.connect(self._md5sums_written)
+        task.failed.connect(self._md5sums_failed)
+        task.cancelled.connect(lambda: self._iso_recreation_failed(f"Updating {MD5SUM_FILE} was cancelled."))
+
+    def _md5sums_written(self, result):
+        listed, hashed = result
+        self.step7_log_display.append_text(f"{MD5SUM_FILE}: {listed} files, {hashed} hashed, "
+                                           f"{listed - hashed} unchanged\n")
+        self._run_xorriso()
+
+    def _md5sums_failed(self, error):
+        self._iso_recreation_failed(f"Cannot update {MD5SUM_FILE}: {error}")
+
+    def _run_xorriso(self, allow_modify=True):
+        output_iso_file = self.output_iso_path.text()
+        self.step7_progress_bar.setValue(0)
+        self.step7_progress_bar.setFormat("%p% - Writing ISO...")
+        if self.extraction_selection is not None:
+            try:
+                cmd = self._graft_command(output_iso_file)
+            except OSError as e:
+                self._iso_recreation_failed(f"Cannot prepare the ISO update: {e}")
+                return
+        elif allow_modify and self._modifies_iso():
+            self._find_iso_changes()
+            return
+        elif self.live_root_offset is not None and \
+                not os.path.exists(os.path.join(self.extracted_iso_path, self.live_root_image)):
+            self._copy_live_root_image(lambda: self._run_xorriso(allow_modify))
+            return
+        else:
+            cmd = [
+                "xorriso",
+                "-as", "mkisofs",
+                "-r",
+                "-J",
+                "-joliet-long",
+                "-l",
+                "-cache-inodes",
+                "-follow-links",
+                "-o", output_iso_file,
+                "-b", "isolinux/isolinux.bin",
+                "-c", "isolinux/boot.cat",
+                "-no-emul-boot",
+                "-boot-load-size", "4",
+                "-boot-info-table",
+                "-isohybrid-mbr", "isolinux/isohdpfx.bin",
+                "-eltorito-alt-boot",
+                "-e", "boot/grub/efi.img",
+                "-no-emul-boot",
+                "-isohybrid-gpt-basdat",
+            ]
+
+            if self.preseed_file and os.path.exists(self.preseed_file):
+                cmd.extend(["-preseed", self.preseed_file])
+
+            cmd.append(self.extracted_iso_path)
+
+        self._start_xorriso(cmd)
+
+    def _start_xorriso(self, cmd):
+        self.iso_recreation_thread = CommandRunnerThread(cmd,
+                                                        working_dir=self.working_folder_path.text())
+        self.iso_recreation_thread.command_output_signal.connect(self._process_iso_recreation_output)
+        self.iso_recreation_thread.command_completed_signal.connect(self._report_iso_recreation_status)
+        self.iso_recreation_thread.command_finished_signal.connect(self._iso_recreation_finished)
+        self.iso_recreation_thread.start()
+
+    def _graft_command(self, output_iso_file):
+        # Only part of the ISO was extracted. Load the original and update it
+        # from the working tree: skipped paths are copied ISO to ISO and the
+        # boot setup is replayed as it was.
+        if os.path.exists(output_iso_file):
+            # -outdev would add a session to an existing ISO.
+            os.remove(output_iso_file)
+        cmd = ["xorriso", "-indev", self.iso_file_path.text(), "-outdev", output_iso_file,
+               "-boot_image", "any", "replay"]
+        cmd += graft_arguments(self.extracted_iso_path, self.extraction_selection)
+        cmd += self._preseed_arguments()
+        return cmd
+
+    def _modifies_iso(self):
+        if not self.modify_iso_checkbox.isChecked():
+            return False
+        try:
+            return os.path.exists(self._cache_path("iso_tree-baseline.sqlite"))
+        except OSError:
+            return False
+
+    def _find_iso_changes(self):
+        self.step7_progress_bar.setFormat("Finding changed files in the ISO tree...")
+        baseline = self._cache_path("iso_tree-baseline.sqlite")
+        task = self.executor.submit(changes_since, self.extracted_iso_path, baseline,
+                                    description="Finding changed files in the ISO tree")
+        task.finished.connect(self._iso_changes_found)
+        task.failed.connect(self._iso_changes_failed)
+
+    def _iso_changes_found(self, result):
+        changes, entries = result
+        output_iso_file = self.output_iso_path.text()
+        self.step7_log_display.append_text(
+            f"ISO tree since extraction: {len(changes.added)} added, {len(changes.changed)} changed, "
+            f"{len(changes.removed)} removed\n")
+        try:
+            if os.path.exists(output_iso_file):
+                # -outdev would add a session to an existing ISO.
+                os.remove(output_iso_file)
+        except OSError as e:
+            self._iso_recreation_failed(f"Cannot replace {output_iso_file}: {e}")
+            return
+        # The original ISO is the input image: unchanged files are copied
+        # from it extent by extent and its boot setup is replayed.
+        cmd = ["xorriso", "-indev", self.iso_file_path.text(), "-outdev", output_iso_file,
+               "-boot_image", "any", "replay"]
+        cmd += change_arguments(self.extracted_iso_path, changes, entries)
+        cmd += self._preseed_arguments()
+        self.step7_progress_bar.setFormat("%p% - Writing ISO...")
+        self._start_xorriso(cmd)
+
+    def _iso_changes_failed(self, error):
+        print(f"Cannot compare the ISO tree with the extracted one ({error}), writing the whole ISO.")
+        self._run_xorriso(allow_modify=False)
+
+    def _copy_live_root_image(self, then):
+        # The original image was left in the ISO when it was unpacked in
+        # place; a full mkisofs build reads only the tree and needs it there.
+        image = os.path.join(self.extracted_iso_path, self.live_root_image)
+        self.step7_progress_bar.setFormat("Copying the root filesystem image...")
+        task = self.executor.submit(copy_image, self.iso_file_path.text(), self.live_root_offset,
+                                    self.live_root_size, image, description="Copying root filesystem image")
+        task.finished.connect(lambda _: then())
+        task.failed.connect(lambda e: self._iso_recreation_failed(f"Cannot copy {self.live_root_image}: {e}"))
+
+    def _preseed_arguments(self):
+        if self.preseed_file and os.path.exists(self.preseed_file):
+            return ["-map", self.preseed_file, "/preseed/" + os.path.basename(self.preseed_file)]
+        return []
+
+    def _skipped_paths(self):
+        skipped = list(self.extraction_selection.skipped) if self.extraction_selection is not None else []
+        # Left in the ISO when unpacked in place; its sum stays valid until it is rebuilt.
+        if self.live_root_offset is not None and self.live_root_image not in skipped:
+            skipped.append(self.live_root_image)
+        return skipped
+
+    def _iso_recreation_failed(self, message):
+        self.step7_progress_bar.setFormat("ISO Creation Failed")
+        QMessageBox.critical(self, "Error", message)
+        print(f"Error: {message}")
+        self.iso_recreation_thread = None
+        self.next_button.setEnabled(True)
+        self.back_button.setEnabled(True)
+
+    def _report_iso_recreation_status(self, return_code, wall_time):
+        self.step7_log_display.append_text(f"\nxorriso finished: {format_exit_status(return_code, wall_time)}\n")
+
+    def _process_iso_recreation_output(self, output_text):
+        self.step7_log_display.append_text(output_text)
+
+        # Output arrives in batches of many lines; the last progress line wins.
+        for line in reversed(output_text.splitlines()):
+            if "xorriso : UPDATE : " in line:
+                try:
+                    progress_part = line.split(":")[-1].strip()
+                    if progress_part.endswith("%"):
+                        progress_percent = int(progress_part[:-1])
+                        self.step7_progress_bar.setValue(progress_percent)
+                        break
+                except (ValueError, IndexError):
+                    pass
+
+    def _iso_recreation_finished(self, return_code):
+        self.next_button.setEnabled(True)
+        self.back_button.setEnabled(True)
+        if return_code == 0:
+            self.step7_progress_bar.setValue(100)
+            self._journal_record("build_finished", self.output_iso_path.text())
+        else:
+            self.step7_progress_bar.setFormat("ISO Creation Failed")
+            QMessageBox.critical(self, "Error", f"ISO re-creation failed with return code {return_code}.")
+
+        self.iso_recreation_thread = None
+        self.go_to_step(8)
@@ -0,0 +1,141 @@
+import collections
+import fnmatch
+import os
+import posixpath
+import stat
+
+from iso9660 import IsoImage, is_directory
+
+# What to copy out of the ISO: the topmost paths extracted whole, and the
+# topmost paths left in the ISO. Both are relative to the ISO root; an
+# extracted root of "" means everything.
+Selection = collections.namedtuple("Selection", "extracted skipped")
+
+
+def parse_patterns(text):
+    """Split a pattern field ("casper/ boot/ *.cfg") into patterns, without leading or trailing slashes."""
+    return [pattern.strip("/") for pattern in text.split() if pattern.strip("/")]
+
+
+def matches(path, patterns):
+    """True if `path` or one of its parent directories matches one of the glob `patterns`."""
+    parts = path.split("/")
+    prefixes = ["/".join(parts[:depth]) for depth in range(1, len(parts) + 1)]
+    return any(fnmatch.fnmatchcase(prefix, pattern) for pattern in patterns for prefix in prefixes)
+
+
+def plan_extraction(iso_path, include=(), exclude=(), always=(), never=()):
+    """Work out which parts of the ISO to extract.
+
+    A path is extracted when it (or a parent) matches an `include` pattern,
+    or there are none, and matches no `exclude` pattern. Paths in `always`
+    are extracted regardless, paths in `never` are not. Directories whose
+    contents are all extracted, or all skipped, are listed as one path.
+    Returns a Selection.
+    """
+    always, never = set(always), set(never)
+    extracted, skipped = [], []
+
+    def selected(path):
+        if path in never:
+            return False
+        if path in always:
+            return True
+        return (not include or matches(path, include)) and not matches(path, exclude)
+
+    def visit(image, record, path):
+        # Returns (extracted, skipped) below `path`; one of them is [path]
+        # when the whole directory goes one way.
+        inside, outside = [], []
+        for entry in image.listdir(record):
+            entry_path = posixpath.join(path, entry['name'])
+            forced = any(kept.startswith(entry_path + "/") for kept in always)
+            if is_directory(entry) and (forced or not (entry_path in never or matches(entry_path, exclude))):
+                below_inside, below_outside = visit(image, entry, entry_path)
+            elif selected(entry_path):
+                below_inside, below_outside = [entry_path], []
+            else:
+                below_inside, below_outside = [], [entry_path]
+            inside += below_inside
+            outside += below_outside
+        if not outside and (inside or selected(path)):
+            return [path], []
+        if not inside:
+            return [], [path]
+        return inside, outside
+
+    with IsoImage(iso_path) as image:
+        extracted, skipped = visit(image, image.root, "")
+    return Selection(extracted, skipped)
+
+
+def extract_arguments(selection, destination):
+    """xorriso -osirrox arguments that copy the extracted part of `selection` to `destination`."""
+    if selection.extracted == [""]:
+        return ["-extract", "/", destination]
+    return ["-extract_l", "/", destination.rstrip("/") + "/"] + ["/" + path for path in selection.extracted] + ["--"]
+
+
+def graft_arguments(tree, selection):
+    """xorriso commands that update the ISO loaded with -indev to match `tree`.
+
+    Extracted directories and files are mirrored with -update_r, so edits
+    and deletions in them carry over. Anything else found in `tree` (new
+    files, a rebuilt image that was not extracted) is added with -map.
+    Skipped paths are not on disk and stay as they are in the ISO.
+    """
+    roots = set(selection.extracted)
+    # Directories that were only partly extracted; their entries are handled one by one.
+    partial = {posixpath.dirname(root) for root in roots}
+    for directory in list(partial):
+        while directory:
+            directory = posixpath.dirname(directory)
+            partial.add(directory)
+
+    arguments = []
+
+    def visit(path):
+        with os.scandir(os.path.join(tree, path)) as listing:
+            names = sorted(entry.name for entry in listing)
+        for name in names:
+            entry_path = posixpath.join(path, name)
+            disk_path = os.path.join(tree, entry_path)
+            if entry_path in roots:
+                arguments.extend(["-update_r", disk_path, "/" + entry_path])
+            elif entry_path in partial and os.path.isdir(disk_path) and not os.path.islink(disk_path):
+                visit(entry_path)
+            else:
+                arguments.extend(["-map", disk_path, "/" + entry_path])
+
+    visit("")
+    for root in sorted(roots):
+        if root and not os.path.lexists(os.path.join(tree, root)):
+            arguments.extend(["-rm_r", "/" + root, "--"])
+    return arguments
+
+
+def change_arguments(tree, changes, entries):
+    """xorriso commands that carry `changes` made in `tree` over to the ISO loaded with -indev.
+
+    `entries` is the current manifest of `tree`. Removed paths are deleted
+    and added or changed files are mapped in from `tree`; everything else is
+    copied over from the original ISO. An added directory is mapped as a
+    whole.
+    """
+    arguments = []
+    removed = set(changes.removed)
+    for path in changes.removed:
+        if posixpath.dirname(path) not in removed:
+            arguments.extend(["-rm_r", "/" + path, "--"])
+    added = set(changes.added)
+    # Directories only change when an entry in them does; that entry is listed itself.
+    mapped = changes.added + [path for path in changes.changed if not stat.S_ISDIR(entries[path].mode)]
+    for path in sorted(mapped):
+        if posixpath.dirname(path) not in added:
+            arguments.extend(["-map", os.path.join(tree, path), "/" + path])
+    return arguments
+
+
+def under(path, roots):
+    """True if `path` is one of `roots` or inside one of them."""
+    return any(not root or path == root or path.startswith(root + "/") for root in roots)
@@ -0,0 +1,241 @@
+import collections
+import hashlib
+import os
+import sqlite3
+import stat
+import struct
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# A file's identity in a snapshot. Anything that rewrites, replaces, chmods or
+# touches a file changes at least one of these.
+Entry = collections.namedtuple("Entry", "inode size mtime_ns mode")
+
+Changes = collections.namedtuple("Changes", "added changed removed")
+
+# lstat() releases the GIL, so a walk is bound by the disk, not by Python.
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Coarsest mtime granularity to allow for (FAT keeps two seconds). A directory
+# changed within this of a scan may change again without its mtime moving.
+MTIME_TICK_NS = 2 * 10**9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path BLOB PRIMARY KEY, inode INTEGER, size INTEGER, mtime_ns INTEGER, mode INTEGER, digest BLOB
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS baseline (
+    path BLOB PRIMARY KEY, inode INTEGER, size INTEGER, mtime_ns INTEGER, mode INTEGER
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def compare(old, new):
+    """Return the sorted paths added to, changed in and removed from `old`."""
+    added = sorted(path for path in new.keys() - old.keys())
+    removed = sorted(path for path in old.keys() - new.keys())
+    changed = sorted(path for path, entry in new.items() if path in old and old[path] != entry)
+    return Changes(added, changed, removed)
+
+
+def _entry(status):
+    return Entry(status.st_ino, status.st_size, status.st_mtime_ns, status.st_mode)
+
+
+class TreeManifest:
+    """Persistent index of a directory tree, kept in an SQLite file.
+
+    Each path below the root (the root itself is "") maps to an Entry and an
+    optional content digest. Paths are stored as bytes, so names that are not
+    valid UTF-8 survive. refresh() brings the index up to date and
+    reports what changed; it lists only directories whose mtime moved, since
+    creating, deleting or renaming an entry always touches its directory.
+    Like git's "racily clean" entries, a directory whose mtime was within
+    MTIME_TICK_NS of the previous scan's start is listed again regardless.
+    A baseline copy of the index can be set aside with mark_baseline() and
+    compared against later.
+    """
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        self._db = sqlite3.connect(path)
+        try:
+            self._db.executescript(_SCHEMA)
+            stored_root = self._db.execute("SELECT value FROM meta WHERE key = 'root'").fetchone()
+        except sqlite3.DatabaseError as e:
+            self._db.close()
+            raise ValueError(f"Not a tree manifest: {path} ({e})")
+        if stored_root is not None and stored_root[0] != os.path.realpath(root):
+            # Indexed for another tree; start over.
+            self._db.executescript("DELETE FROM entries; DELETE FROM baseline;")
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('root', ?)", (os.path.realpath(root),))
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def entries(self):
+        """Return {path: Entry} as of the last refresh()."""
+        rows = self._db.execute("SELECT path, inode, size, mtime_ns, mode FROM entries")
+        return {os.fsdecode(path): Entry(inode, size, mtime_ns, mode) for path, inode, size, mtime_ns, mode in rows}
+
+    def refresh(self, check_files=True):
+        """Rescan the tree, store the result and return the Changes since the last scan.
+
+        Directories whose mtime is unchanged are not listed again. With
+        `check_files` their files are still stat()ed, which catches files
+        rewritten in place; without it a refresh touches only directories.
+        Content digests of changed files are dropped.
+        """
+        started = time.time_ns()
+        previous = self._db.execute("SELECT value FROM meta WHERE key = 'scanned'").fetchone()
+        old = self.entries()
+        # Without a recorded start every directory is listed again.
+        new = self._scan(old, check_files, int(previous[0]) - MTIME_TICK_NS if previous else 0)
+        changes = compare(old, new)
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('scanned', ?)", (str(started),))
+            self._db.executemany("DELETE FROM entries WHERE path = ?", ((os.fsencode(path),) for path in changes.removed))
+            self._db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, NULL)",
+                                 ((os.fsencode(path),) + tuple(new[path]) for path in changes.added + changes.changed))
+        # The root's own entry only tells the scan whether to relist it.
+        return Changes(*([path for path in paths if path] for paths in changes))
+
+    def _scan(self, old, check_files, clean_before):
+        # Directories last modified before `clean_before` (ns) and unchanged
+        # since are not listed again.
+        children = collections.defaultdict(list)
+        for path in old:
+            if path:
+                children[path.rpartition(os.sep)[0]].append(path)
+        root_device = os.lstat(self.root).st_dev
+        entries = {"": _entry(os.lstat(self.root))}
+
+        def visit(directories):
+            # Returns the entries found in `directories` and the subdirectories to visit.
+            found, subdirectories = [], []
+
+            def add(path, status):
+                found.append((path, _entry(status)))
+                # Directories on another filesystem (a /proc mounted into a
+                # chroot) are recorded but not descended into.
+                if stat.S_ISDIR(status.st_mode) and status.st_dev == root_device:
+                    subdirectories.append(path)
+
+            for directory in directories:
+                if old.get(directory) == entries[directory] and entries[directory].mtime_ns < clean_before:
+                    for path in children[directory]:
+                        if not check_files and not stat.S_ISDIR(old[path].mode):
+                            found.append((path, old[path]))
+                            continue
+                        try:
+                            add(path, os.lstat(os.path.join(self.root, path)))
+                        except FileNotFoundError:
+                            pass
+                else:
+                    with os.scandir(os.path.join(self.root, directory)) as listing:
+                        for item in listing:
+                            add(os.path.join(directory, item.name), item.stat(follow_symlinks=False))
+            return found, subdirectories
+
+        # Directories are handed out in batches, sized so every worker stays
+        # busy without paying for one future per directory.
+        queue = [""]
+        pending = set()
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="manifest-scan") as pool:
+            while queue or pending:
+                while queue and len(pending) < SCAN_WORKERS * 2:
+                    batch_size = min(max(1, len(queue) // SCAN_WORKERS), 256)
+                    pending.add(pool.submit(visit, queue[-batch_size:]))
+                    del queue[-batch_size:]
+                completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    found, subdirectories = future.result()
+                    entries.update(found)
+                    queue.extend(subdirectories)
+        return entries
+
+    def mark_baseline(self):
+        """Keep the current index as the baseline for changes_since_baseline()."""
+        with self._db:
+            self._db.execute("DELETE FROM baseline")
+            self._db.execute("INSERT INTO baseline SELECT path, inode, size, mtime_ns, mode FROM entries")
+
+    def has_baseline(self):
+        return self._db.execute("SELECT EXISTS (SELECT 1 FROM baseline)").fetchone()[0] == 1
+
+    def baseline_digest(self):
+        """SHA-256 over the baseline's paths, sizes, mtimes and modes, or None without a baseline.
+
+        Inode numbers are left out, so two extractions of the same image
+        give the same digest.
+        """
+        if not self.has_baseline():
+            return None
+        digest = hashlib.sha256()
+        for path, size, mtime_ns, mode in self._db.execute(
+                "SELECT path, size, mtime_ns, mode FROM baseline ORDER BY path"):
+            digest.update(struct.pack("<Iqqq", len(path), size, mtime_ns, mode) + path)
+        return digest.hexdigest()
+
+    def changes_since_baseline(self):
+        """Changes between the baseline and the last refresh(), without the root."""
+        added = [os.fsdecode(path) for path, in self._db.execute(
+            "SELECT e.path FROM entries e LEFT JOIN baseline b USING (path) "
+            "WHERE b.path IS NULL AND e.path != X'' ORDER BY e.path")]
+        removed = [os.fsdecode(path) for path, in self._db.execute(
+            "SELECT b.path FROM baseline b LEFT JOIN entries e USING (path) "
+            "WHERE e.path IS NULL AND b.path != X'' ORDER BY b.path")]
+        changed = [os.fsdecode(path) for path, in self._db.execute(
+            "SELECT e.path FROM entries e JOIN baseline b USING (path) "
+            "WHERE e.path != X'' AND (e.inode != b.inode OR e.size != b.size OR e.mtime_ns != b.mtime_ns "
+            "OR e.mode != b.mode) "
+            "ORDER BY e.path")]
+        return Changes(added, changed, removed)
+
+    def changed_paths(self, check_files=True):
+        """Refresh and return the set of paths added, changed or removed since the last scan."""
+        changes = self.refresh(check_files)
+        return set(changes.added) | set(changes.changed) | set(changes.removed)
+
+    def digests(self):
+        """Return {path: digest} for the files whose digest is stored."""
+        rows = self._db.execute("SELECT path, digest FROM entries WHERE digest IS NOT NULL")
+        return {os.fsdecode(path): digest for path, digest in rows}
+
+    def store_digests(self, digests):
+        """Store content digests computed by the caller, keyed by path."""
+        with self._db:
+            self._db.executemany("UPDATE entries SET digest = ? WHERE path = ?",
+                                 ((digest, os.fsencode(path)) for path, digest in digests.items()))
+
+
+def snapshot_tree(root, manifest_path):
+    """Index `root` into `manifest_path` and make that the baseline; returns the entry count."""
+    with TreeManifest(manifest_path, root) as manifest:
+        manifest.refresh()
+        manifest.mark_baseline()
+        return len(manifest)
+
+
+def changes_since(root, manifest_path):
+    """Compare `root` with the baseline stored in `manifest_path`.
+
+    Returns (changes, current entries). ValueError if there is no baseline.
+    """
+    with TreeManifest(manifest_path, root) as manifest:
+        if not manifest.has_baseline():
+            raise ValueError(f"No baseline in {manifest_path}")
+        manifest.refresh()
+        return manifest.changes_since_baseline(), manifest.entries()
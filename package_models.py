@@ -1,14 +1,71 @@
+import itertools
+from array import array
+
 from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
-from PyQt6.QtCore import QSortFilterProxyModel
+from PyQt6.QtCore import QIdentityProxyModel, QTimer, pyqtSignal
+from PyQt6.QtWidgets import QApplication
+
+from package_search import PackageSearchIndex, narrows, parse_query
+from package_store import PackageStore
+
+# Column index -> key in the package rows.
+_COLUMN_KEYS = {
+    1: 'name',
+    2: 'version',
+    3: 'architecture',
+    4: 'installed_size',
+    5: 'section',
+    6: 'priority',
+}
+
+def format_size(size):
+    if not size:
+        return ''
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
 
 class PackageListModel(QAbstractTableModel):
-    def __init__(self, package_data=None):
+    """Table of packages held in a PackageStore.
+
+    Rows of the table are "view rows". Unless a row filter or a sort is set
+    they are the store's rows; otherwise _shown lists the store row behind
+    each view row, so filtering and sorting never move package data.
+    """
+    # Rows pulled from a row source per fetchMore() call.
+    FETCH_CHUNK_SIZE = 2000
+
+    # Emitted after set_packages() or set_row_source() replaced the store.
+    rows_replaced = pyqtSignal()
+
+    def __init__(self, package_data=None, description_loader=None):
         super().__init__()
-        self._package_data = package_data if package_data else []
-        self._headers = ["Remove", "Package Name", "Version"]
+        self._store = PackageStore(package_data or ())
+        self._row_source = None
+        # Store row of each view row, or None while they are the same.
+        self._shown = None
+        # Every store row in sort order, or None while unsorted, and the
+        # position of each store row in it, built when first needed.
+        self._order = None
+        self._rank = None
+        self._sort_key = None
+        self._sort_reverse = False
+        # callable(store rows) -> the ones to show, while a row filter is set.
+        self._match_rows = None
+        # Keeps pulling chunks whenever the event loop is idle, so all rows
+        # arrive without the view having to scroll to the end first.
+        self._fetch_timer = QTimer(self)
+        self._fetch_timer.setInterval(0)
+        self._fetch_timer.timeout.connect(lambda: self.fetchMore(QModelIndex()))
+        # Optional callable(name) -> str; descriptions are only looked up when
+        # a tooltip is actually shown.
+        self._description_loader = description_loader
+        self._headers = ["Remove", "Package Name", "Version", "Architecture", "Installed Size", "Section", "Priority"]
 
     def rowCount(self, parent=QModelIndex()):
-        return len(self._package_data)
+        return len(self._store) if self._shown is None else len(self._shown)
 
     def columnCount(self, parent=QModelIndex()):
         return len(self._headers)
@@ -16,24 +73,28 @@ class PackageListModel(QAbstractTableModel):
     def data(self, index, role=Qt.ItemDataRole.DisplayRole):
         if not index.isValid():
             return None
-        row = index.row()
+        row = self._store_row(index.row())
         col = index.column()
         if role == Qt.ItemDataRole.DisplayRole:
-            if col == 1:
-                return self._package_data[row].get('name', '')
-            elif col == 2:
-                return self._package_data[row].get('version', '')
+            key = _COLUMN_KEYS.get(col)
+            if key == 'installed_size':
+                return format_size(self._store.installed_size(row))
+            elif key:
+                return self._store.get(row, key)
+        elif role == Qt.ItemDataRole.ToolTipRole:
+            if col == 1 and self._description_loader:
+                return self._description_loader(self._store.name(row)) or None
         elif role == Qt.ItemDataRole.CheckStateRole:
             if col == 0:
-                return Qt.CheckState.Checked if self._package_data[row].get('remove') else Qt.CheckState.Unchecked
+                return Qt.CheckState.Checked if self._store.is_checked(row) else Qt.CheckState.Unchecked
         elif role == Qt.ItemDataRole.BackgroundRole:
-            status = self._package_data[row].get('status')
+            status = self._store.status(row)
             if status == 'removing':
-                pass
+                return QApplication.palette().color(QApplication.palette().ColorRole.Mid)
             elif status == 'removed':
-                pass
+                return QApplication.palette().color(QApplication.palette().ColorRole.Highlight)
             elif status == 'error':
-                pass
+                return QApplication.palette().color(QApplication.palette().ColorRole.Window)
         return None
 
     def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
@@ -52,38 +113,302 @@ class PackageListModel(QAbstractTableModel):
         if not index.isValid():
             return False
         if role == Qt.ItemDataRole.CheckStateRole and index.column() == 0:
-            self._package_data[index.row()]['remove'] = (value == Qt.CheckState.Checked)
+            self._store.set_checked(self._store_row(index.row()), value == Qt.CheckState.Checked)
             self.dataChanged.emit(index, index, [Qt.ItemDataRole.CheckStateRole])
             return True
         return False
 
+    def set_description_loader(self, description_loader):
+        self._description_loader = description_loader
+
+    def set_packages(self, package_data):
+        self._stop_fetching()
+        self.beginResetModel()
+        self._store = PackageStore(package_data)
+        self._reset_view_rows()
+        self.endResetModel()
+        self.rows_replaced.emit()
+
+    def set_row_source(self, rows):
+        """Replace the contents with rows streamed lazily from an iterable.
+
+        The first chunk is loaded right away; the rest arrive through
+        fetchMore(), called by the view while scrolling and by an idle timer.
+        """
+        self._stop_fetching()
+        self.beginResetModel()
+        self._store = PackageStore()
+        self._row_source = iter(rows)
+        self._reset_view_rows()
+        self.endResetModel()
+        self.rows_replaced.emit()
+        self.fetchMore(QModelIndex())
+        if self._row_source is not None:
+            self._fetch_timer.start()
+
+    def _stop_fetching(self):
+        self._row_source = None
+        self._fetch_timer.stop()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._row_source is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._row_source is None:
+            return
+        try:
+            chunk = list(itertools.islice(self._row_source, self.FETCH_CHUNK_SIZE))
+        except (OSError, ValueError) as e:
+            print(f"Error loading package rows: {e}")
+            chunk = []
+        if len(chunk) < self.FETCH_CHUNK_SIZE:
+            self._stop_fetching()
+        if not chunk:
+            return
+        first = len(self._store)
+        if self._shown is None:
+            self.beginInsertRows(QModelIndex(), first, first + len(chunk) - 1)
+            self._store.extend(chunk)
+            self.endInsertRows()
+        else:
+            # Not shown until added to _shown.
+            self._store.extend(chunk)
+            self._show_loaded_rows(range(first, len(self._store)))
+
+    def _show_loaded_rows(self, rows):
+        if self._order is not None:
+            # Two sorted runs, which list.sort() merges in one pass.
+            self._order.extend(rows)
+            self._order.sort(key=self._sort_key_function(), reverse=self._sort_reverse)
+            self._rank = None
+        if self._match_rows is not None:
+            rows = self._match_rows(rows)
+        if not rows:
+            return
+        first = len(self._shown)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        self._shown.extend(rows)
+        self.endInsertRows()
+        if self._order is not None:
+            self._change_view_rows(sorted(self._shown, key=self._sort_key_function(), reverse=self._sort_reverse))
+
+    def _store_row(self, row):
+        return row if self._shown is None else self._shown[row]
+
+    def _view_row(self, store_row):
+        if self._shown is None:
+            return store_row
+        try:
+            return self._shown.index(store_row)
+        except ValueError:
+            return None
+
+    def _sort_key_function(self):
+        return getattr(self._store, self._sort_key)
+
+    def _reset_view_rows(self):
+        # The store was replaced: drop the row filter, keep the sort.
+        self._match_rows = None
+        self._rank = None
+        if self._sort_key is None:
+            self._order = self._shown = None
+        else:
+            self._order = sorted(range(len(self._store)), key=self._sort_key_function(), reverse=self._sort_reverse)
+            self._shown = list(self._order)
+
+    def _in_view_order(self, rows):
+        # The store rows in `rows`, ordered as the view shows them.
+        if self._order is None:
+            return sorted(rows)
+        if len(rows) * 16 >= len(self._order):
+            return [row for row in self._order if row in rows]
+        if self._rank is None:
+            self._rank = array('I', bytes(4 * len(self._order)))
+            for position, row in enumerate(self._order):
+                self._rank[row] = position
+        return sorted(rows, key=self._rank.__getitem__)
+
+    def _change_view_rows(self, shown):
+        # Same rows in a different order: a layout change, which keeps the
+        # views' selection and scroll position.
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        store_rows = [self._store_row(index.row()) for index in persistent]
+        self._shown = shown
+        if persistent:
+            view_rows = {row: view_row for view_row, row in enumerate(shown)} if shown is not None else None
+            self.changePersistentIndexList(persistent, [
+                self.index(row if view_rows is None else view_rows[row], index.column())
+                for row, index in zip(store_rows, persistent)])
+        self.layoutChanged.emit()
+
+    def set_row_filter(self, rows, match_rows=None):
+        """Show only the store rows in the set `rows`, or every row if None.
+
+        Rows loaded later are passed to match_rows(rows), which returns the
+        ones to show. Only the shown rows are touched; no per-row callback
+        runs over the whole store.
+        """
+        self.beginResetModel()
+        if rows is None:
+            self._match_rows = None
+            self._shown = None if self._order is None else list(self._order)
+        else:
+            self._match_rows = match_rows
+            self._shown = self._in_view_order(rows)
+        self.endResetModel()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        key = _COLUMN_KEYS.get(column)
+        self._sort_key = key
+        self._sort_reverse = order == Qt.SortOrder.DescendingOrder
+        self._rank = None
+        if key is None:
+            # Not a sortable column: back to the order rows were loaded in.
+            self._order = None
+            if self._match_rows is None:
+                self._change_view_rows(None)
+            else:
+                self._change_view_rows(sorted(self._shown))
+            return
+        sort_key = self._sort_key_function()
+        self._order = sorted(range(len(self._store)), key=sort_key, reverse=self._sort_reverse)
+        if self._match_rows is None:
+            self._change_view_rows(list(self._order))
+        else:
+            self._change_view_rows(sorted(self._shown, key=sort_key, reverse=self._sort_reverse))
+
+    def package_count(self):
+        """Number of packages loaded, shown or not."""
+        return len(self._store)
+
+    def stored_package(self, store_row):
+        return self._store.package(store_row)
+
+    def package_name(self, row):
+        return self._store.name(self._store_row(row))
+
+    def package_version(self, row):
+        return self._store.version(self._store_row(row))
+
+    def package(self, row):
+        return self._store.package(self._store_row(row))
+
     def get_checked_packages(self):
-         return [pkg['name'] for pkg in self._package_data if pkg.get('remove')]
+        return [self._store.name(row) for row in self._store.checked_rows()]
 
     def set_package_status(self, package_name, status):
-        for row in range(len(self._package_data)):
-            if self._package_data[row]['name'] == package_name:
-                self._package_data[row]['status'] = status
+        for row in self._store.rows_of(package_name):
+            self._store.set_status(row, status)
+            view_row = self._view_row(row)
+            if view_row is not None:
+                self.dataChanged.emit(self.index(view_row, 0), self.index(view_row, len(self._headers) - 1),
+                                      [Qt.ItemDataRole.BackgroundRole])
 
     def clear_package_statuses(self):
-        for pkg in self._package_data:
-            if 'status' in pkg:
-                pkg.pop('status')
+        self._store.clear_statuses()
+        if self.rowCount():
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, len(self._headers) - 1),
+                                  [Qt.ItemDataRole.BackgroundRole])
+
+# Shown as a tooltip on the search boxes of the package tables.
+SEARCH_SYNTAX_HELP = (
+    "Space-separated terms, all of which must match:\n"
+    "  word  name:word  version:word  - substring match\n"
+    "  section:doc  priority:required  arch:amd64\n"
+    "  size>10M  size<=512K  - installed size\n"
+    "  /^lib.*-dev$/  or  re:pattern  - regex on the name\n"
+    "  !term  - exclude matches"
+)
+
+class PackageSortFilterProxyModel(QIdentityProxyModel):
+    """Debounced search box filter over a PackageListModel.
+
+    Matches come from a PackageSearchIndex and are handed to the source model
+    with set_row_filter(); sorting is passed on to the source model too. The
+    proxy never filters or compares rows itself.
+    """
+    # Keystrokes arriving within this window are folded into one filter pass.
+    FILTER_DELAY_MS = 150
 
-class PackageSortFilterProxyModel(QSortFilterProxyModel):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.filter_text = ""
+        self._pending_filter_text = ""
+        self._filter_terms = []
+        self._search_index = None
+        self._accepted_rows = None
+        self._searched_rows = 0
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(self.FILTER_DELAY_MS)
+        self._filter_timer.timeout.connect(self._apply_filter)
 
-    def setFilterText(self, text):
-        self.filter_text = text.lower()
-        self.invalidateFilter()
+    def setSourceModel(self, model):
+        old_model = self.sourceModel()
+        if old_model is not None:
+            try:
+                old_model.rows_replaced.disconnect(self._reset_search_index)
+            except TypeError:
+                pass
+        super().setSourceModel(model)
+        model.rows_replaced.connect(self._reset_search_index)
+        self._reset_search_index()
 
-    def filterAcceptsRow(self, source_row, source_parent):
-        if not self.filter_text:
-            return True
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.sourceModel().sort(column, order)
+
+    def _reset_search_index(self):
+        # Built lazily on the first search.
+        self._search_index = None
+        self._accepted_rows = None
+        self._searched_rows = 0
+        if self.filter_text:
+            # Re-run the active filter against the new rows.
+            if not self._filter_timer.isActive():
+                self._pending_filter_text = self.filter_text
+            self.filter_text = ""
+            self._apply_filter()
+
+    def _sync_search_index(self):
+        if self._search_index is None:
+            self._search_index = PackageSearchIndex()
         model = self.sourceModel()
-        package_name = model._package_data[source_row]['name']
-        package_version = model._package_data[source_row]['version']
-        return (self.filter_text in package_name.lower() or
-                self.filter_text in package_version.lower())
+        for row in range(len(self._search_index), model.package_count()):
+            self._search_index.add(model.stored_package(row))
+        return self._search_index
+
+    def setFilterText(self, text):
+        # Terms are lower-cased by parse_query; regexes keep their escapes.
+        self._pending_filter_text = text.strip()
+        self._filter_timer.start()
+
+    def _apply_filter(self):
+        text = self._pending_filter_text
+        if text == self.filter_text:
+            return
+        candidates = None
+        if self._accepted_rows is not None and narrows(self.filter_text, text):
+            # The query was extended: only rows matching the previous query
+            # (and rows added since) can still match.
+            candidates = self._accepted_rows
+            if self._searched_rows < self.sourceModel().package_count():
+                candidates = candidates.union(range(self._searched_rows, self.sourceModel().package_count()))
+        self.filter_text = text
+        self._filter_terms = parse_query(text)
+        if self._filter_terms:
+            search_index = self._sync_search_index()
+            self._accepted_rows = search_index.evaluate(self._filter_terms, candidates)
+            self._searched_rows = len(search_index)
+            self.sourceModel().set_row_filter(self._accepted_rows, self._search_loaded_rows)
+        else:
+            self._accepted_rows = None
+            self.sourceModel().set_row_filter(None)
+
+    def _search_loaded_rows(self, rows):
+        # Rows streamed into the source model after the last search.
+        search_index = self._sync_search_index()
+        matched = search_index.evaluate(self._filter_terms, rows)
+        self._accepted_rows |= matched
+        self._searched_rows = len(search_index)
+        return sorted(matched)
@@ -0,0 +1,393 @@
+import bisect
+import re
+from array import array
+
+_TEXT_FIELDS = ("name", "version")
+
+# Candidate sets at or below this size are filtered row by row rather than
+# intersected with another index lookup.
+_FILTER_THRESHOLD = 256
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _add_postings(postings, text, item):
+    for gram in _trigrams(text):
+        posting = postings.get(gram)
+        if posting is None:
+            posting = postings[gram] = array('I')
+        posting.append(item)
+
+
+def _match(query, texts, postings):
+    # Ids of `texts` containing `query`. The rarest trigram of the query gives
+    # the candidates; each one is then confirmed with a plain substring test.
+    if len(query) < 3:
+        return {item for item, text in enumerate(texts) if query in text}
+    if len(query) == 3:
+        # The posting list of a single trigram needs no confirmation.
+        return set(postings.get(query, ()))
+    smallest = None
+    for gram in _trigrams(query):
+        posting = postings.get(gram)
+        if posting is None:
+            return set()
+        if smallest is None or len(posting) < len(smallest):
+            smallest = posting
+    return {item for item in smallest if query in texts[item]}
+
+
+class TrigramIndex:
+    """Lower-case trigram index over package names and versions.
+
+    Rows are appended in order, so the index can follow a model that grows.
+    Versions repeat a lot, so each distinct version string is indexed once
+    and mapped back to its rows.
+    """
+
+    def __init__(self):
+        self._names = []
+        self._name_postings = {}
+        self._row_versions = array('I')
+        self._versions = []
+        self._version_ids = {}
+        self._version_rows = []
+        self._version_postings = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, name, version):
+        row = len(self._names)
+        name = name.lower()
+        self._names.append(name)
+        _add_postings(self._name_postings, name, row)
+
+        version = version.lower()
+        version_id = self._version_ids.get(version)
+        if version_id is None:
+            version_id = self._version_ids[version] = len(self._versions)
+            self._versions.append(version)
+            self._version_rows.append(array('I'))
+            _add_postings(self._version_postings, version, version_id)
+        self._version_rows[version_id].append(row)
+        self._row_versions.append(version_id)
+
+    def name(self, row):
+        return self._names[row]
+
+    def version(self, row):
+        return self._versions[self._row_versions[row]]
+
+    def estimate(self, query):
+        # Size of the smallest name posting list, i.e. the work an index
+        # lookup would do.
+        if len(query) < 3:
+            return len(self._names)
+        return min((len(self._name_postings.get(gram, ())) for gram in _trigrams(query)), default=0)
+
+    def matches(self, row, query, fields=_TEXT_FIELDS):
+        return (("name" in fields and query in self._names[row]) or
+                ("version" in fields and query in self.version(row)))
+
+    def search(self, query, candidates=None, fields=_TEXT_FIELDS):
+        """Return the set of rows whose name or version contains `query`.
+
+        `candidates` may hold a superset of the answer, typically the result
+        for a shorter prefix of the query; it is checked directly when that
+        is cheaper than going through the index.
+        """
+        query = query.lower()
+        if candidates is not None and len(candidates) <= self.estimate(query):
+            return self.filter(query, candidates, fields)
+
+        rows = set()
+        if "name" in fields:
+            rows = _match(query, self._names, self._name_postings)
+        if "version" in fields:
+            for version_id in _match(query, self._versions, self._version_postings):
+                rows.update(self._version_rows[version_id])
+        return rows
+
+    def filter(self, query, rows, fields=_TEXT_FIELDS):
+        """Return the rows of `rows` whose name or version contains `query`."""
+        query = query.lower()
+        if fields == _TEXT_FIELDS:
+            names, versions, row_versions = self._names, self._versions, self._row_versions
+            return {row for row in rows if query in names[row] or query in versions[row_versions[row]]}
+        return {row for row in rows if self.matches(row, query, fields)}
+
+
+class _ValueIndex:
+    """Posting lists of rows per lower-case field value (section, priority...)."""
+
+    def __init__(self):
+        self.values = []
+        self._postings = {}
+        self._lowered = {}
+
+    def add(self, value):
+        row = len(self.values)
+        lowered = self._lowered.get(value)
+        if lowered is None:
+            lowered = self._lowered[value] = value.lower()
+        self.values.append(lowered)
+        self._postings.setdefault(lowered, array('I')).append(row)
+        # "universe/doc" can also be found as "doc".
+        if "/" in lowered:
+            self._postings.setdefault(lowered.rsplit("/", 1)[1], array('I')).append(row)
+
+    def rows(self, value):
+        return self._postings.get(value, ())
+
+    def matches(self, row, value):
+        current = self.values[row]
+        return current == value or current.endswith("/" + value)
+
+
+class _SizeIndex:
+    """Installed sizes with a row order sorted by size for range queries."""
+
+    def __init__(self):
+        self.sizes = array('Q')
+        self._order = None
+        self._sorted = None
+
+    def add(self, size):
+        self.sizes.append(size)
+        self._order = None
+
+    def _bounds(self, op, value):
+        if self._order is None:
+            order = sorted(range(len(self.sizes)), key=self.sizes.__getitem__)
+            self._order = array('I', order)
+            self._sorted = array('Q', (self.sizes[row] for row in order))
+        if op == ">":
+            return bisect.bisect_right(self._sorted, value), len(self._sorted)
+        if op == ">=":
+            return bisect.bisect_left(self._sorted, value), len(self._sorted)
+        if op == "<":
+            return 0, bisect.bisect_left(self._sorted, value)
+        if op == "<=":
+            return 0, bisect.bisect_right(self._sorted, value)
+        return bisect.bisect_left(self._sorted, value), bisect.bisect_right(self._sorted, value)
+
+    def count(self, op, value):
+        low, high = self._bounds(op, value)
+        return high - low
+
+    def rows(self, op, value):
+        low, high = self._bounds(op, value)
+        return self._order[low:high]
+
+    def matches(self, row, op, value):
+        size = self.sizes[row]
+        return {">": size > value, ">=": size >= value, "<": size < value,
+                "<=": size <= value, "=": size == value}[op]
+
+
+class _Term:
+    negated = False
+
+    def estimate(self, index):
+        return len(index)
+
+    def filter(self, index, rows):
+        # The members of `rows` this term matches.
+        return {row for row in rows if self.matches(index, row)}
+
+
+class _TextTerm(_Term):
+    def __init__(self, text, fields=_TEXT_FIELDS):
+        self.text = text
+        self.fields = fields
+
+    def estimate(self, index):
+        return index.text.estimate(self.text)
+
+    def rows(self, index):
+        return index.text.search(self.text, fields=self.fields)
+
+    def matches(self, index, row):
+        return index.text.matches(row, self.text, self.fields)
+
+    def filter(self, index, rows):
+        return index.text.filter(self.text, rows, self.fields)
+
+
+class _ValueTerm(_Term):
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def estimate(self, index):
+        return len(index.values[self.field].rows(self.value))
+
+    def rows(self, index):
+        return index.values[self.field].rows(self.value)
+
+    def matches(self, index, row):
+        return index.values[self.field].matches(row, self.value)
+
+
+class _SizeTerm(_Term):
+    def __init__(self, op, value):
+        self.op = op
+        self.value = value
+
+    def estimate(self, index):
+        return index.sizes.count(self.op, self.value)
+
+    def rows(self, index):
+        return index.sizes.rows(self.op, self.value)
+
+    def matches(self, index, row):
+        return index.sizes.matches(row, self.op, self.value)
+
+
+class _RegexTerm(_Term):
+    def __init__(self, pattern):
+        try:
+            self.regex = re.compile(pattern, re.IGNORECASE)
+        except re.error:
+            # Half-typed patterns are matched literally until they compile.
+            self.regex = re.compile(re.escape(pattern), re.IGNORECASE)
+
+    def rows(self, index):
+        search = self.regex.search
+        return {row for row in range(len(index)) if search(index.text.name(row))}
+
+    def matches(self, index, row):
+        return self.regex.search(index.text.name(row)) is not None
+
+
+_FIELD_NAMES = {
+    "section": "section",
+    "priority": "priority",
+    "arch": "architecture",
+    "architecture": "architecture",
+    "name": "name",
+    "version": "version",
+}
+
+_SIZE_TERM = re.compile(r"^size(>=|<=|>|<|=)(\d+(?:\.\d+)?)([kmgt]?)(?:i?b)?$")
+_SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+def _parse_term(token):
+    negated = token.startswith("!") and len(token) > 1
+    if negated:
+        token = token[1:]
+    lowered = token.lower()
+    size = _SIZE_TERM.match(lowered)
+    field, sep, value = lowered.partition(":")
+    if size:
+        op, number, unit = size.groups()
+        term = _SizeTerm(op, int(float(number) * _SIZE_UNITS[unit]))
+    elif len(token) > 2 and token.startswith("/") and token.endswith("/"):
+        term = _RegexTerm(token[1:-1])
+    elif sep and field == "re" and value:
+        term = _RegexTerm(token[3:])
+    elif sep and value and field in _FIELD_NAMES:
+        field = _FIELD_NAMES[field]
+        if field in _TEXT_FIELDS:
+            term = _TextTerm(value, (field,))
+        else:
+            term = _ValueTerm(field, value)
+    else:
+        term = _TextTerm(lowered)
+    term.negated = negated
+    return term
+
+
+def parse_query(text):
+    """Parse a search box query into terms that must all match.
+
+    Supported terms (case-insensitive, separated by spaces):
+      word            substring of the name or version
+      name:x          substring of the name only (version:x likewise)
+      section:doc     exact section; "doc" also matches "universe/doc"
+      priority:x      exact priority (arch:x likewise)
+      size>10M        installed size; >, >=, <, <=, = with K/M/G/T suffixes
+      /regex/, re:x   regular expression searched in the name
+      !term           negates any of the above
+    """
+    return [_parse_term(token) for token in text.split()]
+
+
+def _is_plain(token):
+    return not token.startswith(("!", "/")) and not any(c in token for c in ":<>=")
+
+
+def narrows(old_query, new_query):
+    """True if every row matching `new_query` is known to match `old_query`.
+
+    That holds when the new query only extends plain words or adds terms,
+    which is what happens while the user keeps typing.
+    """
+    old_tokens, new_tokens = old_query.split(), new_query.split()
+    if not old_tokens or len(new_tokens) < len(old_tokens):
+        return False
+    for old, new in zip(old_tokens, new_tokens):
+        if old != new and not (_is_plain(old) and _is_plain(new) and old in new):
+            return False
+    return True
+
+
+class PackageSearchIndex:
+    """All indexes used by the package table search box.
+
+    Holds the trigram index for names and versions, posting lists for
+    section, priority and architecture and a size-sorted row order. Queries
+    are planned so the most selective term produces the candidate rows and
+    the remaining terms only narrow them.
+    """
+
+    def __init__(self):
+        self.text = TrigramIndex()
+        self.values = {
+            "section": _ValueIndex(),
+            "priority": _ValueIndex(),
+            "architecture": _ValueIndex(),
+        }
+        self.sizes = _SizeIndex()
+
+    def __len__(self):
+        return len(self.text)
+
+    def add(self, pkg):
+        self.text.add(pkg['name'], pkg.get('version', ''))
+        for field, values in self.values.items():
+            values.add(pkg.get(field, ''))
+        self.sizes.add(pkg.get('installed_size', 0))
+
+    def evaluate(self, terms, candidates=None):
+        """Return the set of rows matching all `terms`.
+
+        `candidates`, if given, is a superset of the answer to start from.
+        """
+        positive = sorted((term for term in terms if not term.negated), key=lambda term: term.estimate(self))
+        negative = [term for term in terms if term.negated]
+        if candidates is not None:
+            rows = set(candidates)
+        elif positive:
+            rows = set(positive.pop(0).rows(self))
+        else:
+            rows = set(range(len(self)))
+
+        for term in positive:
+            if len(rows) > _FILTER_THRESHOLD and term.estimate(self) < len(rows):
+                rows.intersection_update(term.rows(self))
+            else:
+                rows = term.filter(self, rows)
+        for term in negative:
+            rows -= term.filter(self, rows)
+        return rows
+
+    def query(self, text, candidates=None):
+        return self.evaluate(parse_query(text), candidates)
+
+    def matches(self, terms, row):
+        return all(term.matches(self, row) != term.negated for term in terms)
@@ -0,0 +1,135 @@
+import sys
+from array import array
+
+# Status byte values; 0 means "no status".
+_STATUS_NAMES = [None, 'removing', 'removed', 'error']
+_STATUS_CODES = {name: code for code, name in enumerate(_STATUS_NAMES)}
+
+
+class StringPool:
+    """Interns repeated strings (versions, sections...) behind small integer ids."""
+
+    def __init__(self):
+        self.values = [""]
+        self._ids = {"": 0}
+
+    def intern(self, value):
+        value_id = self._ids.get(value)
+        if value_id is None:
+            value_id = self._ids[value] = len(self.values)
+            self.values.append(sys.intern(value))
+        return value_id
+
+
+class PackageStore:
+    """Column-oriented storage for package rows.
+
+    Each field lives in its own array instead of one dict per row: names are
+    interned strings, the short repeated fields are ids into a shared
+    StringPool, the remove flags are a bitset and the statuses one byte per
+    row. A name -> row dict makes per-package lookups O(1).
+    """
+
+    def __init__(self, package_data=()):
+        self._pool = StringPool()
+        self._names = []
+        self._versions = array('I')
+        self._architectures = array('I')
+        self._sections = array('I')
+        self._priorities = array('I')
+        self._sizes = array('Q')
+        self._remove = bytearray()
+        self._status = bytearray()
+        self._row_by_name = {}
+        # Extra rows for names present more than once (one per architecture).
+        self._duplicate_rows = {}
+        self.extend(package_data)
+
+    def __len__(self):
+        return len(self._names)
+
+    def extend(self, package_data):
+        intern = self._pool.intern
+        for pkg in package_data:
+            row = len(self._names)
+            name = sys.intern(pkg['name'])
+            self._names.append(name)
+            self._versions.append(intern(pkg.get('version', '')))
+            self._architectures.append(intern(pkg.get('architecture', '')))
+            self._sections.append(intern(pkg.get('section', '')))
+            self._priorities.append(intern(pkg.get('priority', '')))
+            self._sizes.append(pkg.get('installed_size', 0))
+            if row % 8 == 0:
+                self._remove.append(0)
+            self._status.append(_STATUS_CODES.get(pkg.get('status'), 0))
+            if pkg.get('remove'):
+                self.set_checked(row, True)
+            if name in self._row_by_name:
+                self._duplicate_rows.setdefault(name, []).append(row)
+            else:
+                self._row_by_name[name] = row
+
+    def name(self, row):
+        return self._names[row]
+
+    def version(self, row):
+        return self._pool.values[self._versions[row]]
+
+    def architecture(self, row):
+        return self._pool.values[self._architectures[row]]
+
+    def section(self, row):
+        return self._pool.values[self._sections[row]]
+
+    def priority(self, row):
+        return self._pool.values[self._priorities[row]]
+
+    def installed_size(self, row):
+        return self._sizes[row]
+
+    def get(self, row, key):
+        return getattr(self, key)(row)
+
+    def package(self, row):
+        return {
+            'name': self.name(row),
+            'version': self.version(row),
+            'architecture': self.architecture(row),
+            'installed_size': self.installed_size(row),
+            'section': self.section(row),
+            'priority': self.priority(row),
+            'remove': self.is_checked(row),
+            'status': self.status(row),
+        }
+
+    def rows_of(self, name):
+        """Return every row holding `name` (usually zero or one)."""
+        row = self._row_by_name.get(name)
+        if row is None:
+            return []
+        return [row] + self._duplicate_rows.get(name, [])
+
+    def is_checked(self, row):
+        return bool(self._remove[row >> 3] & (1 << (row & 7)))
+
+    def set_checked(self, row, checked):
+        if checked:
+            self._remove[row >> 3] |= 1 << (row & 7)
+        else:
+            self._remove[row >> 3] &= ~(1 << (row & 7)) & 0xFF
+
+    def checked_rows(self):
+        for byte_index, byte in enumerate(self._remove):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (byte_index << 3) | bit
+
+    def status(self, row):
+        return _STATUS_NAMES[self._status[row]]
+
+    def set_status(self, row, status):
+        self._status[row] = _STATUS_CODES[status]
+
+    def clear_statuses(self):
+        self._status = bytearray(len(self._names))
@@ -0,0 +1,401 @@
+import json
+import os
+import re
+import shlex
+import shutil
+import stat
+import struct
+import time
+
+from chroot_env import mounts_under
+from iso9660 import copy_range, find_extent
+
+# Where live ISOs keep their root filesystem, relative to the ISO root.
+LIVE_ROOT_IMAGES = (
+    os.path.join("casper", "filesystem.squashfs"),  # Ubuntu and derivatives
+    os.path.join("live", "filesystem.squashfs"),  # Debian live
+)
+
+SQUASHFS_MAGIC = b"hsqs"
+# magic, inode count, mkfs time, block size, fragment count, compression id,
+# block log, flags, id count, major and minor version, root inode, bytes used,
+# then the start of the id, xattr, inode, directory, fragment and export tables.
+_SUPERBLOCK = struct.Struct("<4sIIIIHHHHHHQQQQQQQQ")
+
+COMPRESSORS = {
+    1: "gzip",
+    2: "lzma",
+    3: "lzo",
+    4: "xz",
+    5: "lz4",
+    6: "zstd",
+}
+
+# Compressors mksquashfs can write, with their (lowest, highest, default)
+# -Xcompression-level. lz4 has no levels, only normal (0) and high
+# compression (1, -Xhc); xz takes no level at all.
+COMPRESSION_LEVELS = {
+    "gzip": (1, 9, 9),
+    "xz": None,
+    "lzo": (1, 9, 8),
+    "lz4": (0, 1, 0),
+    "zstd": (1, 22, 15),
+}
+
+# mksquashfs accepts powers of two from 4K to 1M; 128K is its default.
+BLOCK_SIZES = tuple(4096 << shift for shift in range(9))
+DEFAULT_BLOCK_SIZE = 131072
+
+FRAGMENT_MODES = {
+    "default": [],
+    "none": ["-no-fragments"],
+    "always": ["-always-use-fragments"],
+}
+
+DEFAULT_COMPRESSION_OPTIONS = {
+    "method": "gzip",
+    "level": 9,
+    "threads": 0,
+    "block_size": DEFAULT_BLOCK_SIZE,
+    "fragments": "default",
+    "custom_command": "",
+    # Compress only what changed since extraction into a layer on top of the
+    # original image; see stage_layer().
+    "incremental": True,
+}
+
+# casper and live-boot mount every *.squashfs in the image's directory in name
+# order and stack each one over the ones before it, so the layer must sort
+# after the image it updates. Debian live media list them in filesystem.module.
+LAYER_SUFFIX = ".update.squashfs"
+LIVE_MODULE_FILE = "filesystem.module"
+
+# unsquashfs and mksquashfs draw "[====/    ] 1234/5678  21%", redrawn in
+# place with \r.
+_PROGRESS = re.compile(r"(\d+)/(\d+)\s+\d+%")
+# mksquashfs ends with "Filesystem size 3532.47 Kbytes (3.45 Mbytes)" and
+# "34.12% of uncompressed filesystem size (10353.14 Kbytes)".
+_PACKED_SIZE = re.compile(r"Filesystem size ([\d.]+) Kbytes")
+_UNPACKED_SIZE = re.compile(r"of uncompressed filesystem size \(([\d.]+) Kbytes\)")
+
+
+def _progress_fraction(text):
+    """Fraction done according to the last progress bar in `text`, or None."""
+    last = None
+    for last in _PROGRESS.finditer(text):
+        pass
+    if last is None:
+        return None
+    done, total = int(last.group(1)), int(last.group(2))
+    if not total:
+        return None
+    return min(done / total, 1.0)
+
+
+def read_superblock(path, offset=0):
+    """Return the superblock fields of the squashfs image at `path` as a dict.
+
+    `offset` is where the image starts within the file, e.g. its extent
+    inside an ISO.
+    """
+    with open(path, "rb") as image:
+        image.seek(offset)
+        data = image.read(_SUPERBLOCK.size)
+    if len(data) < _SUPERBLOCK.size or data[:4] != SQUASHFS_MAGIC:
+        raise ValueError(f"Not a squashfs image: {path}")
+    fields = _SUPERBLOCK.unpack(data)
+    _magic, inodes, mkfs_time, block_size, fragments, compression = fields[:6]
+    major, minor, _root_inode, bytes_used = fields[9:13]
+    if major != 4:
+        raise ValueError(f"Unsupported squashfs version {major}.{minor}: {path}")
+    return {
+        'inodes': inodes,
+        'mkfs_time': mkfs_time,
+        'block_size': block_size,
+        'fragments': fragments,
+        'compression': COMPRESSORS.get(compression, f"unknown ({compression})"),
+        'bytes_used': bytes_used,
+    }
+
+
+def find_live_root(iso_root):
+    """Return the path of the live root filesystem image under `iso_root`, or None."""
+    for relative_path in LIVE_ROOT_IMAGES:
+        path = os.path.join(iso_root, relative_path)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def locate_live_root(iso_path):
+    """Find the live root filesystem image inside the ISO file itself.
+
+    Returns (path inside the ISO, byte offset, size) or None, without
+    extracting anything.
+    """
+    for relative_path in LIVE_ROOT_IMAGES:
+        extent = find_extent(iso_path, relative_path)
+        if extent is not None:
+            return (relative_path,) + extent
+    return None
+
+
+def unsquash_command(image, destination, processors=None, offset=0):
+    """Command line unpacking `image` into `destination` with `processors` threads.
+
+    unsquashfs decompresses blocks on all of them in parallel; the default is
+    one per CPU. A non-zero `offset` reads the image in place from inside a
+    larger file, such as the ISO it ships in.
+    """
+    if processors is None:
+        processors = os.cpu_count() or 1
+    command = ["unsquashfs", "-f", "-d", destination, "-processors", str(processors)]
+    if offset:
+        command += ["-o", str(offset)]
+    return command + [image]
+
+
+def staging_path(destination):
+    """Fresh directory to unpack into before replace_tree() moves it to `destination`."""
+    return destination + ".unpacking"
+
+
+def replace_tree(staging, destination):
+    """Move the unpacked tree `staging` to `destination`, deleting the tree that was there.
+
+    unsquashfs -f writes over whatever its destination holds, so files left
+    by an earlier extraction or build would survive into the new tree.
+    Raises OSError, leaving both trees alone, while anything is still
+    mounted inside `destination`.
+    """
+    if os.path.lexists(destination):
+        mounts = mounts_under(destination)
+        if mounts:
+            raise OSError(f"{destination} still has mounts: {', '.join(mounts)}")
+        old = destination + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        os.rename(destination, old)
+        os.rename(staging, destination)
+        shutil.rmtree(old)
+    else:
+        os.rename(staging, destination)
+
+
+class UnsquashProgress:
+    """Tracks how far an unsquashfs run has got from its progress bar.
+
+    unsquashfs counts data blocks and non-file inodes as it writes them;
+    the fraction done is scaled to the image's size and inode count from
+    the superblock.
+    """
+
+    def __init__(self, superblock):
+        self.bytes_total = superblock['bytes_used']
+        self.inodes_total = superblock['inodes']
+        self.fraction = 0.0
+
+    def feed(self, text):
+        """Update from a chunk of unsquashfs output; True if progress moved."""
+        fraction = _progress_fraction(text)
+        if fraction is None or fraction == self.fraction:
+            return False
+        self.fraction = fraction
+        return True
+
+    @property
+    def percent(self):
+        return int(self.fraction * 100)
+
+    @property
+    def bytes_done(self):
+        return int(self.bytes_total * self.fraction)
+
+    @property
+    def inodes_done(self):
+        return int(self.inodes_total * self.fraction)
+
+
+def mksquash_command(source, image, options, pseudo_file=None):
+    """Command line packing the tree at `source` into a new squashfs `image`.
+
+    `options` is a dict shaped like DEFAULT_COMPRESSION_OPTIONS, as returned
+    by AdvancedCompressionDialog. With method "Custom" the compressor
+    arguments come from `custom_command` instead, split like a shell would.
+    Threads of 0 leave mksquashfs to use every CPU. `pseudo_file` adds the
+    entries defined in it, such as the whiteouts from write_whiteouts().
+    """
+    options = dict(DEFAULT_COMPRESSION_OPTIONS, **options)
+    command = ["mksquashfs", source, image, "-noappend"]
+    method = options["method"]
+    if method == "Custom":
+        command += shlex.split(options["custom_command"])
+    elif method in COMPRESSION_LEVELS:
+        command += ["-comp", method]
+        levels = COMPRESSION_LEVELS[method]
+        if method == "lz4":
+            if options["level"]:
+                command.append("-Xhc")
+        elif levels is not None:
+            lowest, highest, _default = levels
+            level = min(max(options["level"], lowest), highest)
+            command += ["-Xcompression-level", str(level)]
+        command += ["-b", str(options["block_size"])]
+        command += FRAGMENT_MODES[options["fragments"]]
+    else:
+        raise ValueError(f"mksquashfs cannot compress with {method}")
+    if pseudo_file:
+        command += ["-pf", pseudo_file]
+    if options["threads"]:
+        command += ["-processors", str(options["threads"])]
+    return command
+
+
+class MksquashProgress:
+    """Tracks an mksquashfs run: its progress bar and closing size summary."""
+
+    def __init__(self):
+        self.fraction = 0.0
+        self.packed_bytes = None
+        self.unpacked_bytes = None
+
+    def feed(self, text):
+        """Update from a chunk of mksquashfs output; True if progress moved."""
+        match = _PACKED_SIZE.search(text)
+        if match:
+            self.packed_bytes = int(float(match.group(1)) * 1024)
+        match = _UNPACKED_SIZE.search(text)
+        if match:
+            self.unpacked_bytes = int(float(match.group(1)) * 1024)
+        fraction = _progress_fraction(text)
+        if fraction is None or fraction == self.fraction:
+            return False
+        self.fraction = fraction
+        return True
+
+    @property
+    def percent(self):
+        return int(self.fraction * 100)
+
+
+def record_build(log_path, image, options, seconds, unpacked_bytes=None):
+    """Append the settings, size and speed of a squashfs build to `log_path`.
+
+    The log holds one JSON object per line so builds can be compared when
+    tuning the compression settings. Returns the recorded entry.
+    """
+    packed_bytes = os.path.getsize(image)
+    entry = {
+        'time': int(time.time()),
+        'image': image,
+        'options': dict(DEFAULT_COMPRESSION_OPTIONS, **options),
+        'seconds': round(seconds, 3),
+        'packed_bytes': packed_bytes,
+        'unpacked_bytes': unpacked_bytes,
+        'ratio': round(packed_bytes / unpacked_bytes, 4) if unpacked_bytes else None,
+        # Uncompressed input consumed per second.
+        'throughput': round(unpacked_bytes / seconds) if unpacked_bytes and seconds else None,
+    }
+    with open(log_path, "a") as log:
+        log.write(json.dumps(entry) + "\n")
+    return entry
+
+
+def layer_image_path(image):
+    """Path of the delta layer stacked over the squashfs `image`."""
+    directory, name = os.path.split(image)
+    if name.endswith(".squashfs"):
+        name = name[:-len(".squashfs")]
+    return os.path.join(directory, name + LAYER_SUFFIX)
+
+
+def update_module_list(layer):
+    """List `layer` in the filesystem.module next to it while it exists.
+
+    Only Debian live media have that file; casper picks layers up by name.
+    """
+    module_path = os.path.join(os.path.dirname(layer), LIVE_MODULE_FILE)
+    if not os.path.isfile(module_path):
+        return
+    with open(module_path) as module_file:
+        names = module_file.read().split()
+    name = os.path.basename(layer)
+    listed = [entry for entry in names if entry != name]
+    if os.path.exists(layer):
+        listed.append(name)
+    if listed != names:
+        with open(module_path, "w") as module_file:
+            module_file.write("".join(entry + "\n" for entry in listed))
+
+
+def copy_image(source, offset, size, destination):
+    """Copy the `size` bytes at `offset` in `source`, e.g. an image inside the ISO."""
+    with open(source, "rb") as source_file, open(destination, "wb", buffering=0) as destination_file:
+        copied = copy_range(source_file, offset, size, destination_file)
+    if copied != size:
+        raise OSError(f"{source} ends {size - copied} bytes into the image")
+
+
+def stage_layer(root, changes, entries, staging):
+    """Lay out the delta layer for `changes` to the tree at `root` in `staging`.
+
+    Added and changed files are hard-linked (copied across filesystems),
+    with every directory above them recreated with the original's owner,
+    mode and times. `entries` is the current manifest of `root`. Returns the
+    removed paths that need a whiteout: those whose parent directory is
+    still there.
+    """
+    directories = set()
+
+    def add_parents(path):
+        parent = os.path.dirname(path)
+        while parent and parent not in directories:
+            directories.add(parent)
+            parent = os.path.dirname(parent)
+
+    files = []
+    for path in changes.added + changes.changed:
+        if stat.S_ISDIR(entries[path].mode):
+            directories.add(path)
+        else:
+            files.append(path)
+        add_parents(path)
+
+    whiteouts = []
+    for path in changes.removed:
+        parent = os.path.dirname(path)
+        # A removed directory's whiteout already hides everything below it.
+        if not parent or (parent in entries and stat.S_ISDIR(entries[parent].mode)):
+            whiteouts.append(path)
+            add_parents(path)
+
+    os.makedirs(staging)
+    for path in sorted(directories):
+        os.mkdir(os.path.join(staging, path))
+    for path in files:
+        source, target = os.path.join(root, path), os.path.join(staging, path)
+        try:
+            os.link(source, target, follow_symlinks=False)
+        except OSError:
+            shutil.copy2(source, target, follow_symlinks=False)
+    # Deepest first, so creating children does not bump a parent's mtime
+    # again; the layer's root takes the attributes of the tree's root.
+    for path in sorted(directories, reverse=True) + [""]:
+        source, target = os.path.join(root, path), os.path.join(staging, path)
+        status = os.lstat(source)
+        try:
+            os.chown(target, status.st_uid, status.st_gid)
+        except PermissionError:
+            pass
+        shutil.copystat(source, target, follow_symlinks=False)
+    return whiteouts
+
+
+def write_whiteouts(paths, pseudo_path):
+    """Write an mksquashfs pseudo file hiding `paths` in the layers below.
+
+    overlayfs treats a 0/0 character device as a deleted entry.
+    """
+    with open(pseudo_path, "w") as pseudo_file:
+        for path in paths:
+            escaped = re.sub(r'([\\\s"\'])', r"\\\1", path)
+            pseudo_file.write(f"{escaped} c 0000 0 0 0 0\n")
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+import time
+
+from manifest import TreeManifest, changes_since
+
+DEFAULT_BUDGET = 20 << 30
+
+_TREE = "tree"
+_PATHS = "paths"
+_REMOVED = "removed"
+_META = "meta.json"
+
+
+def stage_key(previous, name, command, inputs=()):
+    """Key of the tree a stage leaves behind: a hash of the key it started from, the stage itself and `inputs`."""
+    return hashlib.sha256(json.dumps([previous, name, list(command), list(inputs)]).encode()).hexdigest()
+
+
+def stage_keys(base, stages, inputs=()):
+    """Keys for each of `stages`, a list of (name, command) run in order on the tree keyed `base`."""
+    keys = []
+    for name, command in stages:
+        base = stage_key(base, name, command, inputs)
+        keys.append(base)
+    return keys
+
+
+def _write_list(path, paths):
+    with open(path, "wb") as list_file:
+        list_file.write(b"\0".join(os.fsencode(item) for item in paths))
+
+
+def _read_list(path):
+    with open(path, "rb") as list_file:
+        data = list_file.read()
+    return [os.fsdecode(item) for item in data.split(b"\0")] if data else []
+
+
+def _same_file(first, second):
+    return (first.st_size, first.st_mtime_ns, first.st_mode, first.st_uid, first.st_gid) == \
+        (second.st_size, second.st_mtime_ns, second.st_mode, second.st_uid, second.st_gid)
+
+
+def _copy_file(source, target):
+    # copy_file_range() clones the extents on filesystems with reflinks
+    # (btrfs, XFS), so a copy there costs metadata only.
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        try:
+            while os.copy_file_range(source_file.fileno(), target_file.fileno(), 1 << 30):
+                pass
+        except OSError:
+            source_file.seek(0)
+            target_file.seek(0)
+            target_file.truncate()
+            shutil.copyfileobj(source_file, target_file, 1 << 20)
+    try:
+        for name in os.listxattr(source):
+            os.setxattr(target, name, os.getxattr(source, name))
+    except OSError:
+        # File capabilities and the like are lost where xattrs are not supported.
+        pass
+
+
+def _copy_entry(source, target, status):
+    """Recreate the non-directory `source` (lstat result `status`) at `target`."""
+    if stat.S_ISLNK(status.st_mode):
+        os.symlink(os.readlink(source), target)
+    elif stat.S_ISREG(status.st_mode):
+        _copy_file(source, target)
+    else:
+        os.mknod(target, status.st_mode, status.st_rdev)
+
+
+def _copy_attributes(target, status):
+    try:
+        os.chown(target, status.st_uid, status.st_gid, follow_symlinks=False)
+    except PermissionError:
+        pass
+    if not stat.S_ISLNK(status.st_mode):
+        os.chmod(target, stat.S_IMODE(status.st_mode))
+    os.utime(target, ns=(status.st_atime_ns, status.st_mtime_ns), follow_symlinks=False)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+def _disk_usage(directory):
+    # Blocks actually allocated, each hard-linked file counted once.
+    seen, total = set(), 0
+    for parent, directories, files in os.walk(directory):
+        for name in directories + files:
+            status = os.lstat(os.path.join(parent, name))
+            if (status.st_dev, status.st_ino) not in seen:
+                seen.add((status.st_dev, status.st_ino))
+                total += status.st_blocks * 512
+    return total
+
+
+class StageCache:
+    """Trees left behind by the step-4 stages, kept in `directory` under their stage keys.
+
+    A stage is stored as its difference from the tree's baseline (the
+    extracted root filesystem): the added and changed entries, copied, and
+    the removed paths. Files a stage did not touch are hard-linked to the
+    stage before it, so a chain of stages costs little more than its last
+    stage. Restoring a stage onto a tree still at the baseline rewrites only
+    those entries. The least recently used stages are evicted once the cache
+    outgrows `budget` bytes.
+    """
+
+    def __init__(self, directory, budget=DEFAULT_BUDGET):
+        self.directory = directory
+        self.budget = budget
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, name=""):
+        return os.path.join(self.directory, key, name)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key, _META))
+
+    def base_key(self, root, manifest_path):
+        """Key of `root` if it is still exactly its baseline in `manifest_path`, None otherwise.
+
+        Stages can only be restored onto, and stored from, a tree that
+        started at the baseline.
+        """
+        with TreeManifest(manifest_path, root) as manifest:
+            if not manifest.has_baseline():
+                return None
+            manifest.refresh()
+            if any(manifest.changes_since_baseline()):
+                return None
+            return manifest.baseline_digest()
+
+    def deepest(self, keys):
+        """Number of leading `keys` up to the last one that is cached; 0 if none is."""
+        for index in range(len(keys), 0, -1):
+            if keys[index - 1] in self:
+                return index
+        return 0
+
+    def _read_meta(self, key):
+        with open(self._path(key, _META)) as meta_file:
+            return json.load(meta_file)
+
+    def _write_meta(self, key, meta):
+        meta_path = self._path(key, _META)
+        with open(meta_path + ".tmp", "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _touch(self, key):
+        meta = self._read_meta(key)
+        meta["last_used"] = time.time()
+        self._write_meta(key, meta)
+
+    def stages(self):
+        """Return [(key, meta)] of the cached stages, least recently used first."""
+        stages = []
+        for key in os.listdir(self.directory):
+            try:
+                stages.append((key, self._read_meta(key)))
+            except (OSError, ValueError):
+                continue
+        return sorted(stages, key=lambda stage: stage[1].get("last_used", 0))
+
+    def store(self, key, root, manifest_path, name="", previous=None):
+        """Store `root` as the tree after the stage `key`; `previous` is the stage it started from.
+
+        Filesystems mounted inside `root` are left out, so a chroot session
+        can stay open.
+
+        Returns the number of bytes the cache now uses.
+        """
+        changes, _entries = changes_since(root, manifest_path)
+        root_device = os.lstat(root).st_dev
+        staging = self._path(key + ".tmp")
+        _remove(staging)
+        tree = os.path.join(staging, _TREE)
+        os.makedirs(tree)
+        previous_tree = self._path(previous, _TREE) if previous and previous in self else None
+
+        # Bytes this stage allocated, and bytes it shares with `previous`.
+        paths, directories, size, linked_size = [], [], 0, 0
+        for path in sorted(changes.added + changes.changed):
+            source, target = os.path.join(root, path), os.path.join(tree, path)
+            status = os.lstat(source)
+            # The scan stays on the tree's filesystem, but sees the mount
+            # points of a chroot session (/proc, /dev, ...) as changed.
+            if status.st_dev != root_device:
+                continue
+            paths.append(path)
+            # Unchanged directories above a changed entry are only placeholders.
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if stat.S_ISDIR(status.st_mode):
+                os.makedirs(target, exist_ok=True)
+                directories.append((target, status))
+                continue
+            if previous_tree is not None and stat.S_ISREG(status.st_mode):
+                linked = os.path.join(previous_tree, path)
+                try:
+                    if _same_file(os.lstat(linked), status):
+                        os.link(linked, target)
+                        linked_size += status.st_blocks * 512
+                        continue
+                except OSError:
+                    pass
+            _copy_entry(source, target, status)
+            _copy_attributes(target, status)
+            size += os.lstat(target).st_blocks * 512
+        # Deepest first, so filling a directory does not move its mtime again.
+        for target, status in reversed(directories):
+            _copy_attributes(target, status)
+            size += os.lstat(target).st_blocks * 512
+
+        _write_list(os.path.join(staging, _PATHS), paths)
+        _write_list(os.path.join(staging, _REMOVED), changes.removed)
+        for list_name in (_PATHS, _REMOVED):
+            size += os.lstat(os.path.join(staging, list_name)).st_blocks * 512
+        with open(os.path.join(staging, _META), "w") as meta_file:
+            json.dump({"name": name, "created": time.time(), "last_used": time.time(),
+                       "files": len(paths), "removed": len(changes.removed), "bytes": size,
+                       "previous": previous if previous_tree is not None else None,
+                       "linked_bytes": linked_size}, meta_file)
+        _remove(self._path(key))
+        os.rename(staging, self._path(key))
+        return self.evict(keep=key)
+
+    def restore(self, key, root):
+        """Turn `root`, still at its baseline, into the tree stored for `key`."""
+        stage = self._path(key)
+        tree = os.path.join(stage, _TREE)
+        for path in reversed(_read_list(os.path.join(stage, _REMOVED))):
+            _remove(os.path.join(root, path))
+        directories = []
+        for path in _read_list(os.path.join(stage, _PATHS)):
+            source, target = os.path.join(tree, path), os.path.join(root, path)
+            status = os.lstat(source)
+            if stat.S_ISDIR(status.st_mode):
+                if not os.path.isdir(target) or os.path.islink(target):
+                    _remove(target)
+                    os.mkdir(target)
+                directories.append((target, status))
+                continue
+            # Into a new name first, so the tree never holds a half-written file.
+            partial = os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.stage")
+            _remove(partial)
+            _copy_entry(source, partial, status)
+            _copy_attributes(partial, status)
+            if os.path.isdir(target) and not os.path.islink(target):
+                shutil.rmtree(target)
+            os.replace(partial, target)
+        for target, status in reversed(directories):
+            _copy_attributes(target, status)
+        self._touch(key)
+
+    def evict(self, keep=None):
+        """Remove the least recently used stages until the cache fits its budget; returns the bytes used.
+
+        Works from the sizes store() recorded, without walking the cache.
+        """
+        # Left behind by a store() that was interrupted.
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                _remove(os.path.join(self.directory, name))
+        stages = self.stages()
+        for key, meta in stages:
+            if "bytes" not in meta:
+                # Stored before sizes were recorded; measured once.
+                meta.update(bytes=_disk_usage(self._path(key)), previous=None, linked_bytes=0)
+                self._write_meta(key, meta)
+        used = sum(meta["bytes"] for _key, meta in stages)
+        for key, meta in stages:
+            if used <= self.budget:
+                break
+            if key == keep:
+                continue
+            _remove(self._path(key))
+            used -= meta["bytes"]
+            # Files the stages after it linked stay on disk, now theirs alone.
+            for other_key, other in stages:
+                if other.get("previous") == key and other_key in self:
+                    other["bytes"] += other["linked_bytes"]
+                    used += other["linked_bytes"]
+                    other.update(previous=None, linked_bytes=0)
+                    self._write_meta(other_key, other)
+        return used
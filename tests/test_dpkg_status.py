@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from dpkg_status import DPKG_STATUS_PATH, read_installed_kernels
+
+STATUS = b"""Package: linux-image-6.8.0-31-generic
+Status: install ok installed
+Priority: optional
+Section: kernel
+Installed-Size: 14012
+Architecture: amd64
+Version: 6.8.0-31.31
+
+Package: bash
+Status: install ok installed
+Architecture: amd64
+Version: 5.2.21-2ubuntu4
+
+Package: linux-image-6.5.0-9-generic
+Status: deinstall ok config-files
+Architecture: amd64
+Version: 6.5.0-9.9
+
+Package: linux-image-generic
+Status: install ok installed
+Architecture: amd64
+Version: 6.8.0-31.31
+"""
+
+
+def _unpacked_root(path):
+    # What unsquashfs leaves in root_fs/: the live system's own dpkg database.
+    status_path = os.path.join(path, DPKG_STATUS_PATH)
+    os.makedirs(os.path.dirname(status_path))
+    with open(status_path, "wb") as status_file:
+        status_file.write(STATUS)
+    return str(path)
+
+
+def test_reads_kernels_from_unpacked_root(tmp_path):
+    kernels = read_installed_kernels(_unpacked_root(tmp_path / "root_fs"))
+    assert [kernel['name'] for kernel in kernels] == ["linux-image-6.8.0-31-generic", "linux-image-generic"]
+    assert kernels[0]['version'] == "6.8.0-31.31"
+    assert kernels[0]['installed_size'] == 14012 * 1024
+
+
+def test_iso_tree_has_no_dpkg_database(tmp_path):
+    # The ISO tree around the live root only holds boot files.
+    iso_tree = tmp_path / "extracted_iso"
+    (iso_tree / "casper").mkdir(parents=True)
+    with pytest.raises(FileNotFoundError):
+        read_installed_kernels(str(iso_tree))
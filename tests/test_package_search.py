@@ -0,0 +1,34 @@
+from package_search import PackageSearchIndex
+
+PACKAGES = [
+    {'name': "bash", 'version': "5.2.21-2ubuntu4", 'section': "shells", 'priority': "required",
+     'architecture': "amd64", 'installed_size': 1664 * 1024},
+    {'name': "bash-completion", 'version': "1:2.11-8", 'section': "shells", 'priority': "important",
+     'architecture': "all", 'installed_size': 1456 * 1024},
+    {'name': "libc6", 'version': "2.39-0ubuntu8", 'section': "libs", 'priority': "required",
+     'architecture': "amd64", 'installed_size': 13620 * 1024},
+    {'name': "libc6-dev", 'version': "2.39-0ubuntu8", 'section': "libdevel", 'priority': "optional",
+     'architecture': "amd64", 'installed_size': 11 * 2**20},
+]
+
+
+def _index():
+    index = PackageSearchIndex()
+    for pkg in PACKAGES:
+        index.add(pkg)
+    return index
+
+
+def test_query_terms_narrow_each_other():
+    index = _index()
+    assert index.query("bash") == {0, 1}
+    assert index.query("bas") == {0, 1}
+    assert index.query("ubuntu !priority:required") == {3}
+    assert index.query("libc6 size>12M") == {2}
+
+
+def test_query_within_candidates():
+    # The rows matching a shorter query are enough to answer a longer one.
+    index = _index()
+    assert index.query("libc6-", candidates=index.query("libc")) == {3}
+    assert index.query("!arch:all", candidates={0, 1}) == {0}
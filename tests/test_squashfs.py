@@ -0,0 +1,26 @@
+import os
+
+from squashfs import replace_tree, staging_path
+
+
+def test_replace_tree_drops_files_of_the_previous_tree(tmp_path):
+    root = str(tmp_path / "root_fs")
+    os.makedirs(os.path.join(root, "etc"))
+    with open(os.path.join(root, "etc", "left-by-last-build"), "w") as stale_file:
+        stale_file.write("stale")
+    staging = staging_path(root)
+    os.makedirs(os.path.join(staging, "etc"))
+    with open(os.path.join(staging, "etc", "hostname"), "w") as hostname_file:
+        hostname_file.write("live\n")
+
+    replace_tree(staging, root)
+
+    assert os.listdir(os.path.join(root, "etc")) == ["hostname"]
+    assert sorted(os.listdir(tmp_path)) == ["root_fs"]
+
+
+def test_replace_tree_without_a_previous_tree(tmp_path):
+    root = str(tmp_path / "root_fs")
+    os.makedirs(staging_path(root))
+    replace_tree(staging_path(root), root)
+    assert os.path.isdir(root) and not os.path.exists(staging_path(root))
@@ -1,54 +1,398 @@
+import codecs
+import os
+import selectors
+import signal
 import subprocess
-from PyQt6.QtCore import QThread, pyqtSignal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PyQt6.QtCore import QObject, QThread, pyqtSignal
+
+from chroot_env import ChrootEnvironmentError
+from chroot_session import ChrootSessionError
+
+
+def format_exit_status(return_code, wall_time=None):
+    """Describe how a command ended, e.g. "exit status 1 after 2m 05s"."""
+    if return_code is None or return_code == -1:
+        # -1 is what CommandRunnerThread reports when the command could not run.
+        status = "failed to run"
+    elif return_code < 0:
+        try:
+            status = f"killed by {signal.Signals(-return_code).name}"
+        except ValueError:
+            status = f"killed by signal {-return_code}"
+    else:
+        status = f"exit status {return_code}"
+    if wall_time is None:
+        return status
+    minutes, seconds = divmod(wall_time, 60)
+    if minutes:
+        return f"{status} after {int(minutes)}m {seconds:04.1f}s"
+    return f"{status} after {seconds:.1f}s"
+
 
 class CommandRunnerThread(QThread):
+    """Runs a command (optionally inside a chroot) and streams its output.
+
+    stdout and stderr are drained together through a selector, so neither
+    pipe can fill up and stall the command. Output is not emitted line by
+    line: it is collected in a bounded buffer and flushed as one
+    command_output_signal every FLUSH_INTERVAL seconds or FLUSH_BYTES bytes,
+    whichever comes first.
+
+    The command runs in its own session; stop_thread() sends SIGTERM to the
+    whole process group and SIGKILL after KILL_TIMEOUT seconds.
+    """
     command_output_signal = pyqtSignal(str)
     command_finished_signal = pyqtSignal(int)
+    # (return code, wall time in seconds), emitted just before command_finished_signal.
+    command_completed_signal = pyqtSignal(int, float)
+    # Emitted after each output batch. It is queued behind the batch, so its
+    # slot runs on the GUI thread once the batch has been handled.
+    _batch_delivered = pyqtSignal()
+
+    FLUSH_INTERVAL = 0.05
+    FLUSH_BYTES = 64 * 1024
+    # Batches emitted but not yet handled by the GUI. When the GUI falls this
+    # far behind, reading stops until it catches up; the pipes fill and the
+    # command blocks instead of output piling up in memory.
+    MAX_PENDING_BATCHES = 4
+    KILL_TIMEOUT = 5.0
+    # How often the reader wakes up to notice stop_thread() while idle.
+    POLL_INTERVAL = 0.25
 
-    def __init__(self, command, working_dir=None, chroot_path=None, is_dpkg_command=False):
+    def __init__(self, command, working_dir=None, chroot_path=None, is_dpkg_command=False, chroot_env=None):
         super().__init__()
         self.command = command
         self.working_dir = working_dir
         self.chroot_path = chroot_path
+        # Optional ChrootEnvironment held while a chroot command runs.
+        self.chroot_env = chroot_env if chroot_path else None
         self.is_running = True
         self.is_dpkg_command = is_dpkg_command
+        self.return_code = None
+        self.wall_time = None
+        self._pending_output = []
+        self._pending_bytes = 0
+        self._flush_at = None
+        self._batch_slots = threading.Semaphore(self.MAX_PENDING_BATCHES)
+        self._batch_delivered.connect(self._release_batch_slot)
 
     def run(self):
         process = None
+        env_held = False
+        started = time.monotonic()
         try:
             if self.chroot_path:
-                # ...existing code for chroot handling...
-                final_command = self.command  # placeholder
+                if isinstance(self.command, str):
+                    command_list = self.command.split()
+                else:
+                    command_list = self.command
+
+                if self.is_dpkg_command:
+                    final_command = ["chroot", self.chroot_path] + command_list
+                else:
+                    final_command = ["chroot", self.chroot_path] + ["/bin/bash", "-c"] + [' '.join(command_list)]
             else:
-                # ...existing code...
                 final_command = self.command
 
             if isinstance(final_command, str):
                 final_command = final_command.split()
 
+            if self.chroot_env is not None:
+                self.chroot_env.acquire()
+                env_held = True
+                final_command = self.chroot_env.wrap(final_command)
+
             process = subprocess.Popen(final_command,
+                                       stdin=subprocess.DEVNULL,
                                        stdout=subprocess.PIPE,
                                        stderr=subprocess.PIPE,
-                                       text=True,
                                        cwd=self.working_dir,
-                                       bufsize=1,
-                                       universal_newlines=True)
-            while self.is_running:
-                # ...existing code to read output...
-                break  # placeholder loop exit
-
-            stdout, stderr = process.communicate()
-            if stdout:
-                self.command_output_signal.emit(stdout)
-            if stderr:
-                self.command_output_signal.emit(stderr)
-            self.command_finished_signal.emit(process.returncode)
+                                       start_new_session=True)
+            try:
+                self._stream_output(process)
+            finally:
+                process.stdout.close()
+                process.stderr.close()
+            self._finish(process.wait(), started)
+
         except FileNotFoundError as e:
             self.command_output_signal.emit(f"Error: Command not found: {e}\n")
-            self.command_finished_signal.emit(-1)
+            self._finish(-1, started)
+
         except Exception as e:
+            if process is not None and process.poll() is None:
+                self._signal_group(process, signal.SIGKILL)
+                process.wait()
             self.command_output_signal.emit(f"Error executing command: {e}\n")
-            self.command_finished_signal.emit(-1)
+            self._finish(-1, started)
+
+        finally:
+            if env_held:
+                self.chroot_env.release()
+
+    def _finish(self, return_code, started):
+        self.return_code = return_code
+        self.wall_time = time.monotonic() - started
+        self.command_completed_signal.emit(return_code, self.wall_time)
+        self.command_finished_signal.emit(return_code)
+
+    @staticmethod
+    def _signal_group(process, sig):
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _stream_output(self, process):
+        # Read whatever is available on either pipe, up to FLUSH_BYTES at a
+        # time, and flush when the buffer is full or the oldest pending
+        # output is due.
+        decoders = {
+            process.stdout.fileno(): codecs.getincrementaldecoder("utf-8")("replace"),
+            process.stderr.fileno(): codecs.getincrementaldecoder("utf-8")("replace"),
+        }
+        kill_at = None
+        killed = False
+        with selectors.DefaultSelector() as selector:
+            for fd in decoders:
+                selector.register(fd, selectors.EVENT_READ)
+            while selector.get_map():
+                now = time.monotonic()
+                if not self.is_running:
+                    if kill_at is None:
+                        self._signal_group(process, signal.SIGTERM)
+                        kill_at = now + self.KILL_TIMEOUT
+                    elif not killed and now >= kill_at:
+                        self._signal_group(process, signal.SIGKILL)
+                        killed = True
+                    elif killed and process.poll() is not None:
+                        # Something that left the process group still holds
+                        # the pipes open; stop waiting for it.
+                        break
+
+                timeout = self.POLL_INTERVAL
+                if self._flush_at is not None:
+                    timeout = min(timeout, max(0.0, self._flush_at - now))
+                if kill_at is not None and not killed:
+                    timeout = min(timeout, max(0.0, kill_at - now))
+                for key, _events in selector.select(timeout):
+                    data = os.read(key.fd, self.FLUSH_BYTES)
+                    if data:
+                        self._queue_output(decoders[key.fd].decode(data))
+                    else:
+                        selector.unregister(key.fd)
+                        self._queue_output(decoders[key.fd].decode(b"", final=True))
+                self._flush_output_if_due()
+        self._flush_output()
+
+    def _queue_output(self, text):
+        if not text:
+            return
+        if self._flush_at is None:
+            self._flush_at = time.monotonic() + self.FLUSH_INTERVAL
+        self._pending_output.append(text)
+        self._pending_bytes += len(text)
+        if self._pending_bytes >= self.FLUSH_BYTES:
+            self._flush_output()
+
+    def _flush_output_if_due(self):
+        if self._flush_at is not None and time.monotonic() >= self._flush_at:
+            self._flush_output()
+
+    def _flush_output(self):
+        text = "".join(self._pending_output)
+        self._pending_output = []
+        self._pending_bytes = 0
+        self._flush_at = None
+        self._emit_batch(text)
+
+    def _emit_batch(self, text):
+        if not text:
+            return
+        while not self._batch_slots.acquire(timeout=0.1):
+            if not self.is_running:
+                break
+        self.command_output_signal.emit(text)
+        self._batch_delivered.emit()
+
+    def _release_batch_slot(self):
+        self._batch_slots.release()
 
     def stop_thread(self):
+        """Cancel the command: SIGTERM to its process group, then SIGKILL."""
         self.is_running = False
+
+
+class SessionCommandThread(CommandRunnerThread):
+    """Runs one command in a persistent ChrootSession.
+
+    Has the same signals, output batching and stop_thread() as
+    CommandRunnerThread, but the shell (and its cwd and variables) outlives
+    the command. stop_thread() interrupts the command like Ctrl+C.
+    """
+
+    def __init__(self, session, command):
+        super().__init__(command, chroot_path=session.root)
+        self.session = session
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            return_code = self.session.run(self.command, self._queue_output, self._poll)
+        except (OSError, ChrootSessionError, ChrootEnvironmentError) as e:
+            self._queue_output(f"Error executing command: {e}\n")
+            return_code = -1
+        self._flush_output()
+        self._finish(return_code, started)
+
+    def _poll(self):
+        self._flush_output_if_due()
+        return self.is_running
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+def run_subprocess(command, cancel_event=None, check=True, poll_interval=0.1):
+    """subprocess.run() for executor tasks: kills the process on cancellation.
+
+    Returns a CompletedProcess with text output; raises TaskCancelled if
+    `cancel_event` gets set and CalledProcessError on failure when `check`.
+    """
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=poll_interval)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel_event is not None and cancel_event.is_set():
+                process.kill()
+                process.communicate()
+                raise TaskCancelled(f"{command[0]} cancelled")
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+class TaskFuture(QObject):
+    """Handle to a task running on a BackgroundExecutor.
+
+    Exactly one of finished(result), failed(exception) or cancelled() is
+    emitted, always on the GUI thread. A result that arrives after cancel()
+    is handed to discarded(result) instead, so its owner can release it.
+    """
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    discarded = pyqtSignal(object)
+    done = pyqtSignal()
+    # Carries (result, exception) from the worker thread to the GUI thread.
+    _completed = pyqtSignal(object, object)
+
+    def __init__(self, description="", parent=None, cancellable=False):
+        super().__init__(parent)
+        self.description = description
+        self.cancellable = cancellable
+        self.cancel_event = threading.Event()
+        self._future = None
+        self._completed.connect(self._deliver)
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self._future is not None:
+            self._future.cancel()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def _deliver(self, result, error):
+        if self.cancel_event.is_set() or isinstance(error, TaskCancelled):
+            self.cancelled.emit()
+            if error is None:
+                self.discarded.emit(result)
+        elif error is not None:
+            self.failed.emit(error)
+        else:
+            self.finished.emit(result)
+        self.done.emit()
+
+
+class BackgroundExecutor(QObject):
+    """Shared thread pool for blocking work started from the GUI.
+
+    submit() returns a TaskFuture whose signals arrive on the GUI thread.
+    busy_changed/tasks_changed let a BusyIndicator show what is running.
+    """
+    busy_changed = pyqtSignal(bool)
+    tasks_changed = pyqtSignal(list)
+
+    def __init__(self, max_workers=None, parent=None):
+        super().__init__(parent)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1),
+                                        thread_name_prefix="masterlinux-task")
+        self._tasks = []
+
+    def submit(self, fn, *args, description="", cancellable=False, **kwargs):
+        """Run fn(*args, **kwargs) on the pool.
+
+        With cancellable=True the task's threading.Event is passed to `fn` as
+        `cancel_event` so it can stop early.
+        """
+        task = TaskFuture(description, self, cancellable)
+        if cancellable:
+            kwargs["cancel_event"] = task.cancel_event
+        task.done.connect(lambda: self._forget(task))
+        self._tasks.append(task)
+        if len(self._tasks) == 1:
+            self.busy_changed.emit(True)
+        self.tasks_changed.emit(self.descriptions())
+
+        def run():
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                task._completed.emit(None, e)
+            else:
+                task._completed.emit(result, None)
+
+        task._future = self._pool.submit(run)
+        # A task cancelled before it started never runs `run`.
+        task._future.add_done_callback(lambda future: future.cancelled() and task._completed.emit(None, TaskCancelled()))
+        return task
+
+    def _forget(self, task):
+        if task in self._tasks:
+            self._tasks.remove(task)
+            self.tasks_changed.emit(self.descriptions())
+            if not self._tasks:
+                self.busy_changed.emit(False)
+        task.deleteLater()
+
+    def descriptions(self):
+        return [task.description for task in self._tasks if task.description]
+
+    def is_busy(self):
+        return bool(self._tasks)
+
+    def has_cancellable(self):
+        """True while a task that cancel_all() would stop is running."""
+        return any(task.cancellable for task in self._tasks)
+
+    def cancel_all(self):
+        """Cancel the tasks submitted with cancellable=True.
+
+        The others are pipeline steps whose callers expect a result; they
+        are left to finish.
+        """
+        for task in list(self._tasks):
+            if task.cancellable:
+                task.cancel()
+
+    def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
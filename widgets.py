@@ -1,5 +1,13 @@
-from PyQt6.QtWidgets import QLabel, QStyledItemDelegate, QCheckBox
-from PyQt6.QtCore import Qt
+import bisect
+import mmap
+import re
+import tempfile
+from array import array
+
+from PyQt6.QtWidgets import QLabel, QStyledItemDelegate, QCheckBox, QWidget, QHBoxLayout, QProgressBar, QPushButton
+from PyQt6.QtWidgets import QAbstractScrollArea, QApplication, QLineEdit
+from PyQt6.QtGui import QKeySequence, QPainter
+from PyQt6.QtCore import Qt, QEvent
 
 # Custom label that handles elided text.
 class ElidedLabel(QLabel):
@@ -41,3 +49,228 @@ class CenteredIconDelegate(QStyledItemDelegate):
             opt.style().drawControl(opt.style().ControlElement.CE_CheckBox, opt, painter)
         else:
             super().paint(painter, option, index)
+
+# Indeterminate progress bar with a Cancel button, shown while a
+# BackgroundExecutor has tasks in flight.
+class BusyIndicator(QWidget):
+    def __init__(self, executor, parent=None):
+        super().__init__(parent)
+        self.executor = executor
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.label = ElidedLabel("")
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setMaximumWidth(120)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(executor.cancel_all)
+        layout.addWidget(self.label, 1)
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.cancel_button)
+        executor.busy_changed.connect(self.setVisible)
+        executor.tasks_changed.connect(self.update_tasks)
+        self.setVisible(executor.is_busy())
+        self.cancel_button.setVisible(executor.has_cancellable())
+
+    def update_tasks(self, descriptions):
+        self.label.setText(", ".join(descriptions) + "..." if descriptions else "Working...")
+        # Package reads, ISO queries and pipeline steps run to completion.
+        self.cancel_button.setVisible(self.executor.has_cancellable())
+
+# Read-only log pane backed by a file rather than a QTextDocument. Output is
+# appended to the file (an anonymous temporary file unless log_path is given)
+# and only the line start offsets are kept in memory; painting reads the
+# visible lines back through an mmap. Stays at the bottom while the
+# scrollbar is there, and Ctrl+F / F3 search the whole log.
+class LogView(QAbstractScrollArea):
+    MARGIN = 4
+
+    def __init__(self, parent=None, log_path=None):
+        super().__init__(parent)
+        if log_path:
+            self._file = open(log_path, "w+b")
+        else:
+            self._file = tempfile.TemporaryFile(prefix="masterlinux-log-")
+        self._buf = None
+        self._size = 0
+        self._line_starts = array('Q', [0])
+        self._longest_line = 0
+        self._match = None
+        self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+
+        self.search_edit = QLineEdit(self)
+        self.search_edit.setPlaceholderText("Find (Enter: next, Shift+Enter: previous)")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.returnPressed.connect(self.find_next)
+        self.search_edit.installEventFilter(self)
+        self.search_edit.hide()
+
+    def append_text(self, text):
+        if not text:
+            return
+        data = text.encode("utf-8", "replace")
+        scrollbar = self.verticalScrollBar()
+        at_end = scrollbar.value() >= scrollbar.maximum()
+        self._file.seek(self._size)
+        self._file.write(data)
+        self._file.flush()
+        start = self._size
+        self._size += len(data)
+        pos = data.find(b"\n")
+        while pos != -1:
+            line_start = start + pos + 1
+            self._longest_line = max(self._longest_line, line_start - self._line_starts[-1])
+            self._line_starts.append(line_start)
+            pos = data.find(b"\n", pos + 1)
+        self._longest_line = max(self._longest_line, self._size - self._line_starts[-1])
+        self._update_scrollbars()
+        if at_end:
+            scrollbar.setValue(scrollbar.maximum())
+        self.viewport().update()
+
+    def set_text(self, text):
+        self.clear()
+        self.append_text(text)
+
+    def clear(self):
+        if self._buf is not None:
+            self._buf.close()
+            self._buf = None
+        self._file.truncate(0)
+        self._size = 0
+        self._line_starts = array('Q', [0])
+        self._longest_line = 0
+        self._match = None
+        self._update_scrollbars()
+        self.viewport().update()
+
+    def line_count(self):
+        # A trailing newline does not start a visible line.
+        return len(self._line_starts) - (self._line_starts[-1] == self._size)
+
+    def line_text(self, line):
+        buf = self._mapped()
+        end = self._line_starts[line + 1] if line + 1 < len(self._line_starts) else self._size
+        data = buf[self._line_starts[line]:end].rstrip(b"\r\n")
+        # Progress meters redraw their line with \r; show the last state.
+        return data.rsplit(b"\r", 1)[-1].decode("utf-8", "replace").expandtabs()
+
+    def _mapped(self):
+        # The file only grows between clears, so remap once it outgrew the map.
+        if self._size and (self._buf is None or len(self._buf) < self._size):
+            if self._buf is not None:
+                self._buf.close()
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._buf
+
+    def _visible_lines(self):
+        return max(1, self.viewport().height() // self.fontMetrics().lineSpacing())
+
+    def _update_scrollbars(self):
+        visible = self._visible_lines()
+        vertical = self.verticalScrollBar()
+        vertical.setRange(0, max(0, self.line_count() - visible))
+        vertical.setPageStep(visible)
+        width = self.viewport().width()
+        content_width = self._longest_line * self.fontMetrics().averageCharWidth() + 2 * self.MARGIN
+        horizontal = self.horizontalScrollBar()
+        horizontal.setRange(0, max(0, content_width - width))
+        horizontal.setPageStep(width)
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        metrics = self.fontMetrics()
+        line_height = metrics.lineSpacing()
+        first = self.verticalScrollBar().value()
+        last = min(self.line_count(), first + self._visible_lines() + 1)
+        x = self.MARGIN - self.horizontalScrollBar().value()
+        match_line = self._line_of(self._match[0]) if self._match else -1
+        palette = self.palette()
+        for i, line in enumerate(range(first, last)):
+            y = i * line_height
+            if line == match_line:
+                painter.fillRect(0, y, self.viewport().width(), line_height, palette.color(palette.ColorRole.Highlight))
+                painter.setPen(palette.color(palette.ColorRole.HighlightedText))
+            else:
+                painter.setPen(palette.color(palette.ColorRole.Text))
+            painter.drawText(x, y + metrics.ascent(), self.line_text(line))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        scrollbar = self.verticalScrollBar()
+        at_end = scrollbar.value() >= scrollbar.maximum()
+        self._update_scrollbars()
+        if at_end:
+            scrollbar.setValue(scrollbar.maximum())
+        self._place_search_edit()
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.Type.FontChange:
+            self._update_scrollbars()
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def _line_of(self, offset):
+        return bisect.bisect_right(self._line_starts, offset) - 1
+
+    def _place_search_edit(self):
+        width = min(320, self.viewport().width())
+        self.search_edit.setGeometry(self.viewport().width() - width, 0, width, self.search_edit.sizeHint().height())
+
+    def show_search(self):
+        self._place_search_edit()
+        self.search_edit.show()
+        self.search_edit.setFocus()
+        self.search_edit.selectAll()
+
+    def find(self, text, backward=False):
+        """Select the next (or previous) case-insensitive match of `text`, wrapping around."""
+        buf = self._mapped()
+        if not text or buf is None:
+            return False
+        pattern = re.compile(re.escape(text.encode("utf-8")), re.IGNORECASE)
+        if backward:
+            end = self._match[0] if self._match else self._size
+            found = None
+            for found in pattern.finditer(buf, 0, end):
+                pass
+            if found is None:
+                for found in pattern.finditer(buf, end, self._size):
+                    pass
+        else:
+            start = self._match[1] if self._match else self._line_starts[self.verticalScrollBar().value()]
+            found = pattern.search(buf, start, self._size) or pattern.search(buf, 0, start)
+        if found is None:
+            return False
+        self._match = found.span()
+        line = self._line_of(self._match[0])
+        self.verticalScrollBar().setValue(line - self._visible_lines() // 2)
+        self.viewport().update()
+        return True
+
+    def find_next(self):
+        backward = QApplication.keyboardModifiers() & Qt.KeyboardModifier.ShiftModifier
+        return self.find(self.search_edit.text(), backward=bool(backward))
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.StandardKey.Find):
+            self.show_search()
+        elif event.key() == Qt.Key.Key_F3:
+            self.find(self.search_edit.text(), backward=bool(event.modifiers() & Qt.KeyboardModifier.ShiftModifier))
+        elif event.key() == Qt.Key.Key_Home and event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            self.verticalScrollBar().setValue(0)
+        elif event.key() == Qt.Key.Key_End and event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
+        else:
+            super().keyPressEvent(event)
+
+    def eventFilter(self, obj, event):
+        if obj is self.search_edit and event.type() == QEvent.Type.KeyPress and event.key() == Qt.Key.Key_Escape:
+            self.search_edit.hide()
+            self._match = None
+            self.viewport().update()
+            self.setFocus()
+            return True
+        return super().eventFilter(obj, event)